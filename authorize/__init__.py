@@ -37,6 +37,6 @@ test
 """
 
 from authorize.client import AuthorizeClient
-from authorize.data import Address, CreditCard, BankAccount
+from authorize.data import Address, CreditCard, BankAccount, Money
 from authorize.exceptions import AuthorizeConnectionError, AuthorizeError, \
     AuthorizeInvalidError, AuthorizeResponseError
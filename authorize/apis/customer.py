@@ -1,52 +1,140 @@
-from decimal import Decimal
+import httplib
+import threading
 import urllib
 
-from suds import WebFault
-from suds.client import Client
-
-from authorize.apis.transaction import parse_response
+from authorize.apis.templates import MARSHALLERS, SERVICES, SoapFault, \
+    SoapTemplates
+from authorize.apis.transaction import DELIMITER, ENCAPSULATOR, \
+    parse_response
+from authorize.data import format_amount
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeResponseError
+from authorize.instrument import measure
+from authorize.pool import ConnectionPool
+from authorize.process import PerProcess
 
 
 PROD_URL = 'https://api.authorize.net/soap/v1/Service.asmx?WSDL'
 TEST_URL = 'https://apitest.authorize.net/soap/v1/Service.asmx?WSDL'
+PROFILE_TRANSACTION_TYPES = {
+    'profileTransAuthOnly': 'ProfileTransAuthOnlyType',
+    'profileTransAuthCapture': 'ProfileTransAuthCaptureType',
+    'profileTransRefund': 'ProfileTransRefundType',
+}
 
-class CustomerAPI(object):
-    def __init__(self, login_id, transaction_key, debug=True, test=False):
+class CustomerAPI(PerProcess):
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            pool=None, marshaller='suds', instrumentation=None):
         self.url = TEST_URL if debug else PROD_URL
+        # Keep-alive connections, shared with the other APIs by the client
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.instrumentation = instrumentation
         self.login_id = login_id
         self.transaction_key = transaction_key
+        self._prototypes = {}
+        self._reset()
+        if marshaller not in MARSHALLERS:
+            raise ValueError('Unknown SOAP marshaller {0!r}.'.format(
+                marshaller))
+        # Charges to saved payments can skip suds entirely
+        self.templates = None
+        if marshaller == 'templates':
+            self.templates = SoapTemplates(self.url, self.pool, login_id,
+                transaction_key)
         self.transaction_options = urllib.urlencode({
             'x_version': '3.1',
             'x_test_request': 'Y' if test else 'F',
             'x_delim_data': 'TRUE',
-            'x_delim_char': ';',
+            'x_delim_char': DELIMITER,
+            'x_encap_char': ENCAPSULATOR,
         })
 
+    def _reset(self):
+        # A forked child sets up its own credentials. The service client is
+        # kept, so that children share the parsed definition with the parent
+        # copy-on-write.
+        PerProcess._reset(self)
+        self._lock = threading.RLock()
+        self.__dict__.pop('_client_auth', None)
+
+    @property
+    def clients(self):
+        # Calls are made on clients checked out from here, so that threads
+        # sharing this instance never share a suds client. suds is slow to
+        # import, so it is only imported once the SOAP API is first used.
+        self._check_fork()
+        if not hasattr(self, '_clients'):
+            with self._lock:
+                if not hasattr(self, '_clients'):
+                    from authorize.apis.soap import ClientPool
+                    self._clients = ClientPool(self.url, self.pool)
+        return self._clients
+
     @property
     def client(self):
-        # Lazy instantiation of SOAP client, which hits the WSDL url
-        if not hasattr(self, '_client'):
-            self._client = Client(self.url)
+        # Lazy instantiation of the SOAP client used to build request types,
+        # which hits the WSDL url the first time any API in this process
+        # needs it. Checked again under the lock, as threads may race here.
+        # If the definition is replaced, such as by revalidating the WSDL,
+        # the client and the types built with it are made again.
+        from authorize.apis.soap import service_generation
+        self._check_fork()
+        generation = service_generation()
+        if getattr(self, '_client_generation', None) != generation:
+            with self._lock:
+                if getattr(self, '_client_generation', None) != generation:
+                    self._client = self.clients.create()
+                    self._prototypes = {}
+                    self.__dict__.pop('_client_auth', None)
+                    self._client_generation = generation
         return self._client
 
     @property
     def client_auth(self):
+        # Getting the client first drops credentials built for an older one
+        self.client
         if not hasattr(self, '_client_auth'):
-            self._client_auth = self.client.factory.create(
-                'MerchantAuthenticationType')
-            self._client_auth.name = self.login_id
-            self._client_auth.transactionKey = self.transaction_key
+            with self._lock:
+                if not hasattr(self, '_client_auth'):
+                    client_auth = self.client.factory.create(
+                        'MerchantAuthenticationType')
+                    client_auth.name = self.login_id
+                    client_auth.transactionKey = self.transaction_key
+                    self._client_auth = client_auth
         return self._client_auth
 
+    def _create(self, kind):
+        # Building a type walks the schema, so each kind is built once and
+        # the copy kept is cloned for every request after that
+        from authorize.apis.soap import clone
+        client = self.client
+        prototype = self._prototypes.get(kind)
+        if prototype is None:
+            prototype = self._prototypes[kind] = client.factory.create(kind)
+        return clone(prototype)
+
     def _make_call(self, service, *args):
         # Provides standard API call error handling
-        method = getattr(self.client.service, service)
-        try:
-            response = method(self.client_auth, *args)
-        except WebFault as e:
-            raise AuthorizeConnectionError('Error contacting SOAP API.')
+        from suds import WebFault
+        client_auth = self.client_auth
+        with measure(self.instrumentation, 'customer', service):
+            try:
+                with self.clients.checkout() as client:
+                    response = client.method(service)(client_auth, *args)
+            except (WebFault, IOError, httplib.HTTPException) as e:
+                raise AuthorizeConnectionError('Error contacting SOAP API.')
+            return self._check_response(response)
+
+    def _render_call(self, operation, *args):
+        # The same, for calls rendered from templates instead of by suds
+        with measure(self.instrumentation, 'customer', SERVICES[operation]):
+            try:
+                response = getattr(self.templates, operation)(*args)
+            except (SoapFault, IOError, httplib.HTTPException) as e:
+                raise AuthorizeConnectionError('Error contacting SOAP API.')
+            return self._check_response(response)
+
+    def _check_response(self, response):
         if response.resultCode != 'Ok':
             error = response.messages[0][0]
             e = AuthorizeResponseError('%s: %s' % (error.code, error.text))
@@ -57,6 +145,23 @@ class CustomerAPI(object):
             raise e
         return response
 
+    def _profile_transaction(self, kind, profile_id, payment_id, amount):
+        amount = format_amount(amount)
+        if self.templates is not None:
+            response = self._render_call('profile_transaction', kind,
+                profile_id, payment_id, amount, self.transaction_options)
+        else:
+            transaction = self._create('ProfileTransactionType')
+            details = self._create(
+                PROFILE_TRANSACTION_TYPES[kind])
+            details.amount = amount
+            details.customerProfileId = profile_id
+            details.customerPaymentProfileId = payment_id
+            setattr(transaction, kind, details)
+            response = self._make_call('CreateCustomerProfileTransaction',
+                transaction, self.transaction_options)
+        return parse_response(response.directResponse)
+
     def create_saved_profile(self, internal_id, payments=None):
         """
         Creates a user profile to which you can attach saved payments.
@@ -65,10 +170,10 @@ class CustomerAPI(object):
         these will be automatically added to the user profile. Returns the
         user profile id.
         """
-        profile = self.client.factory.create('CustomerProfileType')
+        profile = self._create('CustomerProfileType')
         profile.merchantCustomerId = internal_id
         if payments:
-            payment_array = self.client.factory.create(
+            payment_array = self._create(
                 'ArrayOfCustomerPaymentProfileType')
             payment_array.CustomerPaymentProfileType = payments
             profile.paymentProfiles = payment_array
@@ -90,27 +195,27 @@ class CustomerAPI(object):
         assert (credit_card or bank_account) is not None
 
         # Create the basic payment profile with credit card details
-        payment_profile = self.client.factory.create(
+        payment_profile = self._create(
             'CustomerPaymentProfileType')
-        customer_type_enum = self.client.factory.create('CustomerTypeEnum')
+        customer_type_enum = self._create('CustomerTypeEnum')
         payment_profile.customerType = customer_type_enum.individual
-        payment_type = self.client.factory.create('PaymentType')
+        payment_type = self._create('PaymentType')
         if credit_card is not None:
-            credit_card_type = self.client.factory.create('CreditCardType')
+            credit_card_type = self._create('CreditCardType')
             credit_card_type.cardNumber = credit_card.card_number
             credit_card_type.expirationDate = '{0.exp_year}-{0.exp_month:0>2}' \
                 .format(credit_card)
             credit_card_type.cardCode = credit_card.cvv
             payment_type.creditCard = credit_card_type
         elif bank_account is not None:
-            bank_account_type = self.client.factory.create('BankAccountType')
-            bank_account_type_enum = self.client.factory.create(
+            bank_account_type = self._create('BankAccountType')
+            bank_account_type_enum = self._create(
                 'BankAccountTypeEnum')
             bank_account_type.accountType = getattr(
                 bank_account_type_enum, str(bank_account.account_type))
             bank_account_type.nameOnAccount = '{0} {1}'.format(
                 bank_account.first_name, bank_account.last_name)
-            echeck_type_enum = self.client.factory.create('EcheckTypeEnum')
+            echeck_type_enum = self._create('EcheckTypeEnum')
             bank_account_type.echeckType = getattr(
                 echeck_type_enum, str(bank_account.echeck_type))
             bank_account_type.bankName = bank_account.bank_name
@@ -160,38 +265,14 @@ class CustomerAPI(object):
             profile_id, payment_id)
 
     def auth(self, profile_id, payment_id, amount):
-        transaction = self.client.factory.create('ProfileTransactionType')
-        auth = self.client.factory.create('ProfileTransAuthOnlyType')
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        auth.amount = str(amount)
-        auth.customerProfileId = profile_id
-        auth.customerPaymentProfileId = payment_id
-        transaction.profileTransAuthOnly = auth
-        response = self._make_call('CreateCustomerProfileTransaction',
-            transaction, self.transaction_options)
-        return parse_response(response.directResponse)
+        return self._profile_transaction('profileTransAuthOnly', profile_id,
+            payment_id, amount)
 
     def capture(self, profile_id, payment_id, amount):
-        transaction = self.client.factory.create('ProfileTransactionType')
-        capture = self.client.factory.create('ProfileTransAuthCaptureType')
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        capture.amount = str(amount)
-        capture.customerProfileId = profile_id
-        capture.customerPaymentProfileId = payment_id
-        transaction.profileTransAuthCapture = capture
-        response = self._make_call('CreateCustomerProfileTransaction',
-            transaction, self.transaction_options)
-        return parse_response(response.directResponse)
+        return self._profile_transaction('profileTransAuthCapture',
+            profile_id, payment_id, amount)
 
     def credit(self, profile_id, payment_id, amount):
         # Creates an "unlinked credit" (as opposed to refunding a previous transaction)
-        transaction = self.client.factory.create('ProfileTransactionType')
-        credit = self.client.factory.create('ProfileTransRefundType')
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        credit.amount = str(amount)
-        credit.customerProfileId = profile_id
-        credit.customerPaymentProfileId = payment_id
-        transaction.profileTransRefund = credit
-        response = self._make_call('CreateCustomerProfileTransaction',
-            transaction, self.transaction_options)
-        return parse_response(response.directResponse)
+        return self._profile_transaction('profileTransRefund', profile_id,
+            payment_id, amount)
@@ -0,0 +1,406 @@
+"""
+Implements the basic transaction (AIM), saved payment (CIM) and recurring
+billing (ARB) APIs against the single Authorize.net JSON endpoint, as an
+alternative to the AIM query string API and the two SOAP clients. The
+classes here take the same arguments and return the same results as
+:class:`TransactionAPI <authorize.apis.transaction.TransactionAPI>`,
+:class:`CustomerAPI <authorize.apis.customer.CustomerAPI>` and
+:class:`RecurringAPI <authorize.apis.recurring.RecurringAPI>`.
+
+Every call is a small JSON document posted to the same URL, so all three
+share one set of pooled connections. The endpoint checks that the keys of
+each object come in the element order of the Authorize.net schema, so
+requests are built from ordered dictionaries.
+"""
+
+import codecs
+from collections import OrderedDict
+from datetime import date
+import httplib
+import json
+
+from authorize.apis.recurring import check_subscription
+from authorize.apis.transaction import TransactionResult
+from authorize.data import format_amount
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeInvalidError, AuthorizeResponseError
+from authorize.instrument import measure
+from authorize.pool import ConnectionPool
+
+
+PROD_URL = 'https://api.authorize.net/xml/v1/request.api'
+TEST_URL = 'https://apitest.authorize.net/xml/v1/request.api'
+# Fields of a JSON transaction response, with the names they have in an AIM
+# response
+TRANSACTION_FIELDS = (
+    ('responseCode', 'response_code'),
+    ('authCode', 'authorization_code'),
+    ('avsResultCode', 'avs_response'),
+    ('transId', 'transaction_id'),
+    ('transHash', 'md5_hash'),
+    ('cvvResultCode', 'cvv_response'),
+    ('cavvResultCode', 'cavv_response'),
+    ('accountNumber', 'account_number'),
+    ('accountType', 'card_type'),
+)
+# The AIM name of each transaction type, which AIM responses echo back
+TRANSACTION_TYPES = {
+    'authOnlyTransaction': 'auth_only',
+    'authCaptureTransaction': 'auth_capture',
+    'priorAuthCaptureTransaction': 'prior_auth_capture',
+    'refundTransaction': 'credit',
+    'voidTransaction': 'void',
+}
+TEST_SETTINGS = OrderedDict((
+    ('setting', [OrderedDict((
+        ('settingName', 'testRequest'),
+        ('settingValue', 'true'),
+    ))]),
+))
+
+def loads(body):
+    """
+    Decodes a response body, which Authorize.net starts with a UTF-8 byte
+    order mark that the ``json`` module does not accept.
+    """
+    if body.startswith(codecs.BOM_UTF8):
+        body = body[len(codecs.BOM_UTF8):]
+    return json.loads(body)
+
+def parse_transaction(response, transaction_type, amount=None):
+    """
+    Reads the ``transactionResponse`` of a ``createTransactionRequest`` into
+    a :class:`TransactionResult
+    <authorize.apis.transaction.TransactionResult>`, so that results look the
+    same whichever API made the call.
+    """
+    result = response.get('transactionResponse') or {}
+    fields = dict((name, result[key]) for key, name in TRANSACTION_FIELDS
+        if result.get(key))
+    reasons = result.get('errors') or result.get('messages')
+    if reasons:
+        reason = reasons[0]
+        fields['response_reason_code'] = reason.get('errorCode',
+            reason.get('code', ''))
+        fields['response_reason_text'] = reason.get('errorText',
+            reason.get('description', ''))
+    fields['transaction_type'] = TRANSACTION_TYPES[transaction_type]
+    if amount:
+        fields['amount'] = amount
+    return TransactionResult.from_fields(fields)
+
+def credit_card_payment(credit_card):
+    return OrderedDict((
+        ('creditCard', OrderedDict((
+            ('cardNumber', credit_card.card_number),
+            ('expirationDate', '{0.exp_year}-{0.exp_month:0>2}'.format(
+                credit_card)),
+            ('cardCode', credit_card.cvv),
+        ))),
+    ))
+
+def bill_to(first_name=None, last_name=None, company=None, address=None):
+    # Billing details are optional, so any that are not set are left out
+    fields = [
+        ('firstName', first_name),
+        ('lastName', last_name),
+        ('company', company),
+    ]
+    if address:
+        fields.extend((
+            ('address', address.street),
+            ('city', address.city),
+            ('state', address.state),
+            ('zip', address.zip_code),
+            ('country', address.country),
+        ))
+    return OrderedDict((key, value) for key, value in fields if value)
+
+class JSONAPI(object):
+    """
+    The connection and error handling shared by the JSON API classes. Calls
+    are measured under the name of the ``API`` each class stands in for.
+    """
+    API = None
+
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            pool=None, instrumentation=None):
+        self.url = TEST_URL if debug else PROD_URL
+        # Keep-alive connections, shared with the other APIs by the client
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.instrumentation = instrumentation
+        self.login_id = login_id
+        self.transaction_key = transaction_key
+        self.test = test
+        self.merchant_auth = OrderedDict((
+            ('name', login_id),
+            ('transactionKey', transaction_key),
+        ))
+
+    def _send(self, request, *items):
+        body = json.dumps({request: OrderedDict(
+            (('merchantAuthentication', self.merchant_auth),) + items)},
+            separators=(',', ':'))
+        try:
+            response = self.pool.urlopen(self.url, body,
+                {'Content-Type': 'application/json'})
+            if response.status != 200:
+                raise IOError('JSON API returned {0} {1}'.format(
+                    response.status, response.reason))
+            return loads(response.body)
+        except (IOError, ValueError, httplib.HTTPException) as e:
+            raise AuthorizeConnectionError(e)
+
+    def _make_call(self, request, *items):
+        # Provides standard API call error handling
+        with measure(self.instrumentation, self.API, request):
+            return self._check_response(self._send(request, *items))
+
+    def _check_response(self, response):
+        messages = response.get('messages') or {}
+        if messages.get('resultCode') != 'Ok':
+            error = (messages.get('message') or [{}])[0]
+            code, text = error.get('code'), error.get('text')
+            e = AuthorizeResponseError('%s: %s' % (code, text))
+            e.full_response = {
+                'response_code': code,
+                'response_text': text,
+            }
+            raise e
+        return response
+
+    def _transaction(self, transaction_type, amount, *items):
+        details = [('transactionType', transaction_type)]
+        if amount:
+            amount = format_amount(amount)
+            details.append(('amount', amount))
+        details.extend(items)
+        if self.test:
+            details.append(('transactionSettings', TEST_SETTINGS))
+        # Transactions are measured by their type rather than the request
+        with measure(self.instrumentation, self.API, transaction_type):
+            response = self._send('createTransactionRequest',
+                ('transactionRequest', OrderedDict(details)))
+            if 'transactionResponse' not in response:
+                self._check_response(response)
+            fields = parse_transaction(response, transaction_type, amount)
+            if fields['response_code'] != '1':
+                e = AuthorizeResponseError('%s full_response=%r' %
+                    (fields['response_reason_text'], fields))
+                e.full_response = fields
+                raise e
+            return fields
+
+class JSONTransactionAPI(JSONAPI):
+    API = 'transaction'
+
+    def encode_payment(self, credit_card=None, address=None):
+        """
+        Builds the payment and billing details for a credit card and address,
+        leaving out any that are not set. The result can be passed as
+        ``payment`` to :meth:`auth` and :meth:`capture`, so that repeated
+        charges to the same card skip building them again.
+        """
+        items = []
+        if credit_card:
+            items.append(('payment', credit_card_payment(credit_card)))
+            billing = bill_to(credit_card.first_name, credit_card.last_name,
+                address=address)
+        else:
+            billing = bill_to(address=address)
+        if billing:
+            items.append(('billTo', billing))
+        return tuple(items)
+
+    def auth(self, amount, credit_card, address=None, payment=None):
+        if payment is None:
+            payment = self.encode_payment(credit_card, address)
+        return self._transaction('authOnlyTransaction', amount, *payment)
+
+    def capture(self, amount, credit_card, address=None, payment=None):
+        if payment is None:
+            payment = self.encode_payment(credit_card, address)
+        return self._transaction('authCaptureTransaction', amount, *payment)
+
+    def settle(self, transaction_id, amount=None):
+        # Amount is not required -- if provided, settles for a lower amount
+        # than the original auth; if not, settles the full amount authed.
+        return self._transaction('priorAuthCaptureTransaction', amount,
+            ('refTransId', transaction_id))
+
+    def credit(self, card_num, transaction_id, amount):
+        # The same restrictions apply as for TransactionAPI.credit
+        return self._transaction('refundTransaction', amount,
+            ('payment', {'creditCard': OrderedDict((
+                ('cardNumber', str(card_num)),
+                ('expirationDate', 'XXXX'),
+            ))}),
+            ('refTransId', transaction_id))
+
+    def void(self, transaction_id):
+        return self._transaction('voidTransaction', None,
+            ('refTransId', transaction_id))
+
+class JSONCustomerAPI(JSONAPI):
+    API = 'customer'
+
+    def _profile_transaction(self, transaction_type, profile_id, payment_id,
+            amount):
+        return self._transaction(transaction_type, amount,
+            ('profile', OrderedDict((
+                ('customerProfileId', profile_id),
+                ('paymentProfile', {'paymentProfileId': payment_id}),
+            ))))
+
+    def create_saved_profile(self, internal_id, payments=None):
+        """
+        Creates a user profile to which you can attach saved payments.
+        Requires an internal_id to uniquely identify this user. If a list of
+        saved payments is provided, as generated by create_saved_payment,
+        these will be automatically added to the user profile. Returns the
+        user profile id.
+        """
+        profile = OrderedDict((('merchantCustomerId', internal_id),))
+        if payments:
+            profile['paymentProfiles'] = list(payments)
+        response = self._make_call('createCustomerProfileRequest',
+            ('profile', profile), ('validationMode', 'none'))
+        payment_ids = None
+        if payments:
+            payment_ids = response['customerPaymentProfileIdList']
+        return response['customerProfileId'], payment_ids
+
+    def create_saved_payment(self, credit_card=None, address=None,
+                             bank_account=None, profile_id=None):
+        """
+        Creates a payment profile. If profile_id is provided, this payment
+        profile will be created in Authorize.net attached to that profile.
+        If it is not provided, the payment profile will be returned and can
+        be provided in a list to the create_profile call.
+        """
+        assert (credit_card or bank_account) is not None
+        payment_profile = OrderedDict((('customerType', 'individual'),))
+        if credit_card is not None:
+            billing = bill_to(credit_card.first_name, credit_card.last_name,
+                address=address)
+            payment = credit_card_payment(credit_card)
+        else:
+            billing = bill_to(bank_account.first_name,
+                bank_account.last_name, bank_account.company, address)
+            payment = {'bankAccount': OrderedDict((
+                ('accountType', str(bank_account.account_type)),
+                ('routingNumber', bank_account.routing_number),
+                ('accountNumber', bank_account.account_number),
+                ('nameOnAccount', '{0} {1}'.format(bank_account.first_name,
+                    bank_account.last_name)),
+                ('echeckType', str(bank_account.echeck_type)),
+                ('bankName', bank_account.bank_name),
+            ))}
+        if billing:
+            payment_profile['billTo'] = billing
+        payment_profile['payment'] = payment
+
+        # If a profile id is provided, create saved payment on that profile
+        # Otherwise, return an object for a later call to create_saved_profile
+        if profile_id:
+            response = self._make_call('createCustomerPaymentProfileRequest',
+                ('customerProfileId', profile_id),
+                ('paymentProfile', payment_profile),
+                ('validationMode', 'none'))
+            return response['customerPaymentProfileId']
+        else:
+            return payment_profile
+
+    def delete_saved_profile(self, profile_id):
+        self._make_call('deleteCustomerProfileRequest',
+            ('customerProfileId', profile_id))
+
+    def delete_saved_payment(self, profile_id, payment_id):
+        self._make_call('deleteCustomerPaymentProfileRequest',
+            ('customerProfileId', profile_id),
+            ('customerPaymentProfileId', payment_id))
+
+    def auth(self, profile_id, payment_id, amount):
+        return self._profile_transaction('authOnlyTransaction', profile_id,
+            payment_id, amount)
+
+    def capture(self, profile_id, payment_id, amount):
+        return self._profile_transaction('authCaptureTransaction',
+            profile_id, payment_id, amount)
+
+    def credit(self, profile_id, payment_id, amount):
+        # Creates an "unlinked credit" (as opposed to refunding a previous transaction)
+        return self._profile_transaction('refundTransaction', profile_id,
+            payment_id, amount)
+
+class JSONRecurringAPI(JSONAPI):
+    API = 'recurring'
+
+    def create_subscription(self, credit_card, amount, start,
+            days=None, months=None, occurrences=None, trial_amount=None,
+            trial_occurrences=None):
+        """
+        Creates a recurring subscription payment on the CreditCard provided.
+        Takes the same arguments as :meth:`RecurringAPI.create_subscription
+        <authorize.apis.recurring.RecurringAPI.create_subscription>`.
+        """
+        values = check_subscription(credit_card, amount, start, days,
+            months, occurrences, trial_amount, trial_occurrences)
+        schedule = OrderedDict((
+            ('interval', OrderedDict((
+                ('length', values['length']),
+                ('unit', values['unit']),
+            ))),
+            ('startDate', values['start']),
+            ('totalOccurrences', values['occurrences']),
+        ))
+        subscription = OrderedDict((
+            ('paymentSchedule', schedule),
+            ('amount', values['amount']),
+        ))
+        # If a trial period has been specified, add those fields
+        if values['trial_occurrences'] is not None:
+            schedule['trialOccurrences'] = values['trial_occurrences']
+            subscription['trialAmount'] = values['trial_amount']
+        subscription['payment'] = credit_card_payment(credit_card)
+        subscription['billTo'] = bill_to(credit_card.first_name,
+            credit_card.last_name)
+        response = self._make_call('ARBCreateSubscriptionRequest',
+            ('subscription', subscription))
+        return response['subscriptionId']
+
+    def update_subscription(self, subscription_id, amount=None, start=None,
+            occurrences=None, trial_amount=None, trial_occurrences=None):
+        """
+        Updates an existing recurring subscription payment. Takes the same
+        arguments as :meth:`RecurringAPI.update_subscription
+        <authorize.apis.recurring.RecurringAPI.update_subscription>`, and
+        only the provided fields are updated.
+        """
+        if start and start < date.today():
+            raise AuthorizeInvalidError('The start date for the subscription '
+                'may not be in the past.')
+        schedule = OrderedDict()
+        if start:
+            schedule['startDate'] = start.strftime('%Y-%m-%d')
+        if occurrences:
+            schedule['totalOccurrences'] = occurrences
+        if trial_occurrences:
+            schedule['trialOccurrences'] = trial_occurrences
+        subscription = OrderedDict()
+        if schedule:
+            subscription['paymentSchedule'] = schedule
+        if amount:
+            subscription['amount'] = format_amount(amount)
+        if trial_amount:
+            subscription['trialAmount'] = format_amount(trial_amount)
+        self._make_call('ARBUpdateSubscriptionRequest',
+            ('subscriptionId', subscription_id),
+            ('subscription', subscription))
+
+    def delete_subscription(self, subscription_id):
+        """
+        Deletes an existing recurring subscription payment.
+        """
+        self._make_call('ARBCancelSubscriptionRequest',
+            ('subscriptionId', subscription_id))
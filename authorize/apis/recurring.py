@@ -1,45 +1,189 @@
 from datetime import date
-from decimal import Decimal
-
-from suds import WebFault
-from suds.client import Client
+import httplib
+import threading
 
+from authorize.apis.templates import MARSHALLERS, SERVICES, SoapFault, \
+    SoapTemplates
+from authorize.data import format_amount
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeInvalidError, AuthorizeResponseError
+from authorize.instrument import measure
+from authorize.pool import ConnectionPool
+from authorize.process import PerProcess
 
 
 PROD_URL = 'https://api.authorize.net/soap/v1/Service.asmx?WSDL'
 TEST_URL = 'https://apitest.authorize.net/soap/v1/Service.asmx?WSDL'
 
-class RecurringAPI(object):
-    def __init__(self, login_id, transaction_key, debug=True, test=False):
+def check_subscription(credit_card, amount, start, days=None, months=None,
+        occurrences=None, trial_amount=None, trial_occurrences=None):
+    """
+    Validates the arguments to ``create_subscription`` and returns them
+    formatted for the request, keyed by the argument names of
+    :meth:`SoapTemplates.create_subscription
+    <authorize.apis.templates.SoapTemplates.create_subscription>`. Raises
+    :class:`AuthorizeInvalidError <authorize.exceptions.AuthorizeInvalidError>`
+    for anything that does not check out.
+    """
+    if not (credit_card.first_name and credit_card.last_name):
+        raise AuthorizeInvalidError('Subscriptions require first name '
+            'and last name to be provided with the credit card.')
+    if (days and months) or not (days or months):
+        raise AuthorizeInvalidError('Please provide either the months or '
+            'days argument to define the subscription interval.')
+    if days:
+        try:
+            length = int(days)
+            assert length >= 7 and length <= 365
+        except (AssertionError, ValueError):
+            raise AuthorizeInvalidError('The interval days must be an '
+                'integer value between 7 and 365.')
+        unit = 'days'
+    elif months:
+        try:
+            length = int(months)
+            assert length >= 1 and length <= 12
+        except (AssertionError, ValueError):
+            raise AuthorizeInvalidError('The interval months must be an '
+                'integer value between 1 and 12.')
+        unit = 'months'
+    if start < date.today():
+        raise AuthorizeInvalidError('The start date for the subscription '
+            'may not be in the past.')
+    if occurrences is None:
+        occurrences = 9999 # That's what they say to do in the docs
+    if trial_amount and trial_occurrences:
+        trial_amount = format_amount(trial_amount)
+    elif trial_amount or trial_occurrences:
+        raise AuthorizeInvalidError('To indicate a trial period, you '
+            'must provide both a trial amount and occurrences.')
+    else:
+        trial_amount = trial_occurrences = None
+    amount = format_amount(amount)
+    expiration = '{0}-{1:0>2}'.format(credit_card.exp_year,
+        credit_card.exp_month)
+    start = start.strftime('%Y-%m-%d')
+    return {
+        'amount': amount,
+        'card_number': credit_card.card_number,
+        'expiration': expiration,
+        'card_code': credit_card.cvv,
+        'first_name': credit_card.first_name,
+        'last_name': credit_card.last_name,
+        'unit': unit,
+        'length': length,
+        'start': start,
+        'occurrences': occurrences,
+        'trial_amount': trial_amount,
+        'trial_occurrences': trial_occurrences,
+    }
+
+class RecurringAPI(PerProcess):
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            pool=None, marshaller='suds', instrumentation=None):
         self.url = TEST_URL if debug else PROD_URL
+        # Keep-alive connections, shared with the other APIs by the client
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.instrumentation = instrumentation
         self.login_id = login_id
         self.transaction_key = transaction_key
+        self._prototypes = {}
+        self._reset()
+        if marshaller not in MARSHALLERS:
+            raise ValueError('Unknown SOAP marshaller {0!r}.'.format(
+                marshaller))
+        # Creating subscriptions can skip suds entirely
+        self.templates = None
+        if marshaller == 'templates':
+            self.templates = SoapTemplates(self.url, self.pool, login_id,
+                transaction_key)
+
+    def _reset(self):
+        # A forked child sets up its own credentials. The service client is
+        # kept, so that children share the parsed definition with the parent
+        # copy-on-write.
+        PerProcess._reset(self)
+        self._lock = threading.RLock()
+        self.__dict__.pop('_client_auth', None)
+
+    @property
+    def clients(self):
+        # Calls are made on clients checked out from here, so that threads
+        # sharing this instance never share a suds client. suds is slow to
+        # import, so it is only imported once the SOAP API is first used.
+        self._check_fork()
+        if not hasattr(self, '_clients'):
+            with self._lock:
+                if not hasattr(self, '_clients'):
+                    from authorize.apis.soap import ClientPool
+                    self._clients = ClientPool(self.url, self.pool)
+        return self._clients
 
     @property
     def client(self):
-        # Lazy instantiation of SOAP client, which hits the WSDL url
-        if not hasattr(self, '_client'):
-            self._client = Client(self.url)
+        # Lazy instantiation of the SOAP client used to build request types,
+        # which hits the WSDL url the first time any API in this process
+        # needs it. Checked again under the lock, as threads may race here.
+        # If the definition is replaced, such as by revalidating the WSDL,
+        # the client and the types built with it are made again.
+        from authorize.apis.soap import service_generation
+        self._check_fork()
+        generation = service_generation()
+        if getattr(self, '_client_generation', None) != generation:
+            with self._lock:
+                if getattr(self, '_client_generation', None) != generation:
+                    self._client = self.clients.create()
+                    self._prototypes = {}
+                    self.__dict__.pop('_client_auth', None)
+                    self._client_generation = generation
         return self._client
 
     @property
     def client_auth(self):
+        # Getting the client first drops credentials built for an older one
+        self.client
         if not hasattr(self, '_client_auth'):
-            self._client_auth = self.client.factory.create(
-                'MerchantAuthenticationType')
-            self._client_auth.name = self.login_id
-            self._client_auth.transactionKey = self.transaction_key
+            with self._lock:
+                if not hasattr(self, '_client_auth'):
+                    client_auth = self.client.factory.create(
+                        'MerchantAuthenticationType')
+                    client_auth.name = self.login_id
+                    client_auth.transactionKey = self.transaction_key
+                    self._client_auth = client_auth
         return self._client_auth
 
+    def _create(self, kind):
+        # Building a type walks the schema, so each kind is built once and
+        # the copy kept is cloned for every request after that
+        from authorize.apis.soap import clone
+        client = self.client
+        prototype = self._prototypes.get(kind)
+        if prototype is None:
+            prototype = self._prototypes[kind] = client.factory.create(kind)
+        return clone(prototype)
+
     def _make_call(self, service, *args):
         # Provides standard API call error handling
-        method = getattr(self.client.service, service)
-        try:
-            response = method(self.client_auth, *args)
-        except WebFault as e:
-            raise AuthorizeConnectionError(e)
+        from suds import WebFault
+        client_auth = self.client_auth
+        with measure(self.instrumentation, 'recurring', service):
+            try:
+                with self.clients.checkout() as client:
+                    response = client.method(service)(client_auth, *args)
+            except (WebFault, IOError, httplib.HTTPException) as e:
+                raise AuthorizeConnectionError(e)
+            return self._check_response(response)
+
+    def _render_call(self, operation, *args, **kwargs):
+        # The same, for calls rendered from templates instead of by suds
+        with measure(self.instrumentation, 'recurring', SERVICES[operation]):
+            try:
+                response = getattr(self.templates, operation)(*args, **kwargs)
+            except (SoapFault, IOError, httplib.HTTPException) as e:
+                raise AuthorizeConnectionError(e)
+            return self._check_response(response)
+
+    def _check_response(self, response):
         if response.resultCode != 'Ok':
             error = response.messages[0][0]
             raise AuthorizeResponseError('%s: %s' % (error.code, error.text))
@@ -57,8 +201,8 @@ class RecurringAPI(object):
             the credit card.
         
         ``amount``
-            The amount to charge every occurrence, either as an int, float,
-            or Decimal.
+            The amount to charge every occurrence, as anything accepted by
+            :class:`Money <authorize.data.Money>`.
         
         ``start``
             The date to start the subscription, as a date object.
@@ -86,66 +230,40 @@ class RecurringAPI(object):
             should last for. (Either both trial arguments should be provided,
             or neither.)
         """
-        subscription = self.client.factory.create('ARBSubscriptionType')
+        values = check_subscription(credit_card, amount, start, days,
+            months, occurrences, trial_amount, trial_occurrences)
+
+        if self.templates is not None:
+            response = self._render_call('create_subscription', **values)
+            return response.subscriptionId
+
+        subscription = self._create('ARBSubscriptionType')
 
         # Add the basic amount and payment fields
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        subscription.amount = str(amount)
-        payment_type = self.client.factory.create('PaymentType')
-        credit_card_type = self.client.factory.create('CreditCardType')
+        subscription.amount = values['amount']
+        payment_type = self._create('PaymentType')
+        credit_card_type = self._create('CreditCardType')
         credit_card_type.cardNumber = credit_card.card_number
-        credit_card_type.expirationDate = '{0}-{1:0>2}'.format(
-            credit_card.exp_year, credit_card.exp_month)
+        credit_card_type.expirationDate = values['expiration']
         credit_card_type.cardCode = credit_card.cvv
         payment_type.creditCard = credit_card_type
         subscription.payment = payment_type
-        if not (credit_card.first_name and credit_card.last_name):
-            raise AuthorizeInvalidError('Subscriptions require first name '
-                'and last name to be provided with the credit card.')
         subscription.billTo.firstName = credit_card.first_name
         subscription.billTo.lastName = credit_card.last_name
 
         # Add the fields for the payment schedule
-        if (days and months) or not (days or months):
-            raise AuthorizeInvalidError('Please provide either the months or '
-                'days argument to define the subscription interval.')
-        if days:
-            try:
-                days = int(days)
-                assert days >= 7 and days <= 365
-            except (AssertionError, ValueError):
-                raise AuthorizeInvalidError('The interval days must be an '
-                    'integer value between 7 and 365.')
-            subscription.paymentSchedule.interval.unit = \
-                self.client.factory.create('ARBSubscriptionUnitEnum').days
-            subscription.paymentSchedule.interval.length = days
-        elif months:
-            try:
-                months = int(months)
-                assert months >= 1 and months <= 12
-            except (AssertionError, ValueError):
-                raise AuthorizeInvalidError('The interval months must be an '
-                    'integer value between 1 and 12.')
-            subscription.paymentSchedule.interval.unit = \
-                self.client.factory.create('ARBSubscriptionUnitEnum').months
-            subscription.paymentSchedule.interval.length = months
-        if start < date.today():
-            raise AuthorizeInvalidError('The start date for the subscription '
-                'may not be in the past.')
-        subscription.paymentSchedule.startDate = start.strftime('%Y-%m-%d')
-        if occurrences is None:
-            occurrences = 9999 # That's what they say to do in the docs
-        subscription.paymentSchedule.totalOccurrences = occurrences
+        subscription.paymentSchedule.interval.unit = getattr(
+            self._create('ARBSubscriptionUnitEnum'),
+            values['unit'])
+        subscription.paymentSchedule.interval.length = values['length']
+        subscription.paymentSchedule.startDate = values['start']
+        subscription.paymentSchedule.totalOccurrences = values['occurrences']
 
         # If a trial period has been specified, add those fields
-        if trial_amount and trial_occurrences:
-            subscription.paymentSchedule.trialOccurrences = trial_occurrences
-            trial_amount = Decimal(str(trial_amount))
-            trial_amount = trial_amount.quantize(Decimal('0.01'))
-            subscription.trialAmount = str(trial_amount)
-        elif trial_amount or trial_occurrences:
-            raise AuthorizeInvalidError('To indicate a trial period, you '
-                'must provide both a trial amount and occurrences.')
+        if values['trial_occurrences'] is not None:
+            subscription.paymentSchedule.trialOccurrences = \
+                values['trial_occurrences']
+            subscription.trialAmount = values['trial_amount']
 
         # Make the API call to create the subscription
         response = self._make_call('ARBCreateSubscription', subscription)
@@ -164,8 +282,8 @@ class RecurringAPI(object):
             call for the subscription you want to update.
         
         ``amount``
-            The updated amount to charge every occurrence, either as an int,
-            float, or Decimal.
+            The updated amount to charge every occurrence, as anything
+            accepted by :class:`Money <authorize.data.Money>`.
         
         ``start``
             The updated date to start the subscription, as a date object. This
@@ -184,12 +302,11 @@ class RecurringAPI(object):
             only be updated if you have not begun charging at the regular
             price.
         """
-        subscription = self.client.factory.create('ARBSubscriptionType')
+        subscription = self._create('ARBSubscriptionType')
 
         # Add the basic subscription updates
         if amount:
-            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-            subscription.amount = str(amount)
+            subscription.amount = format_amount(amount)
         if start and start < date.today():
             raise AuthorizeInvalidError('The start date for the subscription '
                 'may not be in the past.')
@@ -198,9 +315,7 @@ class RecurringAPI(object):
         if occurrences:
             subscription.paymentSchedule.totalOccurrences = occurrences
         if trial_amount:
-            trial_amount = Decimal(str(trial_amount))
-            trial_amount = trial_amount.quantize(Decimal('0.01'))
-            subscription.trialAmount = str(trial_amount)
+            subscription.trialAmount = format_amount(trial_amount)
         if trial_occurrences:
             subscription.paymentSchedule.trialOccurrences = trial_occurrences
 
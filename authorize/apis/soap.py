@@ -0,0 +1,346 @@
+"""
+Process-wide cache of the parsed Authorize.net SOAP service definitions.
+
+The saved payment (CIM) and recurring billing (ARB) APIs are both described
+by the same large WSDL document. Downloading and parsing it is by far the
+most expensive part of getting a SOAP client ready, so it is done once per
+process for each service URL, and every API instance, on every
+``AuthorizeClient``, gets a cheap clone of that client sharing the parsed
+definition.
+
+Copies of the WSDL for the test and production hosts are bundled in the
+``authorize/wsdl`` directory by running ``python -m authorize.apis.soap``
+when preparing a release. When present, they are used instead of the live
+documents, so no network access is needed to get ready. The definitions
+parsed from them are also pickled to an on-disk cache, so later processes
+skip parsing as well. The cache is kept in ``WSDL_CACHE_DIR`` if it is set,
+and in a directory for the user running the process under the system's
+temporary directory otherwise. It is not used at all if anyone else could
+have written to it. Use :func:`revalidate` to check a bundled copy against the
+live WSDL in the background; if it has changed, clients already handed out
+are replaced with ones for the live definition as they are next used.
+
+A suds client keeps the state of the call it is making, so it must not be
+used by two threads at once. A :class:`ClientPool` hands out a client to each
+call in turn, so one API instance can be shared by any number of threads.
+Looking up a service method and building a request type from the schema
+are both slow in suds, so pooled clients keep the methods they have looked
+up, and :func:`clone` copies a type built once instead of building it again.
+"""
+
+from contextlib import contextmanager
+from copy import copy, deepcopy
+import errno
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import threading
+import urllib
+import urlparse
+
+import suds
+from suds.cache import NoCache, ObjectCache
+from suds.client import Client
+from suds.sudsobject import Object
+from suds.transport import Request
+
+from authorize.apis.transport import PooledTransport
+from authorize.pool import ConnectionPool
+from authorize.process import PerProcess
+
+
+log = logging.getLogger(__name__)
+
+# Bump whenever the bundled WSDL documents change, so stale pickled
+# definitions from an older release are never loaded
+CACHE_VERSION = 1
+WSDL_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'wsdl')
+# Where to cache parsed definitions, instead of the per-user default
+WSDL_CACHE_DIR = os.environ.get('AUTHORIZE_WSDL_CACHE')
+
+class _Services(PerProcess):
+    # The clients holding the definitions cached in this process, by URL. A
+    # forked child keeps them, to share with the parent copy-on-write.
+    def __init__(self):
+        self.clients = {}
+        # Bumped whenever a cached definition is replaced or forgotten, so
+        # that clients cloned from the old one are dropped
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        PerProcess._reset(self)
+        self._lock = threading.Lock()
+
+_services = _Services()
+
+def bundled_wsdl_path(url):
+    """
+    The path where the bundled copy of the WSDL at ``url`` is kept. There is
+    one copy per host, since the test and production hosts each describe
+    their own service endpoint.
+    """
+    host = urlparse.urlsplit(url).hostname
+    return os.path.join(WSDL_DIR, '{0}.wsdl'.format(host))
+
+def bundled_wsdl(url):
+    """
+    Returns a ``file:`` URL for the bundled copy of the WSDL at ``url``, or
+    ``None`` if there is no bundled copy for that host.
+    """
+    path = bundled_wsdl_path(url)
+    if not os.path.exists(path):
+        return None
+    return urlparse.urljoin('file:', urllib.pathname2url(path))
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _cache_dir():
+    # Cached definitions are unpickled, which can run arbitrary code, so the
+    # cache is only used from a directory that this user owns and no one
+    # else can write to. Returns None if the directory is not safe.
+    root = WSDL_CACHE_DIR
+    if not root:
+        # Named by user ID where there is one, as a process may run as a
+        # user with no name, such as in a container
+        if hasattr(os, 'getuid'):
+            user = os.getuid()
+        else:
+            user = os.environ.get('USERNAME', 'default')
+        root = os.path.join(tempfile.gettempdir(),
+            'authorize-sauce-{0}'.format(user))
+    try:
+        os.makedirs(root, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            log.warning('Could not create the WSDL cache in %s.', root,
+                exc_info=True)
+            return None
+    info = os.lstat(root)
+    if not stat.S_ISDIR(info.st_mode) or \
+            info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or \
+            (hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+        log.warning('Not using the WSDL cache in %s, as it is not a '
+            'directory owned by and only writable by this user.', root)
+        return None
+    return os.path.join(root,
+        'wsdl-{0}-suds-{1}'.format(CACHE_VERSION, suds.__version__))
+
+def _load(url, transport, path=None):
+    # Only definitions parsed from the bundled document at ``path`` are
+    # cached on disk. They are pickled forever (days=0); the cache location
+    # is versioned instead, and keyed by the contents of the bundled
+    # document, so the cache never has to expire to pick up a changed WSDL.
+    # A live WSDL can change at any time, so it is always parsed afresh.
+    location = None if path is None else _cache_dir()
+    if location is None:
+        cache = NoCache()
+    else:
+        cache = ObjectCache(location=os.path.join(location,
+            _digest(path)[:16]), days=0)
+    # A transport can only belong to one client, and the clients handed out
+    # are clones, so the cached client gets a copy of its own
+    return Client(url, transport=deepcopy(transport), cachingpolicy=1,
+        cache=cache)
+
+def service_client(url, transport):
+    """
+    Returns a suds ``Client`` for the service described by the WSDL at
+    ``url`` that sends its requests through ``transport``. The service
+    definition is loaded only the first time it is requested in this
+    process, from the bundled copy if there is one and from ``url``
+    otherwise.
+    """
+    _services._check_fork()
+    with _services._lock:
+        client = _services.clients.get(url)
+        if client is None:
+            bundled = bundled_wsdl(url)
+            if bundled is None:
+                client = _load(url, transport)
+            else:
+                client = _load(bundled, transport, bundled_wsdl_path(url))
+            _services.clients[url] = client
+    client = client.clone()
+    client.set_options(transport=transport)
+    return client
+
+def preload(url):
+    """
+    Loads the service definition for ``url`` into the cache for this
+    process. Any connection opened to fetch it is closed again before this
+    returns, so it is safe to call in a pre-fork server's master process:
+    the workers it forks then share the parsed definition copy-on-write
+    instead of each loading their own.
+    """
+    pool = ConnectionPool()
+    try:
+        service_client(url, PooledTransport(pool))
+    finally:
+        pool.close()
+
+def service_generation():
+    """
+    A number that changes whenever a cached service definition is replaced
+    or forgotten. Clients from :func:`service_client`, and types built with
+    them, that were made in an earlier generation may describe the service
+    as it was, and should be made again.
+    """
+    return _services.generation
+
+def clear_service_cache():
+    """
+    Forgets all service definitions cached in this process, so that the next
+    client for each URL loads its WSDL again.
+    """
+    _services._check_fork()
+    with _services._lock:
+        _services.clients.clear()
+        _services.generation += 1
+
+def clone(sobject):
+    """
+    Copies a suds object, such as one built by a client's factory, along with
+    the suds objects and lists it holds. Unlike ``deepcopy``, this shares the
+    metadata pointing at the schema type instead of copying the schema.
+    """
+    copied = copy(sobject)
+    copied.__keylist__ = list(sobject.__keylist__)
+    for name in sobject.__keylist__:
+        value = getattr(sobject, name)
+        if isinstance(value, Object):
+            setattr(copied, name, clone(value))
+        elif isinstance(value, list):
+            setattr(copied, name, [clone(item) if isinstance(item, Object)
+                else item for item in value])
+    return copied
+
+class PooledClient(object):
+    """
+    A suds client checked out of a :class:`ClientPool`, which keeps the
+    service methods looked up on it for the next call that checks it out.
+    """
+    def __init__(self, client, generation=None):
+        self.client = client
+        self.generation = generation
+        self._methods = {}
+
+    def method(self, name):
+        """
+        Returns the service method called ``name``.
+        """
+        method = self._methods.get(name)
+        if method is None:
+            method = self._methods[name] = getattr(self.client.service, name)
+        return method
+
+class ClientPool(PerProcess):
+    """
+    A thread-safe pool of suds clients for the service at ``url``, all
+    cloned from the one service definition cached for the process and
+    sending their requests over the connection ``pool``.
+
+    Each call checks out a client of its own with :meth:`checkout`, which
+    reuses an idle client when there is one and clones a new one otherwise,
+    so the pool grows to the number of calls made at the same time. Clients
+    cloned from a definition that has since been replaced are dropped.
+    """
+    def __init__(self, url, pool):
+        self.url = url
+        self.pool = pool
+        self._idle = []
+        self._generation = _services.generation
+        self._reset()
+
+    def _reset(self):
+        # Idle clients are kept after a fork, as their transports use the
+        # connection pool, which resets itself
+        PerProcess._reset(self)
+        self._lock = threading.Lock()
+
+    def create(self):
+        """
+        Returns a new client, not tracked by the pool.
+        """
+        return service_client(self.url, PooledTransport(self.pool))
+
+    @contextmanager
+    def checkout(self):
+        """
+        Checks out a :class:`PooledClient` for the length of a ``with``
+        block::
+
+            with clients.checkout() as client:
+                client.method('CreateCustomerProfile')(...)
+        """
+        self._check_fork()
+        generation = _services.generation
+        with self._lock:
+            if self._generation != generation:
+                self._idle = []
+                self._generation = generation
+            client = self._idle.pop() if self._idle else None
+        if client is None:
+            client = PooledClient(self.create(), generation)
+        try:
+            yield client
+        finally:
+            with self._lock:
+                if client.generation == self._generation:
+                    self._idle.append(client)
+
+def revalidate(url, transport):
+    """
+    Starts a background thread that compares the bundled copy of the WSDL at
+    ``url`` with the live document. If they differ, a warning is logged and
+    the live WSDL is loaded to replace the bundled definition for the rest of
+    this process, including for clients already cloned from it, which are
+    made again from the live definition when next used. Without a bundled copy the live WSDL is already in use, so
+    there is nothing to check. Returns the thread.
+    """
+    def check():
+        try:
+            path = bundled_wsdl_path(url)
+            if not os.path.exists(path):
+                return
+            live = transport.open(Request(url)).read()
+            if _digest(path) == hashlib.sha1(live).hexdigest():
+                return
+            log.warning('Bundled WSDL for %s is out of date; '
+                'using the live WSDL instead.', url)
+            client = _load(url, transport)
+            _services._check_fork()
+            with _services._lock:
+                _services.clients[url] = client
+                _services.generation += 1
+        except Exception:
+            log.warning('Could not revalidate the WSDL at %s.', url,
+                exc_info=True)
+    thread = threading.Thread(target=check, name='authorize-wsdl-revalidate')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def bundle_wsdl(url, transport):
+    """
+    Downloads the live WSDL at ``url`` into the bundled copies directory.
+    This is used when preparing a release, by running this module with
+    ``python -m authorize.apis.soap``.
+    """
+    document = transport.open(Request(url)).read()
+    if not os.path.isdir(WSDL_DIR):
+        os.makedirs(WSDL_DIR)
+    with open(bundled_wsdl_path(url), 'wb') as f:
+        f.write(document)
+
+if __name__ == '__main__':
+    from authorize.apis.customer import PROD_URL, TEST_URL
+    transport = PooledTransport(ConnectionPool())
+    for url in (TEST_URL, PROD_URL):
+        bundle_wsdl(url, transport)
+        print 'Bundled {0} as {1}'.format(url, bundled_wsdl_path(url))
@@ -0,0 +1,170 @@
+"""
+Renders the busiest saved payment (CIM) and recurring billing (ARB) calls
+straight from precompiled SOAP envelope templates, and reads their responses
+with a streaming parser, instead of building them through the suds type
+factory and generic marshalling.
+
+Only the operations that sit on hot payment paths are rendered this way:
+charging a saved payment with ``CreateCustomerProfileTransaction`` and
+creating a subscription with ``ARBCreateSubscription``. Every other call still
+goes through suds. The rendered envelopes follow the element order of the
+Authorize.net WSDL, and every value is escaped.
+"""
+
+from cStringIO import StringIO
+from xml.etree.cElementTree import ParseError, iterparse
+from xml.sax.saxutils import escape
+
+
+# The ways the saved payment and recurring billing APIs can build requests
+MARSHALLERS = ('suds', 'templates')
+NAMESPACE = 'https://api.authorize.net/soap/v1/'
+ENVELOPE_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><{0} xmlns="' + NAMESPACE + '">'
+    '<merchantAuthentication><name>{1}</name>'
+    '<transactionKey>{2}</transactionKey></merchantAuthentication>'
+)
+ENVELOPE_TAIL = '</{0}></soap:Body></soap:Envelope>'
+PROFILE_TRANSACTION = (
+    '<transaction><{0}><amount>{1}</amount>'
+    '<customerProfileId>{2}</customerProfileId>'
+    '<customerPaymentProfileId>{3}</customerPaymentProfileId></{0}>'
+    '</transaction><extraOptions>{4}</extraOptions>'
+)
+SUBSCRIPTION = (
+    '<subscription><paymentSchedule><interval><length>{0}</length>'
+    '<unit>{1}</unit></interval><startDate>{2}</startDate>'
+    '<totalOccurrences>{3}</totalOccurrences>{4}</paymentSchedule>'
+    '<amount>{5}</amount>{6}<payment><creditCard>'
+    '<cardNumber>{7}</cardNumber><expirationDate>{8}</expirationDate>'
+    '<cardCode>{9}</cardCode></creditCard></payment><billTo>'
+    '<firstName>{10}</firstName><lastName>{11}</lastName></billTo>'
+    '</subscription>'
+)
+OPERATIONS = ('CreateCustomerProfileTransaction', 'ARBCreateSubscription')
+# The operation each method of SoapTemplates sends
+SERVICES = {
+    'profile_transaction': 'CreateCustomerProfileTransaction',
+    'create_subscription': 'ARBCreateSubscription',
+}
+# Elements of a response that are kept; everything else is skipped
+RESULT_FIELDS = ('resultCode', 'directResponse', 'subscriptionId',
+    'customerProfileId', 'customerPaymentProfileId')
+
+
+class SoapFault(Exception):
+    """A SOAP fault returned in place of a response."""
+
+class Message(object):
+    __slots__ = ('code', 'text')
+
+    def __init__(self, code, text):
+        self.code = code
+        self.text = text
+
+class SoapResult(object):
+    """
+    The fields of a response read by the APIs. Messages are nested in a list
+    the way suds returns them, so ``messages[0][0]`` is the first message.
+    """
+    def __init__(self):
+        self.resultCode = None
+        self.directResponse = None
+        self.subscriptionId = None
+        self.customerProfileId = None
+        self.customerPaymentProfileId = None
+        self.messages = [[]]
+
+def parse_result(body):
+    """
+    Reads a SOAP response body into a :class:`SoapResult`, or raises
+    :class:`SoapFault` if the body is a fault or is not XML at all.
+    """
+    result = SoapResult()
+    code = text = fault = None
+    try:
+        for event, element in iterparse(StringIO(body)):
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag in RESULT_FIELDS:
+                setattr(result, tag, element.text or '')
+            elif tag == 'code':
+                code = element.text
+            elif tag == 'text':
+                text = element.text
+            elif tag == 'MessagesTypeMessage':
+                result.messages[0].append(Message(code, text))
+            elif tag == 'faultstring':
+                fault = element.text
+            element.clear()
+    except ParseError as e:
+        raise SoapFault('Could not parse the response: {0}'.format(e))
+    if fault is not None:
+        raise SoapFault(fault)
+    return result
+
+def _text(value):
+    # A missing optional value is sent empty rather than as 'None'
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return escape(str(value))
+
+class SoapTemplates(object):
+    """
+    Sends the templated operations for one set of credentials to the SOAP
+    endpoint described by the WSDL at ``url``, over ``pool``. The start of
+    each envelope, credentials included, is rendered once up front.
+    """
+    def __init__(self, url, pool, login_id, transaction_key):
+        self.endpoint = url.split('?', 1)[0]
+        self.pool = pool
+        self._heads = dict((operation, ENVELOPE_HEAD.format(operation,
+            _text(login_id), _text(transaction_key)))
+            for operation in OPERATIONS)
+        self._tails = dict((operation, ENVELOPE_TAIL.format(operation))
+            for operation in OPERATIONS)
+
+    def _send(self, operation, body):
+        envelope = ''.join((self._heads[operation], body,
+            self._tails[operation]))
+        response = self.pool.urlopen(self.endpoint, envelope, {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': '"{0}{1}"'.format(NAMESPACE, operation),
+        })
+        # Faults come back with a 500 status and are raised by parse_result
+        if response.status not in (200, 500):
+            raise IOError('SOAP API returned {0} {1}'.format(
+                response.status, response.reason))
+        return parse_result(response.body)
+
+    def profile_transaction(self, kind, profile_id, payment_id, amount,
+            extra_options):
+        """
+        Sends a ``CreateCustomerProfileTransaction`` of the given ``kind``,
+        such as ``'profileTransAuthOnly'``, for a formatted ``amount``.
+        """
+        return self._send('CreateCustomerProfileTransaction',
+            PROFILE_TRANSACTION.format(kind, _text(amount),
+            _text(profile_id), _text(payment_id), _text(extra_options)))
+
+    def create_subscription(self, amount, card_number, expiration, card_code,
+            first_name, last_name, unit, length, start, occurrences,
+            trial_amount=None, trial_occurrences=None):
+        """
+        Sends an ``ARBCreateSubscription`` from values already validated by
+        the recurring billing API.
+        """
+        trial_schedule = trial_price = ''
+        if trial_occurrences is not None:
+            trial_schedule = '<trialOccurrences>{0}</trialOccurrences>' \
+                .format(_text(trial_occurrences))
+            trial_price = '<trialAmount>{0}</trialAmount>'.format(
+                _text(trial_amount))
+        return self._send('ARBCreateSubscription', SUBSCRIPTION.format(
+            _text(length), _text(unit), _text(start), _text(occurrences),
+            trial_schedule, _text(amount), trial_price, _text(card_number),
+            _text(expiration), _text(card_code), _text(first_name),
+            _text(last_name)))
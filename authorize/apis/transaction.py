@@ -1,106 +1,251 @@
-from decimal import Decimal
+from collections import Mapping
+import httplib
 import urllib
 
+from authorize.data import format_amount
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeResponseError
+from authorize.instrument import measure
+from authorize.pool import ConnectionPool
 
 
 PROD_URL = 'https://secure.authorize.net/gateway/transact.dll'
 TEST_URL = 'https://test.authorize.net/gateway/transact.dll'
-RESPONSE_FIELDS = {
-    0: 'response_code',
-    2: 'response_reason_code',
-    3: 'response_reason_text',
-    4: 'authorization_code',
-    5: 'avs_response',
-    6: 'transaction_id',
-    9: 'amount',
-    11: 'transaction_type',
-    38: 'cvv_response',
-}
-
-def parse_response(response):
-    response = response.split(';')
-    fields = {}
-    for index, name in RESPONSE_FIELDS.items():
-        fields[name] = response[index]
-    return fields
+DELIMITER = ';'
+ENCAPSULATOR = '|'
+# Position of each field in an AIM response, as documented in the AIM
+# implementation guide. Reserved positions are None.
+RESPONSE_FIELDS = (
+    'response_code',
+    'response_subcode',
+    'response_reason_code',
+    'response_reason_text',
+    'authorization_code',
+    'avs_response',
+    'transaction_id',
+    'invoice_number',
+    'description',
+    'amount',
+    'method',
+    'transaction_type',
+    'customer_id',
+    'first_name',
+    'last_name',
+    'company',
+    'address',
+    'city',
+    'state',
+    'zip_code',
+    'country',
+    'phone',
+    'fax',
+    'email',
+    'ship_to_first_name',
+    'ship_to_last_name',
+    'ship_to_company',
+    'ship_to_address',
+    'ship_to_city',
+    'ship_to_state',
+    'ship_to_zip_code',
+    'ship_to_country',
+    'tax',
+    'duty',
+    'freight',
+    'tax_exempt',
+    'purchase_order_number',
+    'md5_hash',
+    'cvv_response',
+    'cavv_response',
+) + (None,) * 10 + (
+    'account_number',
+    'card_type',
+    'split_tender_id',
+    'requested_amount',
+    'balance_on_card',
+) + (None,) * 13
+FIELD_INDEXES = dict((name, index)
+    for index, name in enumerate(RESPONSE_FIELDS) if name is not None)
+
+class TransactionResult(object):
+    """
+    A read-only mapping of the fields of an AIM response, such as
+    ``transaction_id`` or ``md5_hash``, by the names in ``RESPONSE_FIELDS``.
+    The response is split once, in whatever string type it arrived as, and
+    fields are only looked up by position when asked for. Fields missing
+    from a short response read as empty strings.
+
+    Responses sent with ``x_encap_char`` have each field wrapped in the
+    ``encapsulator``, so a delimiter inside a value such as an address does
+    not shift the fields after it. Responses without it are split on the
+    delimiter alone. Whitespace around the response, such as a trailing line
+    break, is ignored.
+    """
+    __slots__ = ('_fields',)
+
+    def __init__(self, response, delimiter=DELIMITER,
+            encapsulator=ENCAPSULATOR):
+        response = response.strip()
+        if encapsulator and len(response) > 1 and \
+                response[0] == encapsulator and response[-1] == encapsulator:
+            self._fields = response[1:-1].split(
+                encapsulator + delimiter + encapsulator)
+        else:
+            self._fields = response.split(delimiter)
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Builds a result from a dictionary of field names to values, for
+        responses that do not arrive as a delimited string, such as those of
+        the JSON API. Fields not given read as empty strings.
+        """
+        result = cls.__new__(cls)
+        result._fields = [''] * len(RESPONSE_FIELDS)
+        for name, value in fields.items():
+            result._fields[FIELD_INDEXES[name]] = value
+        return result
+
+    def __repr__(self):
+        return '<TransactionResult {0!r}>'.format(
+            dict((name, value) for name, value in self.items() if value))
+
+    def __getstate__(self):
+        return self._fields
+
+    def __setstate__(self, state):
+        self._fields = state
+
+    def __getitem__(self, name):
+        index = FIELD_INDEXES[name]
+        if index < len(self._fields):
+            return self._fields[index]
+        return ''
+
+    def __iter__(self):
+        return (name for name in RESPONSE_FIELDS if name is not None)
+
+    def __len__(self):
+        return len(FIELD_INDEXES)
+
+    def __contains__(self, name):
+        return name in FIELD_INDEXES
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def get(self, name, default=None):
+        if name in FIELD_INDEXES:
+            return self[name]
+        return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+Mapping.register(TransactionResult)
+
+def parse_response(response, delimiter=DELIMITER, encapsulator=ENCAPSULATOR):
+    return TransactionResult(response, delimiter, encapsulator)
 
 class TransactionAPI(object):
-    def __init__(self, login_id, transaction_key, debug=True, test=False):
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            pool=None, instrumentation=None):
         self.url = TEST_URL if debug else PROD_URL
+        # Keep-alive connections, shared with the other APIs by the client
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.instrumentation = instrumentation
         self.base_params = {
             'x_login': login_id,
             'x_tran_key': transaction_key,
             'x_version': '3.1',
             'x_test_request': 'TRUE' if test else 'FALSE',
             'x_delim_data': 'TRUE',
-            'x_delim_char': ';',
+            'x_delim_char': DELIMITER,
+            'x_encap_char': ENCAPSULATOR,
         }
+        # The credentials and options are the same for every call, so they
+        # are encoded once and each request is built by concatenation
+        self.base_url = '{0}?{1}'.format(self.url,
+            urllib.urlencode(sorted(self.base_params.items())))
+
+    def _make_call(self, *fragments):
+        # Calls are measured by their x_type, which always comes first
+        with measure(self.instrumentation, 'transaction',
+                fragments[0].split('=', 1)[1]):
+            url = '&'.join((self.base_url,) + tuple(filter(None, fragments)))
+            try:
+                response = self.pool.urlopen(url).read()
+            except (IOError, httplib.HTTPException) as e:
+                raise AuthorizeConnectionError(e)
+            fields = parse_response(response)
+            if fields['response_code'] != '1':
+                e = AuthorizeResponseError('%s full_response=%r' %
+                    (fields['response_reason_text'], fields))
+                e.full_response = fields
+                raise e
+            return fields
 
-    def _make_call(self, params):
-        params = urllib.urlencode(params)
-        url = '{0}?{1}'.format(self.url, params)
-        try:
-            response = urllib.urlopen(url).read()
-        except IOError as e:
-            raise AuthorizeConnectionError(e)
-        fields = parse_response(response)
-        if fields['response_code'] != '1':
-            e = AuthorizeResponseError('%s full_response=%r' %
-                (fields['response_reason_text'], fields))
-            e.full_response = fields
-            raise e
-        return fields
-
-    def _add_params(self, params, credit_card=None, address=None):
+    def _amount(self, amount):
+        return 'x_amount=' + format_amount(amount)
+
+    def encode_payment(self, credit_card=None, address=None):
+        """
+        Encodes the parameters for a credit card and address, leaving out any
+        that are not set. The result can be passed as ``payment`` to
+        :meth:`auth` and :meth:`capture`, so that repeated charges to the same
+        card skip encoding it again.
+        """
+        params = []
         if credit_card:
-            params.update({
-                'x_card_num': credit_card.card_number,
-                'x_exp_date': credit_card.expiration.strftime('%m-%Y'),
-                'x_card_code': credit_card.cvv,
-                'x_first_name': credit_card.first_name,
-                'x_last_name': credit_card.last_name,
-            })
+            params.extend((
+                ('x_card_num', credit_card.card_number),
+                ('x_exp_date', credit_card.expiration.strftime('%m-%Y')),
+                ('x_card_code', credit_card.cvv),
+                ('x_first_name', credit_card.first_name),
+                ('x_last_name', credit_card.last_name),
+            ))
         if address:
-            params.update({
-                'x_address': address.street,
-                'x_city': address.city,
-                'x_state': address.state,
-                'x_zip': address.zip_code,
-                'x_country': address.country,
-            })
-        for key, value in params.items():
-            if value is None:
-                del params[key]
-        return params
-
-    def auth(self, amount, credit_card, address=None):
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        params = self.base_params.copy()
-        params = self._add_params(params, credit_card, address)
-        params['x_type'] = 'AUTH_ONLY'
-        params['x_amount'] = str(amount)
-        return self._make_call(params)
-
-    def capture(self, amount, credit_card, address=None):
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        params = self.base_params.copy()
-        params = self._add_params(params, credit_card, address)
-        params['x_type'] = 'AUTH_CAPTURE'
-        params['x_amount'] = str(amount)
-        return self._make_call(params)
+            params.extend((
+                ('x_address', address.street),
+                ('x_city', address.city),
+                ('x_state', address.state),
+                ('x_zip', address.zip_code),
+                ('x_country', address.country),
+            ))
+        return urllib.urlencode([(key, value) for key, value in params
+            if value is not None])
+
+    def auth(self, amount, credit_card, address=None, payment=None):
+        if payment is None:
+            payment = self.encode_payment(credit_card, address)
+        return self._make_call('x_type=AUTH_ONLY', payment,
+            self._amount(amount))
+
+    def capture(self, amount, credit_card, address=None, payment=None):
+        if payment is None:
+            payment = self.encode_payment(credit_card, address)
+        return self._make_call('x_type=AUTH_CAPTURE', payment,
+            self._amount(amount))
 
     def settle(self, transaction_id, amount=None):
         # Amount is not required -- if provided, settles for a lower amount
         # than the original auth; if not, settles the full amount authed.
-        params = self.base_params.copy()
-        params['x_type'] = 'PRIOR_AUTH_CAPTURE'
-        params['x_trans_id'] = transaction_id
-        if amount:
-            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-            params['x_amount'] = str(amount)
-        return self._make_call(params)
+        return self._make_call('x_type=PRIOR_AUTH_CAPTURE',
+            urllib.urlencode({'x_trans_id': transaction_id}),
+            self._amount(amount) if amount else None)
 
     def credit(self, card_num, transaction_id, amount):
         # Authorize.net can do unlinked credits (not tied to a previous
@@ -115,16 +260,11 @@ class TransactionAPI(object):
         #   charge amount.
         # - The credit must be submitted within 120 days of the original
         #   transaction being settled.
-        params = self.base_params.copy()
-        params['x_type'] = 'CREDIT'
-        params['x_trans_id'] = transaction_id
-        params['x_card_num'] = str(card_num)
-        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
-        params['x_amount'] = str(amount)
-        return self._make_call(params)
+        return self._make_call('x_type=CREDIT', urllib.urlencode((
+            ('x_trans_id', transaction_id),
+            ('x_card_num', str(card_num)),
+        )), self._amount(amount))
 
     def void(self, transaction_id):
-        params = self.base_params.copy()
-        params['x_type'] = 'VOID'
-        params['x_trans_id'] = transaction_id
-        return self._make_call(params)
+        return self._make_call('x_type=VOID',
+            urllib.urlencode({'x_trans_id': transaction_id}))
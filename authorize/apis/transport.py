@@ -0,0 +1,45 @@
+from cStringIO import StringIO
+import urllib2
+
+from suds.transport import Reply, Transport, TransportError
+
+
+class PooledTransport(Transport):
+    """
+    A suds transport that sends SOAP requests over the keep-alive connections
+    of a :class:`ConnectionPool <authorize.pool.ConnectionPool>`, so the CIM
+    and ARB APIs reuse connections instead of opening one per call.
+
+    Connection failures are raised as ``IOError`` or
+    ``httplib.HTTPException`` rather than wrapped by suds, so the APIs can
+    report them consistently.
+    """
+    def __init__(self, pool):
+        Transport.__init__(self)
+        self.pool = pool
+
+    def __deepcopy__(self, memo):
+        # suds deep copies a client's options, transport included, when it is
+        # cloned. The pool is meant to be shared, so only copy the transport.
+        return PooledTransport(self.pool)
+
+    def open(self, request):
+        # Used by suds to fetch the WSDL and any imported schemas, which may
+        # be local files when the bundled copy of the WSDL is used
+        if not request.url.startswith(('http:', 'https:')):
+            return urllib2.urlopen(request.url)
+        response = self.pool.urlopen(request.url, headers=request.headers)
+        if response.status != 200:
+            raise TransportError(response.reason, response.status,
+                StringIO(response.body))
+        return StringIO(response.body)
+
+    def send(self, request):
+        response = self.pool.urlopen(request.url, request.message,
+            request.headers)
+        if response.status in (202, 204):
+            return None
+        if response.status != 200:
+            raise TransportError(response.reason, response.status,
+                StringIO(response.body))
+        return Reply(200, response.headers, response.body)
@@ -0,0 +1,309 @@
+"""
+This is a non-blocking version of the main interface in
+:mod:`authorize.client`, for services that cannot afford to wait on each call
+to Authorize.net, such as event-driven servers.
+
+Every operation returns a ``concurrent.futures.Future`` immediately, and the
+call to Authorize.net is made on one of a fixed number of worker threads,
+which sets how many calls can be in flight at once. The futures resolve to
+the asynchronous counterparts of the usual transaction, saved card and
+recurring payment objects, or raise the usual exceptions from
+:mod:`authorize.exceptions`. Under ``asyncio`` on newer Pythons, these
+futures can be awaited with ``asyncio.wrap_future``.
+"""
+
+from authorize.client import AuthorizeBankAccount, AuthorizeClient, \
+    AuthorizeCreditCard, AuthorizeRecurring, AuthorizeSavedAccount, \
+    AuthorizeSavedCard, AuthorizeTransaction
+
+
+class AsyncAuthorizeClient(object):
+    """
+    Instantiate the client with your login ID and transaction key from
+    Authorize.net. The ``debug``, ``test``, ``soap_marshaller``,
+    ``backend`` and ``instrumentation`` options work just as they do for
+    :class:`AuthorizeClient <authorize.client.AuthorizeClient>`.
+
+    The ``max_concurrency`` option sets how many calls to Authorize.net can
+    be in progress at once; further calls wait their turn. It also sets the
+    number of keep-alive connections kept open to each host.
+    """
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            max_concurrency=10, pool_idle_timeout=60, soap_marshaller='suds',
+            backend='classic', instrumentation=None):
+        self.client = AuthorizeClient(login_id, transaction_key, debug, test,
+            pool_size=max_concurrency, pool_idle_timeout=pool_idle_timeout,
+            soap_marshaller=soap_marshaller, backend=backend,
+            instrumentation=instrumentation)
+        self.max_concurrency = max_concurrency
+        self._executor = self.client.executor(max_concurrency)
+
+    def card(self, credit_card, address=None):
+        """
+        Returns an
+        :class:`AsyncAuthorizeCreditCard <authorize.asynchronous.AsyncAuthorizeCreditCard>`
+        instance for a :class:`CreditCard <authorize.data.CreditCard>`, and
+        optionally an :class:`Address <authorize.data.Address>`.
+        """
+        return AsyncAuthorizeCreditCard(self,
+            self.client.card(credit_card, address))
+
+    def check(self, bank_account, address=None):
+        """
+        Returns an
+        :class:`AsyncAuthorizeBankAccount <authorize.asynchronous.AsyncAuthorizeBankAccount>`
+        instance for a :class:`BankAccount <authorize.data.BankAccount>`, and
+        optionally an :class:`Address <authorize.data.Address>`.
+        """
+        return AsyncAuthorizeBankAccount(self,
+            self.client.check(bank_account, address))
+
+    def transaction(self, uid):
+        """
+        Returns an
+        :class:`AsyncAuthorizeTransaction <authorize.asynchronous.AsyncAuthorizeTransaction>`
+        instance for the previous transaction with the given ``uid``.
+        """
+        return AsyncAuthorizeTransaction(self, self.client.transaction(uid))
+
+    def saved_card(self, uid):
+        """
+        Returns an
+        :class:`AsyncAuthorizeSavedCard <authorize.asynchronous.AsyncAuthorizeSavedCard>`
+        instance for the saved card with the given ``uid``.
+        """
+        return AsyncAuthorizeSavedCard(self, self.client.saved_card(uid))
+
+    def saved_check(self, uid):
+        """
+        Returns an
+        :class:`AsyncAuthorizeSavedAccount <authorize.asynchronous.AsyncAuthorizeSavedAccount>`
+        instance for the saved bank account with the given ``uid``.
+        """
+        return AsyncAuthorizeSavedAccount(self, self.client.saved_check(uid))
+
+    def recurring(self, uid):
+        """
+        Returns an
+        :class:`AsyncAuthorizeRecurring <authorize.asynchronous.AsyncAuthorizeRecurring>`
+        instance for the recurring payment with the given ``uid``.
+        """
+        return AsyncAuthorizeRecurring(self, self.client.recurring(uid))
+
+    def warmup(self, connections=None):
+        """
+        Warms up the client as
+        :meth:`AuthorizeClient.warmup <authorize.client.AuthorizeClient.warmup>`
+        does, opening ``max_concurrency`` connections to each host unless
+        told otherwise. Returns a future for the step timings.
+        """
+        if connections is None:
+            connections = self.max_concurrency
+        return self._submit(self.client.warmup, connections)
+
+    def close(self, wait=True):
+        """
+        Stops accepting new calls and closes idle connections. If ``wait`` is
+        ``True``, blocks until calls already in progress have finished.
+        """
+        self._executor.shutdown(wait)
+        self.client.close()
+
+    def _submit(self, method, *args, **kwargs):
+        return self._executor.submit(self._call, method, args, kwargs)
+
+    def _call(self, method, args, kwargs):
+        # Runs on a worker thread, giving the asynchronous counterpart of
+        # anything the blocking interface returns
+        result = method(*args, **kwargs)
+        wrapper = WRAPPERS.get(type(result))
+        if wrapper is not None:
+            result = wrapper(self, result)
+        return result
+
+class AsyncAuthorizeCreditCard(object):
+    """
+    The non-blocking interface for working with a credit card. Each method
+    works like its counterpart on
+    :class:`AuthorizeCreditCard <authorize.client.AuthorizeCreditCard>` but
+    returns a future.
+    """
+    def __init__(self, client, card):
+        self._client = client
+        self._card = card
+
+    def __repr__(self):
+        return '<AsyncAuthorizeCreditCard {0.credit_card.card_type} ' \
+            '{0.credit_card.safe_number}>'.format(self._card)
+
+    @property
+    def credit_card(self):
+        return self._card.credit_card
+
+    @property
+    def address(self):
+        return self._card.address
+
+    def auth(self, amount):
+        return self._client._submit(self._card.auth, amount)
+
+    def capture(self, amount):
+        return self._client._submit(self._card.capture, amount)
+
+    def save(self):
+        return self._client._submit(self._card.save)
+
+    def recurring(self, amount, start, days=None, months=None,
+            occurrences=None, trial_amount=None, trial_occurrences=None):
+        return self._client._submit(self._card.recurring, amount, start,
+            days=days, months=months, occurrences=occurrences,
+            trial_amount=trial_amount, trial_occurrences=trial_occurrences)
+
+class AsyncAuthorizeBankAccount(object):
+    """
+    The non-blocking interface for working with a bank account. Each method
+    works like its counterpart on
+    :class:`AuthorizeBankAccount <authorize.client.AuthorizeBankAccount>` but
+    returns a future.
+    """
+    def __init__(self, client, check):
+        self._client = client
+        self._check = check
+
+    def __repr__(self):
+        return '<AsyncAuthorizeBankAccount {0.bank_account.account_type} ' \
+            '{0.bank_account.routing_number} ' \
+            '{0.bank_account.safe_number}>'.format(self._check)
+
+    @property
+    def bank_account(self):
+        return self._check.bank_account
+
+    @property
+    def address(self):
+        return self._check.address
+
+    def auth(self, amount):
+        return self._client._submit(self._check.auth, amount)
+
+    def capture(self, amount):
+        return self._client._submit(self._check.capture, amount)
+
+    def save(self):
+        return self._client._submit(self._check.save)
+
+    def recurring(self, amount, start, days=None, months=None,
+            occurrences=None, trial_amount=None, trial_occurrences=None):
+        return self._client._submit(self._check.recurring, amount, start,
+            days=days, months=months, occurrences=occurrences,
+            trial_amount=trial_amount, trial_occurrences=trial_occurrences)
+
+class AsyncAuthorizeTransaction(object):
+    """
+    The non-blocking interface for working with a previous transaction. Each
+    method works like its counterpart on
+    :class:`AuthorizeTransaction <authorize.client.AuthorizeTransaction>` but
+    returns a future. The ``full_response`` and ``timings`` of the
+    transaction are available as usual.
+    """
+    def __init__(self, client, transaction):
+        self._client = client
+        self._transaction = transaction
+
+    def __repr__(self):
+        return '<AsyncAuthorizeTransaction {0.uid}>'.format(self)
+
+    @property
+    def uid(self):
+        return self._transaction.uid
+
+    @property
+    def full_response(self):
+        return getattr(self._transaction, 'full_response', None)
+
+    @property
+    def timings(self):
+        return getattr(self._transaction, 'timings', None)
+
+    def settle(self, amount=None):
+        return self._client._submit(self._transaction.settle, amount=amount)
+
+    def credit(self, card_number, amount):
+        return self._client._submit(self._transaction.credit, card_number,
+            amount)
+
+    def void(self):
+        return self._client._submit(self._transaction.void)
+
+class AsyncAuthorizeSavedCard(object):
+    """
+    The non-blocking interface for working with a saved credit card. Each
+    method works like its counterpart on
+    :class:`AuthorizeSavedCard <authorize.client.AuthorizeSavedCard>` but
+    returns a future.
+    """
+    def __init__(self, client, saved):
+        self._client = client
+        self._saved = saved
+
+    def __repr__(self):
+        return '<AsyncAuthorizeSavedCard {0.uid}>'.format(self)
+
+    @property
+    def uid(self):
+        return self._saved.uid
+
+    def auth(self, amount):
+        return self._client._submit(self._saved.auth, amount)
+
+    def capture(self, amount):
+        return self._client._submit(self._saved.capture, amount)
+
+    def delete(self):
+        return self._client._submit(self._saved.delete)
+
+class AsyncAuthorizeSavedAccount(AsyncAuthorizeSavedCard):
+    """
+    The non-blocking interface for working with a saved bank account. Each
+    method works like its counterpart on
+    :class:`AuthorizeSavedAccount <authorize.client.AuthorizeSavedAccount>`
+    but returns a future.
+    """
+    def __repr__(self):
+        return '<AsyncAuthorizeSavedAccount {0.uid}>'.format(self)
+
+class AsyncAuthorizeRecurring(object):
+    """
+    The non-blocking interface for working with a recurring charge. Each
+    method works like its counterpart on
+    :class:`AuthorizeRecurring <authorize.client.AuthorizeRecurring>` but
+    returns a future.
+    """
+    def __init__(self, client, recurring):
+        self._client = client
+        self._recurring = recurring
+
+    def __repr__(self):
+        return '<AsyncAuthorizeRecurring {0.uid}>'.format(self)
+
+    @property
+    def uid(self):
+        return self._recurring.uid
+
+    def update(self, amount=None, start=None, occurrences=None,
+            trial_amount=None, trial_occurrences=None):
+        return self._client._submit(self._recurring.update, amount=amount,
+            start=start, occurrences=occurrences, trial_amount=trial_amount,
+            trial_occurrences=trial_occurrences)
+
+    def delete(self):
+        return self._client._submit(self._recurring.delete)
+
+WRAPPERS = {
+    AuthorizeCreditCard: AsyncAuthorizeCreditCard,
+    AuthorizeBankAccount: AsyncAuthorizeBankAccount,
+    AuthorizeTransaction: AsyncAuthorizeTransaction,
+    AuthorizeSavedCard: AsyncAuthorizeSavedCard,
+    AuthorizeSavedAccount: AsyncAuthorizeSavedAccount,
+    AuthorizeRecurring: AsyncAuthorizeRecurring,
+}
@@ -0,0 +1,151 @@
+"""
+Local lookup of the issuer of a credit card from its bank identification
+number (BIN), the first digits of the card number.
+
+BIN range files, as sold by the card networks and data vendors, are
+compiled with :func:`build_index` (or ``python -m authorize.bins ranges.csv
+bins.idx``) into a memory-mapped index (see :mod:`authorize.index`) of
+ranges sorted by their first BIN, so a lookup is a binary search touching a
+handful of pages.
+
+Load an index once at startup with :func:`load`, after which
+:attr:`CreditCard.bin_info <authorize.data.CreditCard.bin_info>` gives the
+:class:`BinInfo` for any card without calling out to another service.
+
+The source file is a CSV with a header row and the columns ``low``,
+``high``, ``issuer``, ``country``, ``funding``, ``card_level`` and
+``prepaid``. ``low`` and ``high`` are the first and last BINs in the range,
+of any length up to ``KEY_DIGITS``. ``funding`` is one of ``FUNDING_TYPES``,
+and ``prepaid`` is ``Y`` or ``N``. Ranges may not overlap.
+"""
+
+from collections import namedtuple
+import csv
+import struct
+import sys
+
+from authorize.index import MappedIndex, StringTable, write_index
+
+
+# Card numbers are matched on this many leading digits
+KEY_DIGITS = 12
+FUNDING_TYPES = ('', 'credit', 'debit', 'charge')
+MAGIC = 'AZBIN\x00\x00\x01'
+
+# Low and high key, issuer and card level string numbers, country, funding
+# type number, prepaid
+RECORD = struct.Struct('>QQII2sBB')
+LOW = struct.Struct('>Q')
+
+_index = None
+
+
+class BinInfo(namedtuple('BinInfo',
+        'issuer country funding card_level prepaid')):
+    """
+    What is known about the issuer of a card: the ``issuer`` name, its
+    two-letter ``country`` code, the ``funding`` type (``'credit'``,
+    ``'debit'`` or ``'charge'``), the ``card_level`` (such as
+    ``'PLATINUM'``), and whether it is ``prepaid``. Fields the source file
+    left blank are empty strings.
+    """
+    __slots__ = ()
+
+
+class BinIndex(MappedIndex):
+    """
+    A memory-mapped BIN range index, opened from a file written by
+    :func:`build_index`. Raises ``ValueError`` if the file is not an index.
+    """
+    MAGIC = MAGIC
+    RECORD = RECORD
+    KEY = LOW
+
+    def lookup(self, card_number):
+        """
+        Returns the :class:`BinInfo` for the range holding ``card_number``,
+        a string of digits, or ``None`` if no range holds it.
+        """
+        if not card_number.isdigit():
+            return None
+        key = int(card_number[:KEY_DIGITS].ljust(KEY_DIGITS, '0'))
+        # The last range starting at or below the key
+        position = self._search(key)
+        if not position:
+            return None
+        first, last, issuer, card_level, country, funding, prepaid = \
+            self._record(position - 1)
+        if key > last:
+            return None
+        return BinInfo(self._string(issuer), country.rstrip('\x00'),
+            FUNDING_TYPES[funding], self._string(card_level), bool(prepaid))
+
+def _key(bin_number, fill):
+    if not bin_number.isdigit() or len(bin_number) > KEY_DIGITS:
+        raise ValueError('BIN {0!r} is not valid.'.format(bin_number))
+    return int(bin_number.ljust(KEY_DIGITS, fill))
+
+def build_index(source, path):
+    """
+    Compiles the BIN ranges in the CSV file ``source`` into an index at
+    ``path``. Raises ``ValueError`` for malformed or overlapping ranges.
+    Returns the number of ranges.
+    """
+    string = StringTable()
+    ranges = []
+    with open(source, 'rb') as f:
+        for row in csv.DictReader(f):
+            funding = row['funding'].strip().lower()
+            if funding not in FUNDING_TYPES:
+                raise ValueError('Funding type {0!r} is not valid.'
+                    .format(funding))
+            country = row['country'].strip().upper()
+            if len(country) > 2:
+                raise ValueError('Country {0!r} is not a two-letter code.'
+                    .format(country))
+            ranges.append((
+                _key(row['low'].strip(), '0'),
+                _key(row['high'].strip(), '9'),
+                string(row['issuer'].strip()),
+                string(row['card_level'].strip()),
+                country,
+                FUNDING_TYPES.index(funding),
+                row['prepaid'].strip().upper() in ('Y', 'YES', 'TRUE', '1'),
+            ))
+    for record in ranges:
+        if record[0] > record[1]:
+            raise ValueError('BIN range {0}-{1} is empty.'.format(
+                record[0], record[1]))
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError('BIN ranges {0}-{1} and {2}-{3} overlap.'.format(
+                previous[0], previous[1], current[0], current[1]))
+
+    write_index(path, MAGIC, RECORD, ranges, string)
+    return len(ranges)
+
+def load(path):
+    """
+    Opens the index at ``path`` and makes it the one used by
+    :func:`lookup` and :attr:`CreditCard.bin_info
+    <authorize.data.CreditCard.bin_info>`. Returns the :class:`BinIndex`.
+    """
+    global _index
+    _index = BinIndex(path)
+    return _index
+
+def lookup(card_number):
+    """
+    Returns the :class:`BinInfo` for ``card_number`` from the index opened
+    by :func:`load`, or ``None`` if no index is loaded or it has no range
+    for the card.
+    """
+    index = _index
+    if index is None:
+        return None
+    return index.lookup(card_number)
+
+if __name__ == '__main__':
+    count = build_index(sys.argv[1], sys.argv[2])
+    print 'Wrote {0} BIN ranges to {1}'.format(count, sys.argv[2])
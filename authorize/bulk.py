@@ -0,0 +1,125 @@
+"""
+This module checks many credit cards at once, such as the rows of an
+imported card file, without creating a
+:class:`CreditCard <authorize.data.CreditCard>` for each one.
+
+The card numbers, expiration dates and CVV codes are taken as whole columns
+and checked with NumPy array operations, which run the Luhn, expiration, CVV
+and card type checks of :meth:`CreditCard.validate
+<authorize.data.CreditCard.validate>` over every row in one pass. NumPy is
+not otherwise needed by Authorize Sauce, so install it to use this module.
+"""
+
+from datetime import date
+
+import numpy as np
+
+from authorize.data import CARD_RANGES
+
+
+# Error codes returned for each card, in the order the checks are made. A
+# card that fails more than one check gets the code of the first.
+VALID = 0
+INVALID_NUMBER = 1
+EXPIRED = 2
+INVALID_CVV = 3
+UNKNOWN_CARD_TYPE = 4
+
+# The messages CreditCard raises for each error code
+ERROR_MESSAGES = {
+    INVALID_NUMBER: 'Credit card number is not valid.',
+    EXPIRED: 'Credit card is expired.',
+    INVALID_CVV: 'Credit card CVV is invalid format.',
+    UNKNOWN_CARD_TYPE: 'Credit card number is not valid.',
+}
+
+
+def _characters(values):
+    # Lays the values out as the bytes of their string forms, one row per
+    # value padded out with zero bytes
+    strings = np.asarray(values).astype(np.string_)
+    chars = strings.view(np.uint8).reshape(len(strings), strings.itemsize)
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    digits = np.where(is_digit, chars - ord('0'), 0).astype(np.int64)
+    return chars, is_digit, digits
+
+def _digit_strings(values):
+    # Which values are made up only of digits, how many they have, and the
+    # place value of each digit counted from the right
+    chars, is_digit, digits = _characters(values)
+    only_digits = (is_digit | (chars == 0)).all(axis=1)
+    places = np.cumsum(is_digit[:, ::-1], axis=1)[:, ::-1]
+    return only_digits, is_digit.sum(axis=1), digits, places
+
+def _integers(values):
+    # Converts the values to integers, with a mask of the ones that were
+    # whole numbers to begin with
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64), np.ones(len(values), dtype=bool)
+    only_digits, length, digits, places = _digit_strings(values)
+    valid = only_digits & (length > 0) & (length < 10)
+    powers = 10 ** np.clip(places - 1, 0, 9)
+    return (digits * powers).sum(axis=1), valid
+
+def _check_numbers(numbers):
+    # The Luhn check and the card type check, ignoring anything but digits
+    # in the numbers just as CreditCard does
+    chars, is_digit, digits = _characters(numbers)
+    length = is_digit.sum(axis=1)
+
+    # The first six digits, counted from the left, matched against the
+    # card ranges with longer prefixes taking precedence
+    places = np.cumsum(is_digit, axis=1)
+    prefix = np.where(is_digit & (places <= 6),
+        digits * 10 ** np.clip(6 - places, 0, 5), 0).sum(axis=1)
+    known = np.zeros(len(length), dtype=bool)
+    for card_type, first, last, lengths in sorted(CARD_RANGES,
+            key=lambda card_range: len(card_range[1])):
+        leading = prefix // 10 ** (6 - len(first))
+        matched = (leading >= int(first)) & (leading <= int(last))
+        known = np.where(matched, np.in1d(length, lengths), known)
+
+    # Every second digit from the right is doubled
+    places = np.cumsum(is_digit[:, ::-1], axis=1)[:, ::-1]
+    digits = np.where(is_digit & (places % 2 == 0), digits * 2, digits)
+    digits = np.where(digits > 9, digits - 9, digits)
+    luhn = (length > 0) & (digits.sum(axis=1) % 10 == 0)
+    return luhn, known
+
+def validate_cards(numbers, exp_years, exp_months, cvvs, today=None):
+    """
+    Validates a batch of credit cards, given as sequences or arrays of the
+    same length holding the card number, expiration year, expiration month
+    and CVV code of each card, as would be passed to :class:`CreditCard
+    <authorize.data.CreditCard>`. Card numbers may hold spaces or dashes,
+    which are ignored.
+
+    Returns a NumPy array with an error code for each card: ``VALID``, or
+    ``INVALID_NUMBER``, ``EXPIRED``, ``INVALID_CVV`` or ``UNKNOWN_CARD_TYPE``
+    for the first check it fails. ``ERROR_MESSAGES`` has the message
+    ``CreditCard`` would raise for each. An expiration date that is not a
+    real month counts as expired. Cards are checked against ``today``'s date
+    if given, or the current date otherwise.
+    """
+    count = len(numbers)
+    if not len(exp_years) == len(exp_months) == len(cvvs) == count:
+        raise ValueError('All columns must have the same length.')
+    if count == 0:
+        return np.zeros(0, dtype=np.uint8)
+    if today is None:
+        today = date.today()
+
+    luhn, known = _check_numbers(numbers)
+
+    years, valid_years = _integers(exp_years)
+    months, valid_months = _integers(exp_months)
+    current = (years * 12 + months >= today.year * 12 + today.month) & \
+        valid_years & valid_months & (months >= 1) & (months <= 12)
+
+    only_digits, length, digits, places = _digit_strings(cvvs)
+    cvv = only_digits & (length >= 3) & (length <= 4)
+
+    return np.select([~luhn, ~current, ~cvv, ~known],
+        [INVALID_NUMBER, EXPIRED, INVALID_CVV, UNKNOWN_CARD_TYPE],
+        VALID).astype(np.uint8)
@@ -17,11 +17,38 @@ Authorize.net_.
 
 """
 
-from uuid import uuid4
+from collections import OrderedDict
+import httplib
+import logging
+import threading
+import time
+from xml.sax import SAXException
 
 from authorize.apis.customer import CustomerAPI
+from authorize.apis.jsonapi import JSONCustomerAPI, JSONRecurringAPI, \
+    JSONTransactionAPI
 from authorize.apis.recurring import RecurringAPI
 from authorize.apis.transaction import TransactionAPI
+from authorize.data import Immutable, Money
+from authorize.exceptions import AuthorizeConnectionError
+from authorize.executor import AuthorizeExecutor
+from authorize.instrument import Instrumentation, last_call
+from authorize.pool import ConnectionPool
+
+
+log = logging.getLogger(__name__)
+# The sets of APIs the client can talk to Authorize.net through
+BACKENDS = ('classic', 'json')
+
+def _unique_id():
+    # uuid is slow to import, so it waits until a payment is first saved
+    from uuid import uuid4
+    return uuid4().hex[:20]
+
+def _timings():
+    # The phases of the call just made on this thread, if they were recorded
+    call = last_call()
+    return call.phases if call is not None else None
 
 
 class AuthorizeClient(object):
@@ -36,16 +63,230 @@ class AuthorizeClient(object):
     depending on debug mode. The ``test`` option determines whether to run
     the standard API in test mode, which should generally be left ``False``,
     even in development and staging environments.
+
+    Connections to Authorize.net are kept alive and reused between calls. The
+    ``pool_size`` option sets how many connections are kept open to each
+    host, and ``pool_idle_timeout`` how many seconds an unused connection is
+    kept before it is closed. The same pool is shared by the basic
+    transaction, saved payment and recurring billing APIs. Under load, set
+    ``pool_size`` to about the number of threads making concurrent calls.
+    A single client can be shared by any number of threads; each call to the
+    saved payment and recurring billing APIs gets a SOAP client of its own,
+    cloned from one shared copy of the service definition. Connections go
+    through the proxy set in the ``https_proxy`` environment variable, if
+    any, as they would with ``urllib``.
+
+    The ``soap_marshaller`` option sets how requests to the saved payment
+    and recurring billing APIs are built. The default, ``'suds'``, builds
+    every request through suds. With ``'templates'``, charges to saved
+    payments and new subscriptions are rendered from precompiled templates
+    instead, which takes much less CPU; other calls still use suds.
+
+    The ``backend`` option picks the APIs the client talks to. The default,
+    ``'classic'``, uses the AIM query string API for basic transactions and
+    the SOAP APIs for saved payments and recurring billing. With ``'json'``,
+    everything goes through the single Authorize.net JSON API instead, over
+    one set of connections and with much smaller requests and responses;
+    ``soap_marshaller`` then has no effect.
+
+    Every call to Authorize.net is timed and counted by the client's
+    ``instrumentation``, an :class:`Instrumentation
+    <authorize.instrument.Instrumentation>`, which can be read with
+    :meth:`stats` or exported to Prometheus. Pass one as ``instrumentation``
+    to share it between clients, or one created with ``phases=True`` to
+    break each call down into DNS, connection, TLS, server and parsing time,
+    which transactions then carry as ``timings``. Nothing is logged unless
+    you opt in by passing one with a :class:`FlightRecorder
+    <authorize.recorder.FlightRecorder>` as its ``recorder``, which keeps the
+    last calls made, logs slow ones and dumps the recording to the log when
+    a call fails to connect. Card numbers, account numbers, CVVs and
+    transaction keys are redacted from the recording, but names, addresses
+    and amounts are not.
     """
-    def __init__(self, login_id, transaction_key, debug=True, test=False):
+    def __init__(self, login_id, transaction_key, debug=True, test=False,
+            pool_size=10, pool_idle_timeout=60, soap_marshaller='suds',
+            backend='classic', instrumentation=None):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend {0!r}.'.format(backend))
         self.login_id = login_id
         self.transaction_key = transaction_key
         self.debug = debug
         self.test = test
-        self._transaction = TransactionAPI(login_id, transaction_key,
-            debug, test)
-        self._recurring = RecurringAPI(login_id, transaction_key, debug, test)
-        self._customer = CustomerAPI(login_id, transaction_key, debug, test)
+        self.soap_marshaller = soap_marshaller
+        self.backend = backend
+        self.pool = ConnectionPool(maxsize=pool_size,
+            idle_timeout=pool_idle_timeout)
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+        if backend == 'json':
+            self._transaction = JSONTransactionAPI(login_id, transaction_key,
+                debug, test, pool=self.pool,
+                instrumentation=self.instrumentation)
+            self._recurring = JSONRecurringAPI(login_id, transaction_key,
+                debug, test, pool=self.pool,
+                instrumentation=self.instrumentation)
+            self._customer = JSONCustomerAPI(login_id, transaction_key,
+                debug, test, pool=self.pool,
+                instrumentation=self.instrumentation)
+        else:
+            self._transaction = TransactionAPI(login_id, transaction_key,
+                debug, test, pool=self.pool,
+                instrumentation=self.instrumentation)
+            self._recurring = RecurringAPI(login_id, transaction_key, debug,
+                test, pool=self.pool, marshaller=soap_marshaller,
+                instrumentation=self.instrumentation)
+            self._customer = CustomerAPI(login_id, transaction_key, debug,
+                test, pool=self.pool, marshaller=soap_marshaller,
+                instrumentation=self.instrumentation)
+        self.warmup_timings = None
+
+    def __getstate__(self):
+        # Pickled as the settings to build a new client from, without the
+        # connections, locks and suds objects of this one
+        return {
+            'login_id': self.login_id,
+            'transaction_key': self.transaction_key,
+            'debug': self.debug,
+            'test': self.test,
+            'pool_size': self.pool.maxsize,
+            'pool_idle_timeout': self.pool.idle_timeout,
+            'soap_marshaller': self.soap_marshaller,
+            'backend': self.backend,
+            'instrumentation': self.instrumentation,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def preload(self):
+        """
+        Loads the saved card and recurring payment service definitions into
+        this process, without keeping any connection open. Under a pre-fork
+        server, call this in the master process before the workers are
+        forked, so that they share the parsed definitions instead of each
+        loading its own.
+
+        Clients are also safe to create before forking: connection pools and
+        other per-process state are reset in a child the first time it uses
+        them. A client can be pickled, for instance to hand it to a
+        ``multiprocessing`` worker, in which case the worker gets a new
+        client with the same settings, and a copy of its
+        ``instrumentation`` that starts with no numbers.
+        """
+        if self.backend == 'json':
+            return
+        from authorize.apis.soap import preload
+        preload(self._customer.url)
+
+    def stats(self):
+        """
+        Returns the latency percentiles, outcome counts and bytes sent and
+        received of the calls made so far, by API and operation, as
+        :meth:`Instrumentation.stats
+        <authorize.instrument.Instrumentation.stats>` does.
+        """
+        return self.instrumentation.stats()
+
+    def close(self):
+        """
+        Closes any idle connections this client is holding open to
+        Authorize.net. The client can still be used afterwards; it will just
+        open new connections as needed.
+        """
+        self.pool.close()
+
+    def warmup(self, connections=1, background=False):
+        """
+        Gets everything ready ahead of the first real transaction, instead of
+        lazily during it: imports suds, loads the saved card and recurring
+        payment service definitions, prepares their credentials, and opens
+        ``connections`` keep-alive connections each to the basic transaction
+        and SOAP hosts.
+
+        Returns an ordered dictionary of how many seconds each step took,
+        which is also kept in the ``warmup_timings`` attribute. That
+        attribute is ``None`` until warmup has finished, so it can back a
+        readiness check. Pass ``background=True`` to warm up in a background
+        thread instead; the ``Thread`` is returned, and any error is logged.
+
+        With the JSON backend there are no service definitions to load, so
+        warming up just opens ``connections`` connections to its one host.
+        """
+        if background:
+            def run():
+                try:
+                    self.warmup(connections)
+                except Exception:
+                    log.exception('Authorize.net client warmup failed.')
+            thread = threading.Thread(target=run, name='authorize-warmup')
+            thread.daemon = True
+            thread.start()
+            return thread
+        if self.backend == 'json':
+            steps = (
+                ('json_connections', lambda: self.pool.warm(
+                    self._transaction.url, connections)),
+            )
+        else:
+            steps = (
+                ('customer_client', lambda: self._customer.client),
+                ('customer_auth', lambda: self._customer.client_auth),
+                ('recurring_client', lambda: self._recurring.client),
+                ('recurring_auth', lambda: self._recurring.client_auth),
+                ('transaction_connections', lambda: self.pool.warm(
+                    self._transaction.url, connections)),
+                ('soap_connections', lambda: self.pool.warm(
+                    self._customer.url, connections)),
+            )
+        timings = OrderedDict()
+        for name, step in steps:
+            start = time.time()
+            try:
+                step()
+            except (IOError, httplib.HTTPException, SAXException) as e:
+                # A WSDL that could not be parsed fails with a SAXException
+                raise AuthorizeConnectionError(e)
+            except Exception as e:
+                # suds is only imported by the first steps, and a WSDL that
+                # could not be fetched fails with its TransportError
+                from suds.transport import TransportError
+                if isinstance(e, TransportError):
+                    raise AuthorizeConnectionError(e)
+                raise
+            timings[name] = time.time() - start
+        self.warmup_timings = timings
+        return timings
+
+    def revalidate_wsdl(self):
+        """
+        The saved card and recurring payment APIs are described by a WSDL
+        document bundled with releases of this library, so they are ready to
+        use without fetching it from Authorize.net. This starts a background
+        check of the bundled copy against the live WSDL; if Authorize.net has
+        changed it, a warning is logged and the live WSDL is used from then
+        on, by this client and every other in the process. Returns
+        the background ``Thread``, or ``None`` with the JSON backend, which
+        has no WSDL.
+        """
+        if self.backend == 'json':
+            return None
+        from authorize.apis.soap import revalidate
+        from authorize.apis.transport import PooledTransport
+        return revalidate(self._customer.url, PooledTransport(self.pool))
+
+    def executor(self, max_workers=10, max_pending=None):
+        """
+        To run a large batch of calls concurrently, such as settling or
+        voiding many transactions, this returns an
+        :class:`AuthorizeExecutor <authorize.executor.AuthorizeExecutor>`
+        with ``max_workers`` worker threads. If ``max_pending`` is given,
+        submitting blocks once that many calls are waiting to start. The
+        connection pool is grown to ``max_workers`` if it is smaller, so each
+        worker keeps its connection alive between calls.
+        """
+        self.pool.maxsize = max(self.pool.maxsize, max_workers)
+        return AuthorizeExecutor(max_workers, max_pending)
 
     def card(self, credit_card, address=None):
         """
@@ -105,7 +346,7 @@ class AuthorizeClient(object):
         """
         return AuthorizeRecurring(self, uid)
 
-class AuthorizeCreditCard(object):
+class AuthorizeCreditCard(Immutable):
     """
     This is the interface for working with a credit card. You use this to
     authorize or charge a credit card, as well as saving the credit card and
@@ -114,15 +355,27 @@ class AuthorizeCreditCard(object):
     Any operation performed on this instance returns another instance you can
     work with, such as a transaction, saved card, or recurring payment.
     """
+    __slots__ = ('_client', 'credit_card', 'address', '_payment')
+    _fields = ('credit_card', 'address')
+
     def __init__(self, client, credit_card, address=None):
-        self._client = client
-        self.credit_card = credit_card
-        self.address = address
+        self._set('_client', client)
+        self._set('credit_card', credit_card)
+        self._set('address', address)
+        self._set('_payment', None)
 
     def __repr__(self):
         return '<AuthorizeCreditCard {0.credit_card.card_type} ' \
             '{0.credit_card.safe_number}>'.format(self)
 
+    def _payment_query(self):
+        # The card and address are encoded for the basic transaction API
+        # the first time they are charged, and reused on later charges
+        if self._payment is None:
+            self._set('_payment', self._client._transaction.encode_payment(
+                self.credit_card, self.address))
+        return self._payment
+
     def auth(self, amount):
         """
         Authorize a transaction against this card for the specified amount.
@@ -132,10 +385,10 @@ class AuthorizeCreditCard(object):
         instance representing the transaction.
         """
         response = self._client._transaction.auth(
-            amount, self.credit_card, self.address)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+            amount, self.credit_card, self.address,
+            payment=self._payment_query())
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def capture(self, amount):
         """
@@ -145,10 +398,10 @@ class AuthorizeCreditCard(object):
         instance representing the transaction.
         """
         response = self._client._transaction.capture(
-            amount, self.credit_card, self.address)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+            amount, self.credit_card, self.address,
+            payment=self._payment_query())
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def save(self):
         """
@@ -157,7 +410,7 @@ class AuthorizeCreditCard(object):
         :class:`AuthorizeSavedCard <authorize.client.AuthorizeSavedCard>`
         instance that you can save or use.
         """
-        unique_id = uuid4().hex[:20]
+        unique_id = _unique_id()
         payment = self._client._customer.create_saved_payment(
             credit_card=self.credit_card, address=self.address)
         profile_id, payment_ids = self._client._customer \
@@ -209,7 +462,7 @@ class AuthorizeCreditCard(object):
         return self._client.recurring(uid)
 
 
-class AuthorizeBankAccount(object):
+class AuthorizeBankAccount(Immutable):
     """
     This is the interface for working with a bank account. You use this to
     authorize or charge a bank account via ach, as well as saving the bank
@@ -218,11 +471,13 @@ class AuthorizeBankAccount(object):
     Any operation performed on this instance returns another instance you can
     work with, such as a transaction, saved account, or recurring payment.
     """
+    __slots__ = ('_client', 'bank_account', 'address')
+    _fields = ('bank_account', 'address')
 
     def __init__(self, client, bank_account, address=None):
-        self._client = client
-        self.bank_account = bank_account
-        self.address = address
+        self._set('_client', client)
+        self._set('bank_account', bank_account)
+        self._set('address', address)
 
     def __repr__(self):
         return '<AuthorizeBankAccount {0.bank_account.account_type} ' \
@@ -239,9 +494,8 @@ class AuthorizeBankAccount(object):
         """
         response = self._client._customer.auth(
             amount, self.bank_account, self.address)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def capture(self, amount):
         """
@@ -252,9 +506,8 @@ class AuthorizeBankAccount(object):
         """
         response = self._client._customer.capture(
             amount, self.bank_account, self.address)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def save(self):
         """
@@ -263,7 +516,7 @@ class AuthorizeBankAccount(object):
         :class:`AuthorizeSavedAccount <authorize.client.AuthorizeSavedAccount>`
         instance that you can save or use.
         """
-        unique_id = uuid4().hex[:20]
+        unique_id = _unique_id()
         payment = self._client._customer.create_saved_payment(
             bank_account=self.bank_account, address=self.address)
         profile_id, payment_ids = self._client._customer \
@@ -314,7 +567,7 @@ class AuthorizeBankAccount(object):
             trial_occurrences=trial_occurrences)
         return self._client.recurring(uid)
 
-class AuthorizeTransaction(object):
+class AuthorizeTransaction(Immutable):
     """
     This is the interface for working with a previous transaction. It is
     returned by many other operations, or you can save the transaction's
@@ -325,11 +578,21 @@ class AuthorizeTransaction(object):
     such operation returns another transaction instance you can work with.
     
     Additionally, if you need to access the full raw result of the transaction
-    it is stored in the ``full_response`` attribute on the class.
+    it is stored in the ``full_response`` attribute on the class, as a
+    :class:`TransactionResult <authorize.apis.transaction.TransactionResult>`
+    mapping of every field in the response. If the client's instrumentation
+    records phases, ``timings`` has the seconds the call spent in each of
+    the :data:`PHASES <authorize.instrument.PHASES>`, such as ``'ttfb'``;
+    otherwise it is ``None``.
     """
-    def __init__(self, client, uid):
-        self._client = client
-        self.uid = uid
+    __slots__ = ('_client', 'uid', 'full_response', 'timings')
+    _fields = ('uid',)
+
+    def __init__(self, client, uid, full_response=None, timings=None):
+        self._set('_client', client)
+        self._set('uid', uid)
+        self._set('full_response', full_response)
+        self._set('timings', timings)
 
     def __repr__(self):
         return '<AuthorizeTransaction {0.uid}>'.format(self)
@@ -344,9 +607,8 @@ class AuthorizeTransaction(object):
         instance representing the settlement transaction.
         """
         response = self._client._transaction.settle(self.uid, amount=amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def credit(self, card_number, amount):
         """
@@ -374,9 +636,8 @@ class AuthorizeTransaction(object):
         """
         response = self._client._transaction.credit(
             card_number, self.uid, amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def void(self):
         """
@@ -386,11 +647,10 @@ class AuthorizeTransaction(object):
         instance representing the void transaction.
         """
         response = self._client._transaction.void(self.uid)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
-class AuthorizeSavedCard(object):
+class AuthorizeSavedCard(Immutable):
     """
     This is the interface for working with a saved credit card. It is returned
     by the
@@ -402,10 +662,15 @@ class AuthorizeSavedCard(object):
     The first three operations will all return a transaction instance to work
     with.
     """
+    __slots__ = ('_client', '_uid', '_profile_id', '_payment_id')
+    _fields = ('_uid',)
+
     def __init__(self, client, uid):
-        self._client = client
-        self._uid = uid
-        self._profile_id, self._payment_id = uid.split('|')
+        self._set('_client', client)
+        self._set('_uid', uid)
+        profile_id, payment_id = uid.split('|')
+        self._set('_profile_id', profile_id)
+        self._set('_payment_id', payment_id)
 
     def __repr__(self):
         return '<AuthorizeSavedCard {0.uid}>'.format(self)
@@ -430,9 +695,8 @@ class AuthorizeSavedCard(object):
         """
         response = self._client._customer.auth(
             self._profile_id, self._payment_id, amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def capture(self, amount):
         """
@@ -443,9 +707,8 @@ class AuthorizeSavedCard(object):
         """
         response = self._client._customer.capture(
             self._profile_id, self._payment_id, amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def delete(self):
         """
@@ -454,7 +717,7 @@ class AuthorizeSavedCard(object):
         self._client._customer.delete_saved_payment(
             self._profile_id, self._payment_id)
 
-class AuthorizeSavedAccount(object):
+class AuthorizeSavedAccount(Immutable):
     """
     This is the interface for working with a saved bank account. It is returned
     by the
@@ -466,11 +729,15 @@ class AuthorizeSavedAccount(object):
     The first three operations will all return a transaction instance to work
     with.
     """
+    __slots__ = ('_client', '_uid', '_profile_id', '_payment_id')
+    _fields = ('_uid',)
 
     def __init__(self, client, uid):
-        self._client = client
-        self._uid = uid
-        self._profile_id, self._payment_id = uid.split('|')
+        self._set('_client', client)
+        self._set('_uid', uid)
+        profile_id, payment_id = uid.split('|')
+        self._set('_profile_id', profile_id)
+        self._set('_payment_id', payment_id)
 
     def __repr__(self):
         return '<AuthorizeSavedAccount {0.uid}>'.format(self)
@@ -497,9 +764,8 @@ class AuthorizeSavedAccount(object):
         """
         response = self._client._customer.auth(
             self._profile_id, self._payment_id, amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def capture(self, amount):
         """
@@ -510,9 +776,8 @@ class AuthorizeSavedAccount(object):
         """
         response = self._client._customer.capture(
             self._profile_id, self._payment_id, amount)
-        transaction = self._client.transaction(response['transaction_id'])
-        transaction.full_response = response
-        return transaction
+        return AuthorizeTransaction(self._client, response['transaction_id'],
+            response, _timings())
 
     def delete(self):
         """
@@ -521,7 +786,7 @@ class AuthorizeSavedAccount(object):
         self._client._customer.delete_saved_payment(
             self._profile_id, self._payment_id)
 
-class AuthorizeRecurring(object):
+class AuthorizeRecurring(Immutable):
     """
     This is the interface for working with a recurring charge. It is returned
     by the
@@ -533,9 +798,12 @@ class AuthorizeRecurring(object):
     want to make changes to an existing recurring payment or to cancel a
     recurring payment, this provides the interface.
     """
+    __slots__ = ('_client', 'uid')
+    _fields = ('uid',)
+
     def __init__(self, client, uid):
-        self._client = client
-        self.uid = uid
+        self._set('_client', client)
+        self._set('uid', uid)
 
     def __repr__(self):
         return '<AuthorizeRecurring {0.uid}>'.format(self)
@@ -571,6 +839,11 @@ class AuthorizeRecurring(object):
             specify this option only if there have not yet been any non-trial
             payments.
         """
+        # Amounts are validated up front, before anything is sent
+        if amount is not None:
+            amount = Money(amount)
+        if trial_amount is not None:
+            trial_amount = Money(trial_amount)
         self._client._recurring.update_subscription(self.uid,
             amount=amount, start=start, occurrences=occurrences,
             trial_amount=trial_amount, trial_occurrences=trial_occurrences)
@@ -1,29 +1,113 @@
 """
-This module provides the data structures for describing credit cards and
-addresses for use in executing charges.
+This module provides the data structures for describing credit cards,
+addresses and amounts for use in executing charges.
 """
 
 import calendar
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 import re
 
 from authorize.exceptions import AuthorizeInvalidError
 
-CARD_TYPES = {
-    'visa': r'4\d{12}(\d{3})?$',
-    'amex': r'37\d{13}$',
-    'mc': r'5[1-5]\d{14}$',
-    'discover': r'6011\d{12}',
-    'diners': r'(30[0-5]\d{11}|(36|38)\d{12})$'
-}
+# The card types recognized, each as a range of the first digits of the card
+# number (both ends the same length) and the lengths the number may have.
+# Where ranges overlap, the one with the longer prefix wins.
+CARD_RANGES = (
+    ('visa', '4', '4', (13, 16, 19)),
+    ('amex', '34', '34', (15,)),
+    ('amex', '37', '37', (15,)),
+    ('mc', '51', '55', (16,)),
+    ('mc', '2221', '2720', (16,)),
+    ('discover', '6011', '6011', (16, 17, 18, 19)),
+    ('discover', '644', '649', (16, 17, 18, 19)),
+    ('discover', '65', '65', (16, 17, 18, 19)),
+    ('diners', '300', '305', (14,)),
+    ('diners', '36', '36', (14,)),
+    ('diners', '38', '38', (14,)),
+    ('jcb', '3528', '3589', (16, 17, 18, 19)),
+    ('unionpay', '62', '62', (16, 17, 18, 19)),
+    ('maestro', '5018', '5018', tuple(range(12, 20))),
+    ('maestro', '5020', '5020', tuple(range(12, 20))),
+    ('maestro', '5038', '5038', tuple(range(12, 20))),
+    ('maestro', '5893', '5893', tuple(range(12, 20))),
+    ('maestro', '6304', '6304', tuple(range(12, 20))),
+    ('maestro', '6759', '6759', tuple(range(12, 20))),
+    ('maestro', '6761', '6763', tuple(range(12, 20))),
+)
 
 CUSTOMER_TYPES = ('individual', 'business')
 ACCOUNT_TYPES = ('checking', 'savings', 'businessChecking')
 ROUTING_NUMBER_TYPES = ('ABA', 'IBAN', 'SWIFT')
 ECHECK_TYPES = ('ARC', 'BOC', 'CCD', 'PPD', 'TEL', 'WEB')
 
+# The most amounts kept in the cache of formatted amounts before it is reset
+AMOUNT_CACHE_SIZE = 1024
+_amounts = {}
 
-class CreditCard(object):
+def _card_prefixes():
+    # Every prefix in CARD_RANGES, mapped to its card type and lengths
+    prefixes = {}
+    for card_type, first, last, lengths in CARD_RANGES:
+        for prefix in xrange(int(first), int(last) + 1):
+            prefixes[str(prefix)] = (card_type, frozenset(lengths))
+    return prefixes
+
+_card_types = _card_prefixes()
+# Prefix lengths to try, longest first
+_prefix_lengths = sorted(set(len(prefix) for prefix in _card_types),
+    reverse=True)
+
+
+class Immutable(object):
+    """
+    Base class for objects that cannot be changed once created. Subclasses
+    list their attributes in ``__slots__``, so instances carry no
+    ``__dict__``, and name the ones that identify them in ``_fields``.
+    Instances compare equal, and hash the same, when they are of the same
+    class and those fields are equal, so they can be used as cache keys.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} is immutable.'.format(
+            self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{0} is immutable.'.format(
+            self.__class__.__name__))
+
+    def _set(self, name, value):
+        # Only for filling in attributes while the object is created
+        object.__setattr__(self, name, value)
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._key() != other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+            if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            self._set(name, value)
+
+
+class CreditCard(Immutable):
     """
     Represents a credit card that can be charged.
     
@@ -31,16 +115,22 @@ class CreditCard(object):
     a first name and last name. The card will be validated upon instatiation
     and will raise an
     :class:`AuthorizeInvalidError <authorize.exceptions.AuthorizeInvalidError>`
-    for invalid credit card numbers, past expiration dates, etc.
+    for invalid credit card numbers, past expiration dates, etc. Cards are
+    :class:`Immutable <authorize.data.Immutable>`, and equal when all these
+    fields are.
     """
+    __slots__ = ('card_number', 'exp_year', 'exp_month', 'cvv', 'first_name',
+        'last_name', '_card_type', '_expiration')
+    _fields = __slots__[:6]
+
     def __init__(self, card_number=None, exp_year=None, exp_month=None,
                 cvv=None, first_name=None, last_name=None):
-        self.card_number = re.sub(r'\D', '', str(card_number))
-        self.exp_year = str(exp_year)
-        self.exp_month = str(exp_month)
-        self.cvv = str(cvv)
-        self.first_name = first_name
-        self.last_name = last_name
+        self._set('card_number', re.sub(r'\D', '', str(card_number)))
+        self._set('exp_year', str(exp_year))
+        self._set('exp_month', str(exp_month))
+        self._set('cvv', str(cvv))
+        self._set('first_name', first_name)
+        self._set('last_name', last_name)
         self.validate()
 
     def __repr__(self):
@@ -59,21 +149,31 @@ class CreditCard(object):
             raise AuthorizeInvalidError('Credit card number is not valid.')
         if sum(num[::-2] + map(lambda d: sum(divmod(d * 2, 10)), num[-2::-2])) % 10:
             raise AuthorizeInvalidError('Credit card number is not valid.')
-        if datetime.now() > self.expiration:
+        self._set('_card_type', find_card_type(self.card_number))
+        self._set('_expiration', self._find_expiration())
+        if datetime.now() > self._expiration:
             raise AuthorizeInvalidError('Credit card is expired.')
         if not re.match(r'^[\d+]{3,4}$', self.cvv):
             raise AuthorizeInvalidError('Credit card CVV is invalid format.')
-        if not self.card_type:
+        if not self._card_type:
             raise AuthorizeInvalidError('Credit card number is not valid.')
 
+    def _find_expiration(self):
+        return datetime(int(self.exp_year), int(self.exp_month),
+            calendar.monthrange(int(self.exp_year), int(self.exp_month))[1],
+            23, 59, 59)
+
     @property
     def expiration(self):
         """
-        The credit card expiration date as a ``datetime`` object.
+        The credit card expiration date as a ``datetime`` object, worked out
+        once when the card is validated.
         """
-        return datetime(int(self.exp_year), int(self.exp_month),
-            calendar.monthrange(int(self.exp_year), int(self.exp_month))[1],
-            23, 59, 59)
+        try:
+            return self._expiration
+        except AttributeError:
+            self._set('_expiration', self._find_expiration())
+            return self._expiration
 
     @property
     def safe_number(self):
@@ -82,22 +182,36 @@ class CreditCard(object):
         is useful for storing a representation of the card without keeping
         sensitive data.
         """
-        mask = '*' * (len(self.card_number) - 4)
-        return '{0}{1}'.format(mask, self.card_number[-4:])
+        return mask_number(self.card_number)
 
     @property
     def card_type(self):
         """
         The credit card issuer, such as Visa or American Express, which is
-        determined from the credit card number. Recognizes Visa, American
-        Express, MasterCard, Discover, and Diners Club.
+        determined from the credit card number when the card is validated.
+        Recognizes Visa, American Express, MasterCard, Discover, Diners Club,
+        JCB, UnionPay and Maestro.
+        """
+        try:
+            return self._card_type
+        except AttributeError:
+            self._set('_card_type', find_card_type(self.card_number))
+            return self._card_type
+
+    @property
+    def bin_info(self):
+        """
+        What is known about the issuer of the card, such as its name and
+        country and whether it is a debit or prepaid card, as a
+        :class:`BinInfo <authorize.bins.BinInfo>` from the index loaded with
+        :func:`authorize.bins.load`. ``None`` if no index is loaded or the
+        card is not in it.
         """
-        for card_type, card_type_re in CARD_TYPES.items():
-            if re.match(card_type_re, self.card_number):
-                return card_type
+        from authorize import bins
+        return bins.lookup(self.card_number)
 
 
-class BankAccount(object):
+class BankAccount(Immutable):
     """
     Represents a bank account that can be charged.
     
@@ -105,22 +219,29 @@ class BankAccount(object):
     a first name and last name. The account will be validated upon instantiation
     and will raise an
     :class:`AuthorizeInvalidError <authorize.exceptions.AuthorizeInvalidError>`
-    for invalid bank account numbers, past expiration dates, etc.
+    for invalid bank account numbers, past expiration dates, etc. Accounts are
+    :class:`Immutable <authorize.data.Immutable>`, and equal when all these
+    fields are.
     """
+    __slots__ = _fields = ('first_name', 'last_name', 'company', 'bank_name',
+        'routing_number', 'account_number', 'customer_type', 'account_type',
+        'routing_number_type', 'echeck_type')
+
     def __init__(self, first_name=None, last_name=None, company=None,
                  bank_name=None, routing_number=None, account_number=None,
                  customer_type='individual', account_type='checking',
                  routing_number_type='ABA', echeck_type='WEB'):
-        self.first_name = first_name
-        self.last_name = last_name
-        self.company = company
-        self.bank_name = bank_name
-        self.routing_number = re.sub(r'[^0-9A-Za-z]', '', str(routing_number))
-        self.account_number = re.sub(r'\D', '', str(account_number))
-        self.customer_type = customer_type
-        self.account_type = account_type
-        self.routing_number_type = routing_number_type
-        self.echeck_type = echeck_type
+        self._set('first_name', first_name)
+        self._set('last_name', last_name)
+        self._set('company', company)
+        self._set('bank_name', bank_name)
+        self._set('routing_number',
+            re.sub(r'[^0-9A-Za-z]', '', str(routing_number)))
+        self._set('account_number', re.sub(r'\D', '', str(account_number)))
+        self._set('customer_type', customer_type)
+        self._set('account_type', account_type)
+        self._set('routing_number_type', routing_number_type)
+        self._set('echeck_type', echeck_type)
         self.validate()
 
     def __repr__(self):
@@ -141,6 +262,16 @@ class BankAccount(object):
         if self.customer_type == 'business':
             if self.company is None or not self.company.strip():
                 raise AuthorizeInvalidError('Company name is required.')
+        # With a FedACH directory loaded, ABA routing numbers must be in it,
+        # and it supplies the bank name if none was given
+        from authorize import routing
+        directory = routing.loaded()
+        routing_info = None
+        if directory is not None and self.routing_number_type == 'ABA':
+            routing_info = directory.lookup(self.routing_number)
+            if routing_info is not None and \
+                    (self.bank_name is None or not self.bank_name.strip()):
+                self._set('bank_name', routing_info.name)
         if self.bank_name is None or not self.bank_name.strip():
             raise AuthorizeInvalidError('Bank name is required.')
         if self.routing_number is None or not self.routing_number.strip():
@@ -166,6 +297,10 @@ class BankAccount(object):
             raise AuthorizeInvalidError('eCheck type is not valid.')
         self._validate_account_number(self.account_number)
         self._validate_aba(self.routing_number)
+        if directory is not None and self.routing_number_type == 'ABA' and \
+                routing_info is None:
+            raise AuthorizeInvalidError('Bank routing number is not in the '
+                'FedACH directory.')
 
     @staticmethod
     def _validate_account_number(account_number):
@@ -192,6 +327,17 @@ class BankAccount(object):
         if num[8] != checksum:
             raise AuthorizeInvalidError('Bank routing number is not valid.')
 
+    @property
+    def routing_info(self):
+        """
+        The financial institution the routing number belongs to, as a
+        :class:`RoutingInfo <authorize.routing.RoutingInfo>` from the FedACH
+        directory loaded with :func:`authorize.routing.load`. ``None`` if no
+        directory is loaded or the routing number is not in it.
+        """
+        from authorize import routing
+        return routing.lookup(self.routing_number)
+
     @property
     def safe_number(self):
         """
@@ -199,22 +345,145 @@ class BankAccount(object):
         is useful for storing a representation of the account without keeping
         sensitive data.
         """
-        mask = '*' * (len(self.account_number) - 4)
-        return '{0}{1}'.format(mask, self.account_number[-4:])
+        return mask_number(self.account_number)
 
-class Address(object):
+class Address(Immutable):
     """
     Represents a billing address for a charge. Pass in the street, city, state
-    and zip code, and optionally country for the address.
+    and zip code, and optionally country for the address. Addresses are
+    :class:`Immutable <authorize.data.Immutable>`, and equal when all these
+    fields are.
     """
+    __slots__ = _fields = ('street', 'city', 'state', 'zip_code', 'country')
+
     def __init__(self, street=None, city=None, state=None, zip_code=None,
             country='US'):
-        self.street = street
-        self.city = city
-        self.state = state
-        self.zip_code = zip_code
-        self.country = country
+        self._set('street', street)
+        self._set('city', city)
+        self._set('state', state)
+        self._set('zip_code', zip_code)
+        self._set('country', country)
 
     def __repr__(self):
         return '<Address {0.street}, {0.city}, {0.state} {0.zip_code}>' \
             .format(self)
+
+class Money(Immutable):
+    """
+    Represents an amount of money, held as a whole number of cents.
+
+    Pass in the amount in dollars as an int, a ``Decimal``, a string such as
+    ``'20.50'``, or another ``Money`` instance. A float is accepted only if
+    it converts exactly to whole cents. The amount will be validated upon
+    instantiation and will raise an
+    :class:`AuthorizeInvalidError <authorize.exceptions.AuthorizeInvalidError>`
+    for negative amounts or fractions of a cent, rather than rounding them.
+    Use :meth:`from_cents` if you already have the amount in cents. Amounts
+    are :class:`Immutable <authorize.data.Immutable>`, and equal when they
+    hold the same number of cents.
+    """
+    __slots__ = ('cents',)
+    _fields = __slots__
+
+    def __init__(self, amount):
+        self._set('cents', self._to_cents(amount))
+
+    @classmethod
+    def from_cents(cls, cents):
+        """
+        Returns a ``Money`` instance for a whole number of ``cents``.
+        """
+        money = cls.__new__(cls)
+        if isinstance(cents, bool) or not isinstance(cents, (int, long)):
+            raise AuthorizeInvalidError('Cents must be a whole number.')
+        if cents < 0:
+            raise AuthorizeInvalidError('Amount may not be negative.')
+        money._set('cents', cents)
+        return money
+
+    def __repr__(self):
+        return '<Money {0}>'.format(self)
+
+    def __str__(self):
+        return '{0}.{1:02d}'.format(*divmod(self.cents, 100))
+
+    def __nonzero__(self):
+        return bool(self.cents)
+
+    @property
+    def amount(self):
+        """
+        The amount in dollars as a ``Decimal``.
+        """
+        return Decimal(self.cents) / 100
+
+    @staticmethod
+    def _to_cents(amount):
+        if isinstance(amount, Money):
+            return amount.cents
+        if isinstance(amount, bool):
+            raise AuthorizeInvalidError('Amount is not valid.')
+        if isinstance(amount, (int, long)):
+            cents = amount * 100
+        else:
+            try:
+                if isinstance(amount, float):
+                    # The shortest repr is what the float was written as
+                    amount = Decimal(repr(amount))
+                elif isinstance(amount, basestring):
+                    amount = Decimal(amount.strip())
+                elif not isinstance(amount, Decimal):
+                    raise AuthorizeInvalidError('Amount is not valid.')
+                if not amount.is_finite():
+                    raise AuthorizeInvalidError('Amount is not valid.')
+            except InvalidOperation:
+                raise AuthorizeInvalidError('Amount is not valid.')
+            cents = amount * 100
+            if cents != cents.to_integral_value():
+                raise AuthorizeInvalidError('Amount may not include '
+                    'fractions of a cent.')
+            cents = int(cents)
+        if cents < 0:
+            raise AuthorizeInvalidError('Amount may not be negative.')
+        return cents
+
+def find_card_type(card_number):
+    """
+    Returns the card type of a credit card number, as a string of digits,
+    from ``CARD_RANGES``, or ``None`` if it matches no card type.
+    """
+    for length in _prefix_lengths:
+        match = _card_types.get(card_number[:length])
+        if match is not None:
+            card_type, lengths = match
+            return card_type if len(card_number) in lengths else None
+
+def mask_number(number):
+    """
+    Returns a card or account number with all but the last four digits
+    masked, as the ``safe_number`` of :class:`CreditCard` and
+    :class:`BankAccount` do.
+    """
+    mask = '*' * (len(number) - 4)
+    return '{0}{1}'.format(mask, number[-4:])
+
+def format_amount(amount):
+    """
+    Validates ``amount`` as :class:`Money <authorize.data.Money>` does and
+    returns it formatted in dollars and cents, such as ``'20.50'``, as the
+    Authorize.net APIs expect. Results are cached, so batches that charge the
+    same few amounts skip the conversion.
+    """
+    key = (type(amount), amount)
+    try:
+        return _amounts[key]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable, so it cannot be cached
+        return str(Money(amount))
+    formatted = str(Money(amount))
+    if len(_amounts) >= AMOUNT_CACHE_SIZE:
+        _amounts.clear()
+    _amounts[key] = formatted
+    return formatted
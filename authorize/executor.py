@@ -0,0 +1,104 @@
+"""
+This module provides the executor for running large batches of calls to
+Authorize.net concurrently, such as nightly settlement jobs, so that a batch
+takes about as long as its slowest calls rather than the sum of them all.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+
+class AuthorizeExecutor(object):
+    """
+    Runs calls to Authorize.net on ``max_workers`` worker threads. You get
+    one from
+    :meth:`AuthorizeClient.executor <authorize.client.AuthorizeClient.executor>`.
+
+    Use :meth:`submit` to queue any operation, such as the ``settle`` method
+    of a transaction or the ``capture`` method of a saved card. It returns a
+    ``concurrent.futures.Future`` for that item's result, or for the
+    :class:`AuthorizeResponseError <authorize.exceptions.AuthorizeResponseError>`
+    or
+    :class:`AuthorizeConnectionError <authorize.exceptions.AuthorizeConnectionError>`
+    it raised, so one failure never stops the rest of a batch.
+
+    If ``max_pending`` is given, at most that many calls wait in the queue
+    beyond those being worked on, and :meth:`submit` blocks until there is
+    room. This keeps a producer reading from a large file from getting far
+    ahead of the gateway.
+
+    Used as a context manager, the executor waits for every submitted call
+    to finish when the block ends, or cancels those not yet started if the
+    block raises.
+    """
+    def __init__(self, max_workers=10, max_pending=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._slots = None
+        if max_pending is not None:
+            self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def __repr__(self):
+        return '<AuthorizeExecutor max_workers={0.max_workers} ' \
+            'outstanding={1}>'.format(self, len(self._futures))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True, cancel=exc_type is not None)
+
+    def submit(self, op, *args, **kwargs):
+        """
+        Queues ``op(*args, **kwargs)`` and returns a future for its result.
+        Blocks while ``max_pending`` calls are already waiting.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            future = self._executor.submit(op, *args, **kwargs)
+        except:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def drain(self, timeout=None):
+        """
+        Waits for every call submitted so far to finish, or for ``timeout``
+        seconds. Returns the set of futures still outstanding, which is empty
+        unless the timeout ran out.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        return wait(futures, timeout).not_done
+
+    def cancel(self):
+        """
+        Cancels every submitted call that has not started yet. Calls already
+        in progress are left to finish. Returns the number cancelled.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        return len([future for future in futures if future.cancel()])
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        Stops accepting new calls. With ``cancel``, calls not yet started
+        are cancelled first. With ``wait``, blocks until the rest finish.
+        """
+        if cancel:
+            self.cancel()
+        self._executor.shutdown(wait)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        if self._slots is not None:
+            self._slots.release()
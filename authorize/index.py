@@ -0,0 +1,114 @@
+"""
+Read-only lookup tables kept in files and memory-mapped, used for the local
+BIN range index (:mod:`authorize.bins`) and routing number directory
+(:mod:`authorize.routing`).
+
+An index file holds a header, fixed-size records sorted by the number they
+start with, and a table of the strings the records refer to by number.
+Opening an index maps the file rather than reading it, so it is instant and
+every process using the file shares one copy through the page cache.
+"""
+
+import mmap
+import struct
+
+
+# Magic, number of records, number of strings
+HEADER = struct.Struct('>8sII')
+STRING_OFFSET = struct.Struct('>I')
+STRING_SPAN = struct.Struct('>II')
+
+
+class MappedIndex(object):
+    """
+    Base class for memory-mapped indexes. Subclasses set ``MAGIC``, the
+    struct for their ``RECORD`` and the struct for the ``KEY`` it starts
+    with. Raises ``ValueError`` if the file at ``path`` is not an index of
+    the right kind.
+    """
+    MAGIC = None
+    RECORD = None
+    KEY = None
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self._count, strings = HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = None
+        if magic != self.MAGIC:
+            self._map.close()
+            raise ValueError('{0} is not a {1}.'.format(path,
+                self.__class__.__name__))
+        self._offsets = HEADER.size + self.RECORD.size * self._count
+        self._strings = self._offsets + STRING_OFFSET.size * (strings + 1)
+
+    def __repr__(self):
+        return '<{0} {1} {2} records>'.format(self.__class__.__name__,
+            self.path, self._count)
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, position):
+        return self.RECORD.unpack_from(self._map,
+            HEADER.size + self.RECORD.size * position)
+
+    def _string(self, number):
+        start, end = STRING_SPAN.unpack_from(self._map,
+            self._offsets + STRING_OFFSET.size * number)
+        return self._map[self._strings + start:self._strings + end] \
+            .decode('utf-8')
+
+    def _search(self, key, low=0):
+        # Returns the position of the first record after the ones whose key
+        # is at or below the given key, searching from position low
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if key < self.KEY.unpack_from(self._map,
+                    HEADER.size + self.RECORD.size * middle)[0]:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def close(self):
+        self._map.close()
+
+class StringTable(object):
+    """
+    Collects the strings for an index being built, numbering each distinct
+    string once.
+    """
+    def __init__(self):
+        self._numbers = {}
+
+    def __call__(self, value):
+        return self._numbers.setdefault(value, len(self._numbers))
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __iter__(self):
+        return iter(sorted(self._numbers, key=self._numbers.get))
+
+def write_index(path, magic, record, records, strings):
+    """
+    Writes an index to ``path``, with the given ``magic``, ``records``
+    (tuples packed with the ``record`` struct, already sorted) and
+    :class:`StringTable`.
+    """
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(magic, len(records), len(strings)))
+        for values in records:
+            f.write(record.pack(*values))
+        blobs = list(strings)
+        offset = 0
+        f.write(STRING_OFFSET.pack(offset))
+        for blob in blobs:
+            offset += len(blob)
+            f.write(STRING_OFFSET.pack(offset))
+        f.write(''.join(blobs))
@@ -0,0 +1,428 @@
+"""
+Measurement of the calls made to Authorize.net.
+
+Every call made by the basic transaction, saved payment and recurring
+billing APIs is timed, along with the bytes it sent and received and how it
+turned out. Each :class:`AuthorizeClient <authorize.client.AuthorizeClient>`
+records its calls in an :class:`Instrumentation`, which keeps a latency
+histogram and counters for every operation, and calls any hooks added to
+it before and after each call. The numbers can be read with
+:meth:`Instrumentation.stats`, or exported in the Prometheus text format
+with :meth:`Instrumentation.prometheus`.
+
+The histograms are log-linear, in the manner of HdrHistogram: latencies are
+counted in microsecond buckets whose width grows with the latency, so that
+any percentile is accurate to within about 3% however long the tail, in a
+few hundred counters per operation.
+
+An :class:`Instrumentation` created with ``phases=True`` also breaks each
+call down into the phases in ``PHASES``: building the request
+(``serialize``), resolving the host name (``dns``), opening the TCP
+connection (``connect``), the TLS handshake (``tls``), sending the request
+(``write``), waiting for the response to start (``ttfb``, which includes the
+time Authorize.net takes to process it), reading it (``read``) and handling
+it (``parse``). The connection phases only take time when a new connection
+is opened rather than one reused from the pool. Saved payment and recurring
+billing calls made through suds count its marshalling as ``serialize`` and
+``parse``, as everything the library does before the request is sent and
+after the response is read is.
+"""
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeResponseError
+from authorize.process import PerProcess
+
+
+log = logging.getLogger(__name__)
+# How a call turned out
+OK = 'ok'
+RESPONSE_ERROR = 'response_error'
+CONNECTION_ERROR = 'connection_error'
+ERROR = 'error'
+OUTCOMES = (OK, RESPONSE_ERROR, CONNECTION_ERROR, ERROR)
+# Each power of two of microseconds is split into this many buckets
+SUB_BUCKET_BITS = 6
+# The bucket boundaries, in seconds, exported to Prometheus
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0, 30.0)
+PERCENTILES = (50, 90, 99, 99.9)
+PHASES = ('serialize', 'dns', 'connect', 'tls', 'write', 'ttfb', 'read',
+    'parse')
+
+_current = threading.local()
+
+
+class Call(object):
+    """
+    A call to Authorize.net, as passed to the hooks of an
+    :class:`Instrumentation`. ``api`` is ``'transaction'``, ``'customer'``
+    or ``'recurring'``, and ``operation`` is the name the API gives the call,
+    such as ``'AUTH_ONLY'`` or ``'ARBCreateSubscription'``. Once it is over,
+    ``duration`` is in seconds, and ``outcome`` is one of ``OUTCOMES``, with
+    the exception raised, if any, as ``error``. If phases are being
+    recorded, ``phases`` is a dictionary of the seconds spent in each of
+    ``PHASES``; otherwise it is ``None``. Until the call is over, ``request``
+    is the last request it sent, unredacted.
+    """
+    __slots__ = ('api', 'operation', 'started', 'duration', 'bytes_sent',
+        'bytes_received', 'outcome', 'error', 'phases', 'request', '_mark')
+
+    def __init__(self, api, operation, phases=False):
+        self.api = api
+        self.operation = operation
+        self.started = self._mark = time.time()
+        self.duration = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.outcome = None
+        self.error = None
+        self.phases = {} if phases else None
+        self.request = None
+
+    def lap(self, phase):
+        """
+        Ends ``phase``, which started when the one before it ended, adding
+        its time to ``phases``. Does nothing if phases are not recorded.
+        """
+        if self.phases is not None:
+            now = time.time()
+            self.phases[phase] = self.phases.get(phase, 0.0) + now - self._mark
+            self._mark = now
+
+    def __repr__(self):
+        return '<Call {0.api} {0.operation} {0.outcome}>'.format(self)
+
+class LatencyHistogram(object):
+    """
+    Counts latencies in log-linear buckets of microseconds. Not thread-safe
+    by itself; :class:`Instrumentation` records under a lock.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket(microseconds):
+        half = 1 << (SUB_BUCKET_BITS - 1)
+        exponent = microseconds.bit_length() - SUB_BUCKET_BITS
+        if exponent <= 0:
+            return microseconds
+        return exponent * half + (microseconds >> exponent)
+
+    @staticmethod
+    def _highest(bucket):
+        # The highest latency in microseconds that falls in the bucket
+        half = 1 << (SUB_BUCKET_BITS - 1)
+        if bucket < 2 * half:
+            return bucket
+        exponent = bucket // half - 1
+        return ((bucket % half + half + 1) << exponent) - 1
+
+    def record(self, seconds):
+        bucket = self._bucket(max(int(seconds * 1e6), 0))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        The latency in seconds that ``percent`` of calls took no longer than.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(percent / 100.0 * self.count, 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._highest(bucket) / 1e6, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """
+        The number of calls that took no longer than each of ``bounds``, in
+        seconds, as Prometheus histogram buckets count them.
+        """
+        counts = [0] * len(bounds)
+        for bucket, count in self.counts.items():
+            highest = self._highest(bucket) / 1e6
+            for position, bound in enumerate(bounds):
+                if highest <= bound:
+                    counts[position] += count
+        return counts
+
+class _Operation(object):
+    # What is recorded for each API and operation
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Total seconds in each phase, over the calls that recorded phases
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.phased = 0
+
+class Instrumentation(PerProcess):
+    """
+    Records the calls made to Authorize.net. One can be shared by several
+    clients, by passing it to each as ``instrumentation``.
+
+    Hooks are called with the :class:`Call`: ``before`` hooks as it starts
+    and ``after`` hooks once it is over, whether or not it succeeded. They
+    run on the thread making the call, so should be quick; an exception in
+    a hook is logged and does not affect the call.
+
+    With ``phases`` set, each call is also broken down into ``PHASES``,
+    at the cost of a few more clock readings per call. A ``recorder``, such
+    as a :class:`FlightRecorder <authorize.recorder.FlightRecorder>`, is
+    called with each call once it is over, before the other ``after``
+    hooks.
+
+    A forked child starts over with no numbers, so that each process
+    reports only its own calls. So does a copy unpickled in another process,
+    which keeps the settings, recorder and hooks; the hooks must then be
+    functions that can be pickled.
+    """
+    _per_process = ('_pid', '_lock', '_operations')
+
+    def __init__(self, phases=False, recorder=None):
+        self.phases = phases
+        self.recorder = recorder
+        self.before_hooks = []
+        self.after_hooks = [recorder] if recorder is not None else []
+        self._reset()
+
+    def _reset(self):
+        PerProcess._reset(self)
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def add_hook(self, before=None, after=None):
+        """
+        Adds a ``before`` hook, an ``after`` hook, or both.
+        """
+        if before is not None:
+            self.before_hooks.append(before)
+        if after is not None:
+            self.after_hooks.append(after)
+
+    def _run_hooks(self, hooks, call):
+        for hook in hooks:
+            try:
+                hook(call)
+            except Exception:
+                log.exception('Instrumentation hook %r failed.', hook)
+
+    def record(self, call):
+        """
+        Adds a finished :class:`Call` to the histograms and counters.
+        """
+        key = (call.api, call.operation)
+        self._check_fork()
+        with self._lock:
+            operation = self._operations.get(key)
+            if operation is None:
+                operation = self._operations[key] = _Operation()
+            operation.latency.record(call.duration)
+            operation.outcomes[call.outcome] += 1
+            operation.bytes_sent += call.bytes_sent
+            operation.bytes_received += call.bytes_received
+            if call.phases is not None:
+                operation.phased += 1
+                for phase, seconds in call.phases.items():
+                    operation.phases[phase] += seconds
+
+    @contextmanager
+    def measure(self, api, operation):
+        """
+        Times the call made in the ``with`` block and records it. Yields the
+        :class:`Call`, which is also returned by :func:`current_call` on the
+        same thread until the block ends, so the connection pool can add the
+        bytes sent and received and time its phases. Afterwards, it is
+        returned by :func:`last_call`.
+        """
+        call = Call(api, operation, self.phases)
+        self._run_hooks(self.before_hooks, call)
+        outer = getattr(_current, 'call', None)
+        _current.call = call
+        start = call._mark = time.time()
+        try:
+            yield call
+        except AuthorizeResponseError as e:
+            call.outcome, call.error = RESPONSE_ERROR, e
+            raise
+        except AuthorizeConnectionError as e:
+            call.outcome, call.error = CONNECTION_ERROR, e
+            raise
+        except Exception as e:
+            call.outcome, call.error = ERROR, e
+            raise
+        else:
+            call.outcome = OK
+        finally:
+            call.lap('parse')
+            call.duration = time.time() - start
+            _current.call = outer
+            _current.last = call
+            self.record(call)
+            self._run_hooks(self.after_hooks, call)
+            # Only hooks get to see the request, which may hold card numbers
+            call.request = None
+
+    def reset(self):
+        """
+        Clears the histograms and counters.
+        """
+        self._check_fork()
+        with self._lock:
+            self._operations = {}
+
+    def stats(self):
+        """
+        Returns the numbers recorded so far, as a dictionary keyed by API and
+        then by operation. Each operation has its ``count`` of calls, the
+        ``count`` for each outcome, the ``bytes_sent`` and
+        ``bytes_received``, and its latency in seconds: ``mean``, ``max``
+        and each of ``PERCENTILES``, such as ``p99``. If phases have been
+        recorded, ``phases`` has the mean seconds spent in each.
+        """
+        stats = {}
+        self._check_fork()
+        with self._lock:
+            for (api, name), operation in self._operations.items():
+                latency = operation.latency
+                numbers = stats.setdefault(api, {})[name] = {
+                    'count': latency.count,
+                    'outcomes': dict(operation.outcomes),
+                    'bytes_sent': operation.bytes_sent,
+                    'bytes_received': operation.bytes_received,
+                    'mean': latency.total / latency.count,
+                    'max': latency.max,
+                }
+                for percent in PERCENTILES:
+                    numbers['p{0:g}'.format(percent)] = \
+                        latency.percentile(percent)
+                if operation.phased:
+                    numbers['phases'] = dict((phase, seconds /
+                        operation.phased) for phase, seconds
+                        in operation.phases.items())
+        return stats
+
+    def prometheus(self):
+        """
+        Returns the numbers recorded so far in the Prometheus text format,
+        as the ``authorize_call_duration_seconds`` histogram and the
+        ``authorize_calls_total``, ``authorize_bytes_sent_total`` and
+        ``authorize_bytes_received_total`` counters, labelled by ``api`` and
+        ``operation``. Recorded phases are exported as the
+        ``authorize_call_phase_seconds_total`` counter, labelled by
+        ``phase`` as well.
+        """
+        lines = []
+        self._check_fork()
+        with self._lock:
+            operations = sorted(self._operations.items())
+            lines.extend((
+                '# HELP authorize_call_duration_seconds Latency of calls to '
+                'Authorize.net.',
+                '# TYPE authorize_call_duration_seconds histogram',
+            ))
+            for (api, name), operation in operations:
+                labels = 'api="{0}",operation="{1}"'.format(api, name)
+                latency = operation.latency
+                for bound, count in zip(PROMETHEUS_BUCKETS,
+                        latency.cumulative(PROMETHEUS_BUCKETS)):
+                    lines.append('authorize_call_duration_seconds_bucket{{'
+                        '{0},le="{1!r}"}} {2}'.format(labels, bound, count))
+                lines.extend((
+                    'authorize_call_duration_seconds_bucket{{{0},le="+Inf"}} '
+                    '{1}'.format(labels, latency.count),
+                    'authorize_call_duration_seconds_sum{{{0}}} {1!r}'.format(
+                        labels, latency.total),
+                    'authorize_call_duration_seconds_count{{{0}}} {1}'.format(
+                        labels, latency.count),
+                ))
+            lines.extend((
+                '# HELP authorize_calls_total Calls to Authorize.net by '
+                'outcome.',
+                '# TYPE authorize_calls_total counter',
+            ))
+            for (api, name), operation in operations:
+                for outcome in OUTCOMES:
+                    lines.append('authorize_calls_total{{api="{0}",'
+                        'operation="{1}",outcome="{2}"}} {3}'.format(api, name,
+                        outcome, operation.outcomes[outcome]))
+            for field in ('bytes_sent', 'bytes_received'):
+                lines.extend((
+                    '# HELP authorize_{0}_total Bytes {1} Authorize.net.'
+                    .format(field, 'sent to' if field == 'bytes_sent'
+                        else 'received from'),
+                    '# TYPE authorize_{0}_total counter'.format(field),
+                ))
+                for (api, name), operation in operations:
+                    lines.append('authorize_{0}_total{{api="{1}",'
+                        'operation="{2}"}} {3}'.format(field, api, name,
+                        getattr(operation, field)))
+            phased = [(key, operation) for key, operation in operations
+                if operation.phased]
+            if phased:
+                lines.extend((
+                    '# HELP authorize_call_phase_seconds_total Time spent in '
+                    'each phase of calls to Authorize.net.',
+                    '# TYPE authorize_call_phase_seconds_total counter',
+                ))
+            for (api, name), operation in phased:
+                for phase in PHASES:
+                    lines.append('authorize_call_phase_seconds_total{{'
+                        'api="{0}",operation="{1}",phase="{2}"}} {3!r}'.format(
+                        api, name, phase, operation.phases[phase]))
+        return '\n'.join(lines) + '\n'
+
+class _Unmeasured(object):
+    # Stands in for Instrumentation.measure when there is no instrumentation
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+_UNMEASURED = _Unmeasured()
+
+def measure(instrumentation, api, operation):
+    """
+    Measures the call in the ``with`` block with ``instrumentation``, as
+    :meth:`Instrumentation.measure` does, or does nothing if it is ``None``.
+    """
+    if instrumentation is None:
+        return _UNMEASURED
+    return instrumentation.measure(api, operation)
+
+def current_call():
+    """
+    Returns the :class:`Call` being measured on this thread, or ``None``.
+    """
+    return getattr(_current, 'call', None)
+
+def last_call():
+    """
+    Returns the last :class:`Call` measured on this thread to finish, or
+    ``None``.
+    """
+    return getattr(_current, 'last', None)
+
+def lap(phase):
+    """
+    Ends ``phase`` of the call being measured on this thread, as
+    :meth:`Call.lap` does, if there is one.
+    """
+    call = getattr(_current, 'call', None)
+    if call is not None:
+        call.lap(phase)
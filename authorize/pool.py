@@ -0,0 +1,368 @@
+"""
+This module provides the keep-alive connection pool the APIs use to talk to
+Authorize.net, so that repeated calls reuse an established TCP and TLS
+connection instead of paying a full handshake every time.
+
+Like ``urllib``, pools honour the ``http_proxy``, ``https_proxy`` and
+``no_proxy`` environment variables. HTTPS requests are tunnelled through the
+proxy with ``CONNECT``, so the TLS connection is still made end to end with
+Authorize.net.
+
+Pools are safe to use across ``fork``: a child process notices that it has
+been forked the first time it uses a pool, and starts over with no
+connections rather than sharing the parent's sockets.
+"""
+
+from base64 import b64encode
+import errno
+import httplib
+import select
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+from authorize.instrument import current_call, lap
+from authorize.process import PerProcess
+
+
+# Errors sending on a reused connection that mean the server closed it while
+# it sat idle in the pool, before our request was ever read
+STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def _dropped(conn):
+    # An idle connection has nothing to read unless the server has closed it,
+    # or sent something it should not have; either way it cannot be reused
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class PooledResponse(object):
+    """
+    A fully read HTTP response. The body is read before the underlying
+    connection is handed back to the pool, so this object holds no socket.
+    """
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return '<PooledResponse {0.status} {0.reason}>'.format(self)
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class ConnectionPool(PerProcess):
+    """
+    A thread-safe pool of keep-alive HTTP and HTTPS connections, kept
+    separately for each host.
+
+    ``maxsize``
+        The most connections kept open to any one host. When ``block`` is
+        ``False`` (the default), extra connections are opened under load but
+        are closed instead of being returned to the pool. When ``block`` is
+        ``True``, callers wait for a connection to be handed back instead.
+
+    ``idle_timeout``
+        Seconds a connection may sit unused in the pool before it is closed
+        rather than reused. Authorize.net drops idle connections on its side
+        too, so this should stay reasonably short.
+
+    ``timeout``
+        Socket timeout in seconds for connecting and for each read.
+
+    ``proxies``
+        Proxy URLs by scheme, as ``urllib.getproxies`` returns them, which is
+        also where they are taken from by default. Pass an empty dictionary
+        to connect directly.
+    """
+    def __init__(self, maxsize=10, idle_timeout=60, timeout=30, block=False,
+            proxies=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.block = block
+        self.proxies = urllib.getproxies() if proxies is None else proxies
+        self._routes = {}
+        # Bumped by close(), so connections opened before it are not pooled
+        self._generation = 0
+        self._reset()
+
+    def __repr__(self):
+        return '<ConnectionPool maxsize={0.maxsize} idle={1}>'.format(
+            self, self.num_idle())
+
+    def num_idle(self):
+        """
+        The number of idle connections currently held open, across all hosts.
+        """
+        self._check_fork()
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def urlopen(self, url, data=None, headers=None):
+        """
+        Makes a request to ``url`` over a pooled connection and returns a
+        :class:`PooledResponse`. A ``GET`` is sent unless ``data`` is given,
+        in which case it is sent as the body of a ``POST``. Raises
+        ``IOError`` or ``httplib.HTTPException`` on connection failures.
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+        method = 'GET' if data is None else 'POST'
+        headers = dict(headers or {})
+        proxy = self._route(key)
+        if proxy is not None and parts.scheme == 'http':
+            # Plain HTTP goes to the proxy with the full URL instead
+            path = urlparse.urlunsplit(parts[:3] + (parts.query, ''))
+            headers.update(proxy[2])
+        call = current_call()
+        if call is not None:
+            call.request = url if data is None else data
+        lap('serialize')
+        conn, reused = self._get(key)
+        try:
+            if conn.sock is None:
+                self._open(conn)
+            try:
+                self._send(conn, method, path, data, headers)
+            except socket.error as e:
+                # A reused connection the server closed after it was checked
+                # can fail as the request is sent, when the server cannot
+                # have read it, so it is sent once more on a fresh
+                # connection. Once the request is sent it is never sent
+                # again, even if no response comes back: the server may have
+                # acted on it, and a charge must not be made twice.
+                if not reused or isinstance(e, socket.timeout) or \
+                        e.errno not in STALE_ERRNOS:
+                    raise
+                conn.close()
+                conn = self._connect(key)
+                self._open(conn)
+                self._send(conn, method, path, data, headers)
+            response = self._receive(conn)
+            body = response.read()
+            lap('read')
+        except:
+            conn.close()
+            self._put(key, None)
+            raise
+        if response.will_close:
+            conn.close()
+            conn = None
+        self._put(key, conn)
+        if call is not None:
+            call.bytes_sent += len(url) + len(data or '')
+            call.bytes_received += len(body)
+        return PooledResponse(response.status, response.reason,
+            dict(response.getheaders()), body)
+
+    def warm(self, url, connections=1):
+        """
+        Opens connections to the host of ``url`` ahead of time, so that they
+        are established and idle in the pool when the first requests are
+        made. Connections already idle in the pool count towards
+        ``connections``, which is capped at ``maxsize``.
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        opened = []
+        try:
+            for i in range(min(connections, self.maxsize)):
+                conn, reused = self._get(key)
+                opened.append(conn)
+                if not reused:
+                    self._open(conn)
+        except:
+            for conn in opened:
+                conn.close()
+                self._put(key, None)
+            raise
+        for conn in opened:
+            self._put(key, conn)
+
+    def evict_idle(self):
+        """
+        Closes any pooled connections that have been idle for longer than
+        ``idle_timeout``.
+        """
+        self._check_fork()
+        expired = []
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            for key, idle in self._idle.items():
+                expired.extend(conn for conn, used in idle if used < cutoff)
+                idle[:] = [(conn, used) for conn, used in idle
+                    if used >= cutoff]
+        for conn in expired:
+            conn.close()
+
+    def close(self):
+        """
+        Closes every idle connection in the pool. Connections currently in
+        use are closed as they are handed back.
+        """
+        self._check_fork()
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._generation += 1
+            self._lock.notify_all()
+        for connections in idle.values():
+            for conn, used in connections:
+                conn.close()
+
+    def _reset(self):
+        # Connections opened before a fork are the parent's. A child drops
+        # them rather than closing them, which would only close its own copy
+        # of each socket anyway.
+        PerProcess._reset(self)
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = {}
+        self._in_use = {}
+
+    def _route(self, key):
+        # The proxy for a host, as its host, port and any headers to
+        # authenticate with it, or None to connect directly
+        try:
+            return self._routes[key]
+        except KeyError:
+            pass
+        scheme, host, port = key
+        route = None
+        proxy = self.proxies.get(scheme)
+        if proxy and not urllib.proxy_bypass(host):
+            if '://' not in proxy:
+                proxy = 'http://' + proxy
+            parts = urlparse.urlsplit(proxy)
+            headers = {}
+            if parts.username is not None:
+                credentials = '{0}:{1}'.format(
+                    urllib.unquote(parts.username),
+                    urllib.unquote(parts.password or ''))
+                headers['Proxy-Authorization'] = 'Basic ' + b64encode(
+                    credentials)
+            route = (parts.hostname, parts.port or 80, headers)
+        self._routes[key] = route
+        return route
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = self._route(key)
+        if scheme == 'https':
+            if proxy is None:
+                conn = httplib.HTTPSConnection(host, port,
+                    timeout=self.timeout)
+            else:
+                conn = httplib.HTTPSConnection(proxy[0], proxy[1],
+                    timeout=self.timeout)
+                conn.set_tunnel(host, port, proxy[2])
+        else:
+            if proxy is not None:
+                host, port = proxy[:2]
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        conn.pool_generation = self._generation
+        return conn
+
+    def _open(self, conn):
+        # Connects as httplib would, but a step at a time, so that the call
+        # being measured can time each step
+        addresses = socket.getaddrinfo(conn.host, conn.port, 0,
+            socket.SOCK_STREAM)
+        lap('dns')
+        error = socket.error('getaddrinfo returned no addresses')
+        for family, socktype, proto, name, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(address)
+                break
+            except socket.error as e:
+                sock.close()
+                error = e
+        else:
+            raise error
+        if conn._tunnel_host:
+            # Through a proxy, connecting includes opening the tunnel
+            conn.sock = sock
+            conn._tunnel()
+            sock = conn.sock
+        lap('connect')
+        if isinstance(conn, httplib.HTTPSConnection):
+            try:
+                sock = conn._context.wrap_socket(sock,
+                    server_hostname=conn._tunnel_host or conn.host)
+            except:
+                sock.close()
+                raise
+            lap('tls')
+        conn.sock = sock
+
+    def _send(self, conn, method, path, data, headers):
+        conn.request(method, path, data, headers)
+        lap('write')
+
+    def _receive(self, conn):
+        response = conn.getresponse()
+        lap('ttfb')
+        return response
+
+    def _get(self, key):
+        # Hands out the most recently used idle connection that has not
+        # expired, or opens a new one. Returns (connection, reused).
+        self._check_fork()
+        expired = []
+        cutoff = time.time() - self.idle_timeout
+        conn = None
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            while True:
+                while idle:
+                    candidate, used = idle.pop()
+                    if used >= cutoff and not _dropped(candidate):
+                        conn = candidate
+                        break
+                    expired.append(candidate)
+                if conn is not None or not self.block or \
+                        self._in_use.get(key, 0) < self.maxsize:
+                    break
+                self._lock.wait()
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        for candidate in expired:
+            candidate.close()
+        if conn is not None:
+            return conn, True
+        try:
+            return self._connect(key), False
+        except:
+            self._put(key, None)
+            raise
+
+    def _put(self, key, conn):
+        # Returns a connection to the pool, or just frees its slot if the
+        # connection was closed, was opened before the pool was last closed,
+        # or the pool for that host is already full
+        with self._lock:
+            self._in_use[key] -= 1
+            idle = self._idle.setdefault(key, [])
+            if conn is not None and len(idle) < self.maxsize and \
+                    conn.pool_generation == self._generation:
+                idle.append((conn, time.time()))
+                conn = None
+            self._lock.notify()
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,41 @@
+"""
+This module provides the base class for objects that keep state that belongs
+to one process, such as locks and open sockets, so that clients can be
+created before a server forks its workers.
+"""
+
+import os
+
+
+class PerProcess(object):
+    """
+    Sets up its per-process state in :meth:`_reset`, and sets it up again
+    in a forked child the first time the child calls :meth:`_check_fork`.
+    A lock held by another of the parent's threads when it forked stays held
+    in the child, where that thread does not exist, so the child must never
+    use the parent's.
+
+    Subclasses extend :meth:`_reset`, calling it from ``__init__``, and call
+    :meth:`_check_fork` before touching that state. Those that can be
+    pickled list the attributes :meth:`_reset` sets up in ``_per_process``;
+    they are left out of the pickle, and set up afresh when it is loaded, as
+    they would be in a forked child.
+    """
+    _per_process = ('_pid',)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._per_process:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
@@ -0,0 +1,163 @@
+"""
+A flight recorder for the calls made to Authorize.net, to find out what
+happened around a latency spike or an outage in production without turning
+on full request logging.
+
+A :class:`FlightRecorder` added to an :class:`Instrumentation
+<authorize.instrument.Instrumentation>` keeps the last calls made, with
+their timings, outcome and request, in memory. Calls slower than its
+threshold are logged as warnings as they happen, and when a call fails with
+an :class:`AuthorizeConnectionError
+<authorize.exceptions.AuthorizeConnectionError>` the whole recording is
+logged as an error. Everything goes to the ``authorize.recorder`` logger.
+
+Card numbers, account numbers, CVVs and transaction keys are redacted from
+requests and errors before they are kept, so recordings are safe to log:
+card and account numbers are masked as their ``safe_number`` is, and the
+other values entirely. Anything else in a request or error that looks like a
+card number, such as one typed into a description or notes field, is masked
+too.
+"""
+
+from collections import deque, namedtuple
+from datetime import datetime
+import logging
+import re
+import threading
+
+from authorize.data import find_card_type, mask_number
+from authorize.instrument import CONNECTION_ERROR, PHASES
+from authorize.process import PerProcess
+
+
+log = logging.getLogger(__name__)
+# Fields masked as their safe_number is, and fields masked entirely, as they
+# are named in AIM query strings, SOAP envelopes and JSON requests
+NUMBER_FIELDS = ('x_card_num', 'x_bank_acct_num', 'cardNumber',
+    'accountNumber')
+SECRET_FIELDS = ('x_tran_key', 'x_card_code', 'transactionKey', 'cardCode')
+# Requests are cut to this many characters once redacted
+REQUEST_LIMIT = 2048
+
+# Any of the fields, as a query parameter, an element with or without a
+# namespace prefix, or a JSON key, with its value. Each name must follow one
+# of the characters that can come before it, which is much quicker to scan
+# for than the names themselves.
+_FIELDS = re.compile(r'([?&<:"])({0})(=|>|"\s*:\s*")([^&\s<"]*)'.format(
+    '|'.join(NUMBER_FIELDS + SECRET_FIELDS)))
+# Anything else that looks like a card number
+_CARD_NUMBER = re.compile(r'(?<!\d)\d{12,19}(?!\d)')
+
+
+def _mask_field(match):
+    before, name, separator, value = match.groups()
+    if name in NUMBER_FIELDS:
+        return before + name + separator + mask_number(value)
+    return before + name + separator + '*' * len(value)
+
+def _mask_card_number(match):
+    number = match.group()
+    if find_card_type(number):
+        return mask_number(number)
+    return number
+
+def redact(text):
+    """
+    Masks the card numbers, account numbers, CVVs and transaction keys in
+    the fields of ``text``, such as a request or an error message, and
+    anything else in it that looks like a card number.
+    """
+    # A leading separator lets a field at the very start match as well
+    text = _FIELDS.sub(_mask_field, '&' + text)[1:]
+    return _CARD_NUMBER.sub(_mask_card_number, text)
+
+class Record(namedtuple('Record', 'started api operation duration outcome '
+        'error bytes_sent bytes_received phases request')):
+    """
+    A call kept by a :class:`FlightRecorder`, as the fields of the
+    :class:`Call <authorize.instrument.Call>` it was made from, with the
+    ``error`` as a string and the ``request`` redacted.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        parts = [
+            datetime.utcfromtimestamp(self.started).isoformat(),
+            self.api,
+            self.operation,
+            self.outcome,
+            '{0:.3f}s'.format(self.duration),
+            'sent={0}'.format(self.bytes_sent),
+            'received={0}'.format(self.bytes_received),
+        ]
+        if self.phases:
+            parts.append(' '.join('{0}={1:.3f}'.format(phase,
+                self.phases[phase]) for phase in PHASES
+                if phase in self.phases))
+        if self.error:
+            parts.append('error={0}'.format(self.error))
+        if self.request:
+            parts.append('request={0}'.format(self.request))
+        return ' '.join(parts)
+
+class FlightRecorder(PerProcess):
+    """
+    Keeps the last ``size`` calls to Authorize.net, and logs calls that take
+    ``slow_threshold`` seconds or more. Add it to an :class:`Instrumentation
+    <authorize.instrument.Instrumentation>` as its ``recorder``. Like a
+    forked child, a pickled copy starts with no calls kept.
+    """
+    _per_process = ('_pid', '_lock', '_calls')
+
+    def __init__(self, size=100, slow_threshold=2.0):
+        self.size = size
+        self.slow_threshold = slow_threshold
+        self._reset()
+
+    def _reset(self):
+        PerProcess._reset(self)
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=self.size)
+
+    def __call__(self, call):
+        request = call.request
+        if request:
+            request = redact(request)[:REQUEST_LIMIT]
+        record = Record(call.started, call.api, call.operation,
+            call.duration, call.outcome,
+            redact(str(call.error)) if call.error is not None else None,
+            call.bytes_sent, call.bytes_received,
+            dict(call.phases) if call.phases else None, request)
+        self._check_fork()
+        with self._lock:
+            self._calls.append(record)
+        if self.slow_threshold is not None and \
+                call.duration >= self.slow_threshold:
+            log.warning('Slow call to Authorize.net: %s', record)
+        if call.outcome == CONNECTION_ERROR:
+            calls = self.calls()
+            log.error('Connection error calling Authorize.net; the last %d '
+                'calls were:\n%s', len(calls),
+                '\n'.join(str(record) for record in calls))
+
+    def calls(self):
+        """
+        Returns the :class:`Record` of each call kept, oldest first.
+        """
+        self._check_fork()
+        with self._lock:
+            return list(self._calls)
+
+    def dump(self):
+        """
+        Returns the calls kept, oldest first, one per line.
+        """
+        return '\n'.join(str(record) for record in self.calls())
+
+    def clear(self):
+        """
+        Forgets the calls kept.
+        """
+        self._check_fork()
+        with self._lock:
+            self._calls.clear()
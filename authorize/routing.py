@@ -0,0 +1,205 @@
+"""
+Local lookup of US bank routing numbers in the Federal Reserve's FedACH
+directory, which lists every routing number that can receive ACH (eCheck)
+payments.
+
+The directory file, in the fixed-width FedACH format published by the
+Federal Reserve, is compiled with :func:`build_directory` (or ``python -m
+authorize.routing FedACHdir.txt routing.idx``) into a memory-mapped index
+(see :mod:`authorize.index`) of routing numbers in order.
+
+Load a directory once at startup with :func:`load`. From then on
+:class:`BankAccount <authorize.data.BankAccount>` rejects ABA routing numbers
+that are not in it, even when their checksum is right, instead of leaving
+the payment to be returned later, and fills in a missing ``bank_name`` from
+it. :func:`lookup_all` looks up the routing numbers of a whole file at once.
+"""
+
+from collections import namedtuple
+import struct
+import sys
+
+from authorize.index import MappedIndex, StringTable, write_index
+
+
+MAGIC = 'AZACH\x00\x00\x01'
+# Where each field starts and ends in a line of the FedACH directory
+FIELDS = {
+    'routing_number': (0, 9),
+    'record_type': (19, 20),
+    'new_routing_number': (26, 35),
+    'name': (35, 71),
+    'city': (107, 127),
+    'state': (127, 129),
+    'zip_code': (129, 134),
+}
+# Record type 2 means items are sent on to the new routing number
+FORWARDED = '2'
+
+# Routing number, new routing number (0 for none), name and city string
+# numbers, state, zip code
+RECORD = struct.Struct('>IIII2s5s')
+ROUTING_NUMBER = struct.Struct('>I')
+
+_directory = None
+
+
+class RoutingInfo(namedtuple('RoutingInfo',
+        'routing_number name city state zip_code new_routing_number')):
+    """
+    A financial institution in the FedACH directory, by its
+    ``routing_number``: its ``name``, ``city``, ``state`` and ``zip_code``.
+    If the institution has moved its ACH payments to another routing number,
+    that is the ``new_routing_number``; otherwise it is ``None``.
+    """
+    __slots__ = ()
+
+
+class RoutingDirectory(MappedIndex):
+    """
+    A memory-mapped FedACH directory, opened from a file written by
+    :func:`build_directory`. Raises ``ValueError`` if the file is not one.
+    """
+    MAGIC = MAGIC
+    RECORD = RECORD
+    KEY = ROUTING_NUMBER
+
+    def _find(self, key, low=0):
+        # The position of the routing number if it is present, and where
+        # the search for any higher routing number can start
+        position = self._search(key, low)
+        if position and self._record(position - 1)[0] == key:
+            return position - 1, position
+        return None, position
+
+    def _info(self, position):
+        routing_number, new_routing_number, name, city, state, zip_code = \
+            self._record(position)
+        return RoutingInfo('{0:09d}'.format(routing_number),
+            self._string(name), self._string(city), state, zip_code,
+            '{0:09d}'.format(new_routing_number) if new_routing_number
+            else None)
+
+    def lookup(self, routing_number):
+        """
+        Returns the :class:`RoutingInfo` for ``routing_number``, a string of
+        nine digits, or ``None`` if it is not in the directory.
+        """
+        if len(routing_number) != 9 or not routing_number.isdigit():
+            return None
+        position = self._find(int(routing_number))[0]
+        if position is None:
+            return None
+        return self._info(position)
+
+    def lookup_all(self, routing_numbers):
+        """
+        Looks up many routing numbers at once, such as those of a file being
+        imported, and returns a list of the :class:`RoutingInfo` or ``None``
+        for each. The numbers are looked up in order, each search starting
+        where the last one left off.
+        """
+        routing_numbers = list(routing_numbers)
+        keys = {}
+        for routing_number in routing_numbers:
+            if len(routing_number) == 9 and routing_number.isdigit():
+                keys[routing_number] = int(routing_number)
+        found = {}
+        low = 0
+        for routing_number, key in sorted(keys.items(),
+                key=lambda item: item[1]):
+            position, low = self._find(key, low)
+            if position is not None:
+                found[routing_number] = self._info(position)
+        return [found.get(routing_number)
+            for routing_number in routing_numbers]
+
+def _field(line, name):
+    start, end = FIELDS[name]
+    return line[start:end].strip()
+
+def build_directory(source, path):
+    """
+    Compiles the FedACH directory file ``source`` into an index at
+    ``path``. Raises ``ValueError`` for malformed lines or repeated routing
+    numbers. Returns the number of routing numbers.
+    """
+    string = StringTable()
+    records = []
+    with open(source, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            routing_number = _field(line, 'routing_number')
+            zip_code = _field(line, 'zip_code')
+            if len(line) < FIELDS['zip_code'][1] or \
+                    len(routing_number) != 9 or \
+                    not routing_number.isdigit():
+                raise ValueError('Line {0} is not a FedACH directory entry.'
+                    .format(number))
+            new_routing_number = 0
+            if _field(line, 'record_type') == FORWARDED:
+                new_routing_number = _field(line, 'new_routing_number')
+                if not new_routing_number.isdigit():
+                    raise ValueError('Line {0} has no new routing number.'
+                        .format(number))
+                new_routing_number = int(new_routing_number)
+            records.append((
+                int(routing_number),
+                new_routing_number,
+                string(_field(line, 'name')),
+                string(_field(line, 'city')),
+                _field(line, 'state'),
+                zip_code,
+            ))
+    records.sort()
+    for previous, current in zip(records, records[1:]):
+        if current[0] == previous[0]:
+            raise ValueError('Routing number {0:09d} is listed twice.'.format(
+                current[0]))
+    write_index(path, MAGIC, RECORD, records, string)
+    return len(records)
+
+def load(path):
+    """
+    Opens the directory at ``path`` and makes it the one used by
+    :func:`lookup`, :func:`lookup_all` and :class:`BankAccount
+    <authorize.data.BankAccount>`. Returns the :class:`RoutingDirectory`.
+    """
+    global _directory
+    _directory = RoutingDirectory(path)
+    return _directory
+
+def loaded():
+    """
+    Returns the :class:`RoutingDirectory` opened by :func:`load`, or
+    ``None`` if none has been.
+    """
+    return _directory
+
+def lookup(routing_number):
+    """
+    Returns the :class:`RoutingInfo` for ``routing_number`` from the
+    directory opened by :func:`load`, or ``None`` if no directory is loaded
+    or the routing number is not in it.
+    """
+    directory = _directory
+    if directory is None:
+        return None
+    return directory.lookup(routing_number)
+
+def lookup_all(routing_numbers):
+    """
+    Looks up many routing numbers at once in the directory opened by
+    :func:`load`, as :meth:`RoutingDirectory.lookup_all` does. Every entry
+    is ``None`` if no directory is loaded.
+    """
+    directory = _directory
+    if directory is None:
+        return [None for routing_number in routing_numbers]
+    return directory.lookup_all(routing_numbers)
+
+if __name__ == '__main__':
+    count = build_directory(sys.argv[1], sys.argv[2])
+    print 'Wrote {0} routing numbers to {1}'.format(count, sys.argv[2])
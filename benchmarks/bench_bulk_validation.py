@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Measures the time spent validating a file's worth of credit cards, comparing
+authorize.bulk.validate_cards against creating a CreditCard for each row.
+Needs NumPy.
+
+    python benchmarks/bench_bulk_validation.py
+"""
+
+from datetime import date
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.path.pardir))
+
+from authorize import CreditCard
+from authorize.bulk import validate_cards
+from authorize.exceptions import AuthorizeInvalidError
+
+
+NUMBERS = ('4111111111111111', '5555555555554444', '370000000000002',
+    '6011000000000012', '38000000000006', '4111111111111112')
+ROWS = 100000
+
+
+def validate_per_row(numbers, exp_years, exp_months, cvvs):
+    errors = []
+    for row in zip(numbers, exp_years, exp_months, cvvs):
+        try:
+            CreditCard(*row)
+        except AuthorizeInvalidError as e:
+            errors.append(str(e))
+        else:
+            errors.append(None)
+    return errors
+
+def main():
+    year = date.today().year
+    numbers = [NUMBERS[i % len(NUMBERS)] for i in xrange(ROWS)]
+    exp_years = [year + i % 5 for i in xrange(ROWS)]
+    exp_months = [i % 12 + 1 for i in xrange(ROWS)]
+    cvvs = ['911'] * ROWS
+    columns = (numbers, exp_years, exp_months, cvvs)
+    cases = (
+        ('CreditCard per row', lambda: validate_per_row(*columns)),
+        ('validate_cards', lambda: validate_cards(*columns)),
+    )
+    results = []
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=1, repeat=3))
+        results.append(seconds)
+        print '{0:<20} {1:8.3f} us/card'.format(name, seconds / ROWS * 1e6)
+    print 'Speedup: {0:.2f}x'.format(results[0] / results[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Measures how long ``import authorize`` takes in a fresh interpreter, and
+fails if it is over ``IMPORT_BUDGET`` seconds or pulls in suds, which should
+wait until the saved payment or recurring billing APIs are first used.
+
+    python benchmarks/bench_import.py
+"""
+
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.path.pardir)
+IMPORT_BUDGET = 0.1
+REPEAT = 10
+MEASURE = '''
+import sys, time
+start = time.time()
+import {0}
+print time.time() - start, int(any(name.split('.')[0] == 'suds'
+    for name in sys.modules))
+'''
+
+
+def measure(module):
+    # The best of several runs, each in a new interpreter so nothing is
+    # already imported
+    runs = []
+    for i in range(REPEAT):
+        output = subprocess.check_output([sys.executable, '-c',
+            MEASURE.format(module)], cwd=ROOT)
+        seconds, suds = output.split()
+        runs.append((float(seconds), suds == '1'))
+    return min(runs)
+
+def main():
+    seconds, suds = measure('authorize')
+    print '{0:<28} {1:8.1f} ms{2}'.format('import authorize',
+        seconds * 1e3, ' (imports suds)' if suds else '')
+    soap_seconds, soap_suds = measure('authorize.apis.customer, '
+        'authorize.apis.soap')
+    print '{0:<28} {1:8.1f} ms'.format('with the SOAP APIs',
+        soap_seconds * 1e3)
+    if suds or seconds > IMPORT_BUDGET:
+        print 'Over budget: import authorize should take under ' \
+            '{0:.0f} ms without importing suds.'.format(IMPORT_BUDGET * 1e3)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Measures the CPU time suds spends on a saved payment charge
+(``CreateCustomerProfileTransaction``) and a new subscription
+(``ARBCreateSubscription``), with the network taken out, comparing cached
+service methods and cloned type prototypes against looking up the method and
+building every type from the schema on each call.
+
+The service definition is loaded from the bundled WSDL if there is one, and
+from Authorize.net otherwise, so the first run may need network access.
+
+    python benchmarks/bench_soap_calls.py
+"""
+
+from datetime import date, timedelta
+import httplib
+import os
+import sys
+import timeit
+
+from suds import WebFault
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.path.pardir))
+
+from authorize import CreditCard
+from authorize.apis.customer import CustomerAPI
+from authorize.apis.recurring import RecurringAPI
+from authorize.exceptions import AuthorizeConnectionError
+from authorize.pool import ConnectionPool, PooledResponse
+
+
+DIRECT_RESPONSE = (
+    '|1|;|1|;|1|;|This transaction has been approved.|;|IKRAGJ|;|Y|'
+    ';|2171062816|;||;||;|20.00|;|CC|;|auth_only|' + ';||' * 56)
+RESPONSES = {
+    'CreateCustomerProfileTransaction': (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><CreateCustomerProfileTransactionResponse xmlns="'
+        'https://api.authorize.net/soap/v1/">'
+        '<CreateCustomerProfileTransactionResult><resultCode>Ok</resultCode>'
+        '<messages><MessagesTypeMessage><code>I00001</code>'
+        '<text>Successful.</text></MessagesTypeMessage></messages>'
+        '<directResponse>' + DIRECT_RESPONSE + '</directResponse>'
+        '</CreateCustomerProfileTransactionResult>'
+        '</CreateCustomerProfileTransactionResponse></soap:Body>'
+        '</soap:Envelope>'),
+    'ARBCreateSubscription': (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><ARBCreateSubscriptionResponse xmlns="'
+        'https://api.authorize.net/soap/v1/"><ARBCreateSubscriptionResult>'
+        '<resultCode>Ok</resultCode><messages><MessagesTypeMessage>'
+        '<code>I00001</code><text>Successful.</text></MessagesTypeMessage>'
+        '</messages><subscriptionId>123</subscriptionId>'
+        '</ARBCreateSubscriptionResult></ARBCreateSubscriptionResponse>'
+        '</soap:Body></soap:Envelope>'),
+}
+NUMBER = 500
+
+
+class NullPool(ConnectionPool):
+    # Fetches the WSDL for real if it has to, but answers every SOAP call
+    # at once with a canned response
+    def urlopen(self, url, data=None, headers=None):
+        if data is None:
+            return ConnectionPool.urlopen(self, url, data, headers)
+        operation = headers['SOAPAction'].strip('"').rsplit('/', 1)[-1]
+        return PooledResponse(200, 'OK', {}, RESPONSES[operation])
+
+class Uncached(object):
+    # How every call was made before: build each type from the schema and
+    # look up the service method again
+    def _create(self, kind):
+        return self.client.factory.create(kind)
+
+    def _make_call(self, service, *args):
+        client_auth = self.client_auth
+        try:
+            with self.clients.checkout() as client:
+                method = getattr(client.client.service, service)
+                response = method(client_auth, *args)
+        except (WebFault, IOError, httplib.HTTPException) as e:
+            raise AuthorizeConnectionError(e)
+        return self._check_response(response)
+
+class UncachedCustomerAPI(Uncached, CustomerAPI):
+    pass
+
+class UncachedRecurringAPI(Uncached, RecurringAPI):
+    pass
+
+def main():
+    pool = NullPool()
+    credit_card = CreditCard('4111111111111111', date.today().year + 10, 1,
+        '911', 'Jeff', 'Schenck')
+    start = date.today() + timedelta(days=7)
+    for name, customer, recurring in (
+            ('uncached', UncachedCustomerAPI('123', '456', pool=pool),
+                UncachedRecurringAPI('123', '456', pool=pool)),
+            ('cached', CustomerAPI('123', '456', pool=pool),
+                RecurringAPI('123', '456', pool=pool))):
+        cases = (
+            ('CreateCustomerProfileTransaction',
+                lambda: customer.capture('1', '2', 20)),
+            ('ARBCreateSubscription',
+                lambda: recurring.create_subscription(credit_card, 10,
+                    start, months=1)),
+        )
+        for operation, case in cases:
+            # The first call loads the service definition
+            case()
+            seconds = min(timeit.repeat(case, number=NUMBER, repeat=3))
+            print '{0:<10} {1:<34} {2:8.1f} us/call'.format(name, operation,
+                seconds / NUMBER * 1e6)
+
+if __name__ == '__main__':
+    main()
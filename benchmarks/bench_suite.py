@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+"""
+Measures the CPU cost of each of the library's hot paths (parsing responses,
+building requests, validating payment data and marshalling saved payment and
+recurring billing calls) with the network taken out, and fails if any of them
+has got slower than the baselines in ``baselines.json`` by more than the
+tolerance, or has started holding on to objects.
+
+Each path is measured in calls per second, and in objects still alive per
+call after many calls, which catches leaks and caches that grow without
+bound. Python 2 has no way to count every allocation, so objects retained
+stand in for it.
+
+Speed is compared in calls per calibration run, the time this machine takes
+for a fixed piece of pure Python work, so that baselines carry over roughly
+between machines. Each case is timed in many short rounds, each between two
+calibration runs, so that anything slowing the machine down for a while slows
+both, and the median round is used. A case that still misses its baseline is
+measured once more before it counts as a regression. Record new baselines
+after an intended change with ``--update``, which refuses to write them if
+the rounds of any case are too spread out for the tolerance.
+
+    python benchmarks/bench_suite.py [--update] [--tolerance 0.3] [case ...]
+"""
+
+import argparse
+from datetime import date, timedelta
+import gc
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.path.pardir))
+
+from authorize import Address, BankAccount, CreditCard
+from authorize.apis.customer import CustomerAPI
+from authorize.apis.jsonapi import JSONCustomerAPI, JSONRecurringAPI
+from authorize.apis.recurring import RecurringAPI
+from authorize.apis.transaction import TransactionAPI, parse_response
+from authorize.instrument import Instrumentation
+from authorize.pool import ConnectionPool
+from authorize.recorder import FlightRecorder
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'baselines.json')
+TOLERANCE = 0.3
+# Extra objects retained per call allowed over the baseline
+RETAINED_TOLERANCE = 0.05
+# Rounds of calibration and case timings, and roughly how long each round
+# of a case takes
+ROUNDS = 41
+ROUND_SECONDS = 0.01
+CALIBRATION_NUMBER = 10
+# Calls made before counting retained objects, enough to fill any caches
+# and the flight recorder, and then while counting
+WARMUP = 200
+RETAINED_CALLS = 1000
+
+AIM_RESPONSE = (
+    '|1|;|1|;|1|;|This transaction has been approved.|;|IKRAGJ|;|Y|'
+    ';|2171062816|;||;||;|20.00|;|CC|;|auth_capture|;||;|Jeffrey|;|Schenck|'
+    ';||;|45 Rose Ave|;|Venice|;|CA|;|90291|;|USA|' + ';||' * 16 +
+    ';|375DD9293D7605E20DF0B437EE2A7B92|;|P|;|2|' + ';||' * 10 +
+    ';|XXXX1111|;|Visa|' + ';||' * 17)
+SOAP_RESPONSES = {
+    'CreateCustomerProfileTransaction': (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><CreateCustomerProfileTransactionResponse xmlns="'
+        'https://api.authorize.net/soap/v1/">'
+        '<CreateCustomerProfileTransactionResult><resultCode>Ok</resultCode>'
+        '<messages><MessagesTypeMessage><code>I00001</code>'
+        '<text>Successful.</text></MessagesTypeMessage></messages>'
+        '<directResponse>' + AIM_RESPONSE + '</directResponse>'
+        '</CreateCustomerProfileTransactionResult>'
+        '</CreateCustomerProfileTransactionResponse></soap:Body>'
+        '</soap:Envelope>'),
+    'ARBCreateSubscription': (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><ARBCreateSubscriptionResponse xmlns="'
+        'https://api.authorize.net/soap/v1/"><ARBCreateSubscriptionResult>'
+        '<resultCode>Ok</resultCode><messages><MessagesTypeMessage>'
+        '<code>I00001</code><text>Successful.</text></MessagesTypeMessage>'
+        '</messages><subscriptionId>123</subscriptionId>'
+        '</ARBCreateSubscriptionResult></ARBCreateSubscriptionResponse>'
+        '</soap:Body></soap:Envelope>'),
+}
+JSON_RESPONSES = {
+    'createTransactionRequest': json.dumps({
+        'transactionResponse': {
+            'responseCode': '1',
+            'authCode': 'IKRAGJ',
+            'avsResultCode': 'Y',
+            'cvvResultCode': 'P',
+            'transId': '2171062816',
+            'transHash': '375DD9293D7605E20DF0B437EE2A7B92',
+            'accountNumber': 'XXXX1111',
+            'accountType': 'Visa',
+            'messages': [{'code': '1',
+                'description': 'This transaction has been approved.'}],
+        },
+        'messages': {'resultCode': 'Ok',
+            'message': [{'code': 'I00001', 'text': 'Successful.'}]},
+    }),
+    'ARBCreateSubscriptionRequest': json.dumps({
+        'subscriptionId': '123',
+        'messages': {'resultCode': 'Ok',
+            'message': [{'code': 'I00001', 'text': 'Successful.'}]},
+    }),
+}
+
+
+class CannedResponse(object):
+    status = 200
+    reason = 'OK'
+    will_close = False
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheaders(self):
+        return []
+
+class CannedConnection(object):
+    # Stands in for an open keep-alive connection, answering each request
+    # with the canned response for it
+    sock = True
+
+    def request(self, method, path, data, headers):
+        if 'SOAPAction' in headers:
+            operation = headers['SOAPAction'].strip('"').rsplit('/', 1)[-1]
+            body = SOAP_RESPONSES[operation]
+        elif data is not None:
+            body = JSON_RESPONSES[data[2:data.index('"', 2)]]
+        else:
+            body = AIM_RESPONSE
+        self.response = CannedResponse(body)
+
+    def getresponse(self):
+        return self.response
+
+class CannedPool(ConnectionPool):
+    # Runs the pool's own code for every request, over a connection that
+    # never touches the network
+    def _get(self, key):
+        return CannedConnection(), True
+
+    def _put(self, key, conn):
+        pass
+
+def cases():
+    # Each case as a name and a function making one call
+    pool = CannedPool()
+    credit_card = CreditCard('4111111111111111', date.today().year + 10, 1,
+        '911', 'Jeff', 'Schenck')
+    bank_account = BankAccount('Jeff', 'Schenck', bank_name='Knab Bank',
+        routing_number='211073473', account_number='1234567890')
+    address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+    start = date.today() + timedelta(days=7)
+    transaction = TransactionAPI('123', '456', pool=pool)
+    payment = transaction.encode_payment(credit_card, address)
+    instrumented = TransactionAPI('123', '456', pool=pool,
+        instrumentation=Instrumentation(recorder=FlightRecorder()))
+    customer = CustomerAPI('123', '456', pool=pool, marshaller='templates')
+    recurring = RecurringAPI('123', '456', pool=pool, marshaller='templates')
+    json_customer = JSONCustomerAPI('123', '456', pool=pool)
+    json_recurring = JSONRecurringAPI('123', '456', pool=pool)
+    return (
+        ('parse_response', lambda: parse_response(AIM_RESPONSE)),
+        ('encode_payment', lambda: transaction.encode_payment(credit_card,
+            address)),
+        ('aim_capture', lambda: transaction.capture(20, credit_card,
+            payment=payment)),
+        ('aim_capture_instrumented', lambda: instrumented.capture(20,
+            credit_card, payment=payment)),
+        ('credit_card_validate', credit_card.validate),
+        ('bank_account_validate_aba',
+            lambda: BankAccount._validate_aba('211073473')),
+        ('bank_account_validate', bank_account.validate),
+        ('cim_templates_capture', lambda: customer.capture('1', '2', 20)),
+        ('arb_templates_create_subscription',
+            lambda: recurring.create_subscription(credit_card, 10, start,
+                months=1)),
+        ('cim_json_capture', lambda: json_customer.capture('1', '2', 20)),
+        ('arb_json_create_subscription',
+            lambda: json_recurring.create_subscription(credit_card, 10,
+                start, months=1)),
+    )
+
+def calibration_work():
+    # A fixed piece of the string, dictionary and arithmetic work the
+    # library does, timed to compare speeds between machines
+    fields = {}
+    for i in xrange(200):
+        key = 'x_field_{0}'.format(i % 40)
+        fields[key] = fields.get(key, 0) + i * 7 % 10
+    return '&'.join('{0}={1}'.format(key, value)
+        for key, value in sorted(fields.items()))
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def measure(case):
+    # Finds how many calls take about ROUND_SECONDS, then times that many in
+    # each round between two calibration runs, so that anything slowing the
+    # machine down for a while slows both. Returns the median calls per
+    # second, the median calls per calibration run, and the spread of the
+    # latter: its interquartile range as a fraction of the median.
+    number = 1
+    while True:
+        seconds = timeit.timeit(case, number=number)
+        if seconds >= ROUND_SECONDS / 5:
+            break
+        number *= 2
+    number = int(number * ROUND_SECONDS / seconds) + 1
+    calibrate = lambda: timeit.timeit(calibration_work,
+        number=CALIBRATION_NUMBER)
+    rates = []
+    relative = []
+    before = calibrate()
+    for i in xrange(ROUNDS):
+        rate = number / timeit.timeit(case, number=number)
+        after = calibrate()
+        rates.append(rate)
+        relative.append(rate * (before + after) / 2)
+        before = after
+    relative.sort()
+    middle = median(relative)
+    spread = (relative[ROUNDS * 3 // 4] - relative[ROUNDS // 4]) / middle
+    return median(rates), middle, spread
+
+def retained_per_call(case):
+    for i in xrange(WARMUP):
+        case()
+    gc.collect()
+    before = len(gc.get_objects())
+    for i in xrange(RETAINED_CALLS):
+        case()
+    gc.collect()
+    return max(len(gc.get_objects()) - before, 0) / float(RETAINED_CALLS)
+
+def load_baselines():
+    if not os.path.exists(BASELINES):
+        return {'tolerance': TOLERANCE, 'cases': {}}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+def save_baselines(tolerance, cases):
+    with open(BASELINES, 'w') as f:
+        json.dump({'tolerance': tolerance, 'cases': cases}, f, indent=2,
+            separators=(',', ': '), sort_keys=True)
+        f.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n\n')[0])
+    parser.add_argument('cases', nargs='*',
+        help='cases to run (default: all)')
+    parser.add_argument('--update', action='store_true',
+        help='record the results as the new baselines')
+    parser.add_argument('--tolerance', type=float,
+        help='fraction slower than baseline allowed (default: from the '
+        'baselines file)')
+    args = parser.parse_args()
+    baselines = load_baselines()
+    tolerance = args.tolerance if args.tolerance is not None else \
+        baselines.get('tolerance', TOLERANCE)
+    selected = [(name, case) for name, case in cases()
+        if not args.cases or name in args.cases]
+    unknown = set(args.cases) - set(name for name, case in selected)
+    if unknown:
+        parser.error('unknown cases: {0}'.format(', '.join(sorted(unknown))))
+
+    print '{0:<36} {1:>12} {2:>8} {3:>8} {4:>9}'.format('case', 'calls/s',
+        'change', 'spread', 'retained')
+    results = {}
+    failures = []
+    noisy = []
+    for name, case in selected:
+        rate, relative, spread = measure(case)
+        baseline = baselines['cases'].get(name)
+        if baseline is not None and relative < \
+                baseline['calls_per_calibration'] * (1 - tolerance):
+            # Measure once more, in case the machine was busy
+            rate, relative, spread = max(measure(case),
+                (rate, relative, spread), key=lambda result: result[1])
+        retained = retained_per_call(case)
+        results[name] = {
+            'calls_per_second': round(rate, 1),
+            'calls_per_calibration': round(relative, 2),
+            'retained_per_call': retained,
+        }
+        if spread > tolerance / 2:
+            noisy.append('{0} varies by {1:.0%} between rounds'.format(name,
+                spread))
+        if baseline is None:
+            print '{0:<36} {1:12.0f} {2:>8} {3:7.1%} {4:9.2f}'.format(name,
+                rate, 'new', spread, retained)
+            continue
+        change = relative / baseline['calls_per_calibration'] - 1
+        print '{0:<36} {1:12.0f} {2:+7.1%} {3:7.1%} {4:9.2f}'.format(name,
+            rate, change, spread, retained)
+        if change < -tolerance:
+            failures.append('{0} is {1:.0%} slower than its baseline'.format(
+                name, -change))
+        if retained > baseline['retained_per_call'] + RETAINED_TOLERANCE:
+            failures.append('{0} retains {1:.2f} objects per call, up from '
+                '{2:.2f}'.format(name, retained,
+                baseline['retained_per_call']))
+
+    if args.update:
+        if noisy:
+            # Baselines from runs this noisy would make the gate flaky
+            print
+            print 'Not writing baselines, as timings are too noisy for a ' \
+                '{0:.0%} tolerance:'.format(tolerance)
+            for message in noisy:
+                print '  ' + message
+            sys.exit(1)
+        recorded = dict(baselines['cases']) if args.cases else {}
+        recorded.update(results)
+        save_baselines(tolerance, recorded)
+        print 'Baselines written to {0}'.format(BASELINES)
+    elif failures:
+        print
+        print 'Regressions (tolerance {0:.0%}):'.format(tolerance)
+        for failure in failures:
+            print '  ' + failure
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Measures the CPU time spent building and parsing a basic transaction API call,
+with the network taken out, comparing requests built by concatenating
+pre-encoded fragments against encoding a fresh copy of every parameter.
+
+    python benchmarks/bench_transaction_request.py
+"""
+
+from datetime import date
+from decimal import Decimal
+import os
+import sys
+import timeit
+import urllib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.path.pardir))
+
+from authorize import Address, CreditCard
+from authorize.apis.transaction import TransactionAPI, parse_response
+from authorize.pool import PooledResponse
+
+
+RESPONSE = (
+    '|1|;|1|;|1|;|This transaction has been approved.|;|IKRAGJ|;|Y|'
+    ';|2171062816|;||;||;|20.00|;|CC|;|auth_only|;||;|Jeffrey|;|Schenck|;||'
+    ';|45 Rose Ave|;|Venice|;|CA|;|90291|;|USA|' + ';||' * 16 +
+    ';|375DD9293D7605E20DF0B437EE2A7B92|;|P|;|2|' + ';||' * 10 +
+    ';|XXXX1111|;|Visa|' + ';||' * 17)
+NUMBER = 20000
+
+
+class NullPool(object):
+    # Stands in for the connection pool, answering every call at once
+    def urlopen(self, url, data=None, headers=None):
+        return PooledResponse(200, 'OK', {}, RESPONSE)
+
+def encode_per_call(api, amount, credit_card, address):
+    # How every call was built before: copy the constant parameters, add the
+    # card and address, and encode the lot
+    amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    params = api.base_params.copy()
+    params.update({
+        'x_card_num': credit_card.card_number,
+        'x_exp_date': credit_card.expiration.strftime('%m-%Y'),
+        'x_card_code': credit_card.cvv,
+        'x_first_name': credit_card.first_name,
+        'x_last_name': credit_card.last_name,
+        'x_address': address.street,
+        'x_city': address.city,
+        'x_state': address.state,
+        'x_zip': address.zip_code,
+        'x_country': address.country,
+    })
+    for key, value in params.items():
+        if value is None:
+            del params[key]
+    params['x_type'] = 'AUTH_CAPTURE'
+    params['x_amount'] = str(amount)
+    url = '{0}?{1}'.format(api.url, urllib.urlencode(params))
+    return parse_response(api.pool.urlopen(url).read())
+
+def main():
+    api = TransactionAPI('123', '456', pool=NullPool())
+    credit_card = CreditCard('4111111111111111', date.today().year + 10, 1,
+        '911', 'Jeff', 'Schenck')
+    address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+    # Encoded once, as AuthorizeCreditCard does on its first charge
+    payment = api.encode_payment(credit_card, address)
+    cases = (
+        ('encoded per call', lambda: encode_per_call(api, 20, credit_card,
+            address)),
+        ('pre-encoded', lambda: api.capture(20, credit_card, address,
+            payment=payment)),
+    )
+    results = []
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=NUMBER, repeat=3))
+        results.append(seconds)
+        print '{0:<20} {1:8.2f} us/call'.format(name,
+            seconds / NUMBER * 1e6)
+    print 'Speedup: {0:.2f}x'.format(results[0] / results[1])
+
+if __name__ == '__main__':
+    main()
@@ -63,12 +63,19 @@ setup(
     long_description=__doc__,
     license='MIT',
     install_requires=[
+        'futures>=2.1.3',
         'suds>=0.4',
     ],
+    extras_require={
+        'bulk': ['numpy'],
+    },
     packages=[
         'authorize',
         'authorize.apis',
     ],
+    package_data={
+        'authorize': ['wsdl/*.wsdl'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
@@ -1,14 +1,19 @@
 from datetime import date
+import threading
+import time
 
 import mock
 from suds import WebFault
+from suds.client import Client as RealClient
 from unittest import TestCase
 if not hasattr(TestCase, 'assertIsNotNone'):
     from unittest2 import TestCase
 from test_data import TEST_BANK_ACCOUNT
-from authorize.apis.customer import Client as RealClient
 
 from authorize.apis.customer import CustomerAPI, PROD_URL, TEST_URL
+from authorize.apis.soap import clear_service_cache
+from authorize.apis.transaction import FIELD_INDEXES
+from authorize.apis.transport import PooledTransport
 from authorize.data import Address, CreditCard, BankAccount
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeResponseError
@@ -19,14 +24,17 @@ class AttrDict(dict):
         dict.__init__(self, *args, **kwargs)
         self.__dict__ = self
 
-OPTIONS = 'x_delim_data=TRUE&x_version=3.1&x_delim_char=%3B&x_test_request=F'
-OPTIONS_TEST = 'x_delim_data=TRUE&x_version=3.1&x_delim_char=%3B&x_test_request=Y'
+OPTIONS = 'x_encap_char=%7C&x_delim_data=TRUE&x_version=3.1&x_delim_char=%3B' \
+    '&x_test_request=F'
+OPTIONS_TEST = 'x_encap_char=%7C&x_delim_data=TRUE&x_version=3.1' \
+    '&x_delim_char=%3B&x_test_request=Y'
 RESPONSE = (
     '1;1;1;This transaction has been approved.;IKRAGJ;Y;2171062816;;;20.00;CC'
     ';auth_only;;Jeffrey;Schenck;;45 Rose Ave;Venice;CA;90291;USA;;;;;;;;;;;;'
     ';;;;;375DD9293D7605E20DF0B437EE2A7B92;P;2;;;;;;;;;;;XXXX1111;Visa;;;;;;;'
     ';;;;;;;;;;Y')
-PARSED_RESPONSE = {
+PARSED_RESPONSE = dict.fromkeys(FIELD_INDEXES, '')
+PARSED_RESPONSE.update({
     'cvv_response': 'P',
     'authorization_code': 'IKRAGJ',
     'response_code': '1',
@@ -36,7 +44,20 @@ PARSED_RESPONSE = {
     'response_reason_code': '1',
     'response_reason_text': 'This transaction has been approved.',
     'transaction_id': '2171062816',
-}
+    'response_subcode': '1',
+    'method': 'CC',
+    'first_name': 'Jeffrey',
+    'last_name': 'Schenck',
+    'address': '45 Rose Ave',
+    'city': 'Venice',
+    'state': 'CA',
+    'zip_code': '90291',
+    'country': 'USA',
+    'md5_hash': '375DD9293D7605E20DF0B437EE2A7B92',
+    'cavv_response': '2',
+    'account_number': 'XXXX1111',
+    'card_type': 'Visa',
+})
 SUCCESS = AttrDict({
     'resultCode': 'Ok',
     'customerProfileId': '123456',
@@ -55,12 +76,15 @@ ERROR = AttrDict({
 class CustomerAPITests(TestCase):
     def setUp(self):
         self.patcher = mock.patch(
-            'authorize.apis.customer.Client')
+            'authorize.apis.soap.Client')
         self.Client = self.patcher.start()
+        # Stopped even if the rest of the set up fails
+        self.addCleanup(self.patcher.stop)
+        clear_service_cache()
         self.api = CustomerAPI('123', '456')
         self.real_client = RealClient(TEST_URL)
 
-        # Make the factory creator return mocks that know what kind they are
+        # Make the type creator return mocks that know what kind they are
         # and correctly handles enumerations
         def create(kind):
             created = mock.Mock()
@@ -70,10 +94,7 @@ class CustomerAPITests(TestCase):
                 for e, a in type.children():
                     setattr(created, e.name, e.name)
             return created
-        self.api.client.factory.create.side_effect = create
-
-    def tearDown(self):
-        self.patcher.stop()
+        self.api._create = create
 
     def test_basic_api(self):
         api = CustomerAPI('123', '456')
@@ -94,14 +115,38 @@ class CustomerAPITests(TestCase):
 
     def test_client_and_auth(self):
         self.Client.reset_mock()
+        clear_service_cache()
         api = CustomerAPI('123', '456')
         self.assertEqual(self.Client.call_args, None)
         client_ = api.client
         self.assertEqual(self.Client.call_args[0][0], TEST_URL)
+        self.assertTrue(client_ is self.Client.return_value.clone.return_value)
+        transport = client_.set_options.call_args[1]['transport']
+        self.assertTrue(isinstance(transport, PooledTransport))
+        self.assertTrue(transport.pool is api.pool)
         client_auth = api.client_auth
         self.assertEqual(client_auth.name, '123')
         self.assertEqual(client_auth.transactionKey, '456')
 
+    def test_client_concurrent_first_use(self):
+        api = CustomerAPI('123', '456')
+        created = []
+        def create():
+            time.sleep(0.05)
+            created.append(mock.Mock())
+            return created[-1]
+        with mock.patch.object(api.clients, 'create', side_effect=create):
+            threads = [threading.Thread(target=lambda: api.client_auth)
+                for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(created), 1)
+        self.assertTrue(api.client is created[0])
+        self.assertEqual(api.client_auth.name, '123')
+        self.assertEqual(created[0].factory.create.call_count, 1)
+
     def test_make_call(self):
         self.api.client.service.TestService.return_value = SUCCESS
         result = self.api._make_call('TestService', 'foo')
@@ -115,6 +160,9 @@ class CustomerAPITests(TestCase):
             'TestService', 'foo')
         self.assertEqual(self.api.client.service.TestService.call_args[0],
             (self.api.client_auth, 'foo'))
+        self.api.client.service.TestService.side_effect = IOError('Borked')
+        self.assertRaises(AuthorizeConnectionError, self.api._make_call,
+            'TestService', 'foo')
 
     def test_make_call_response_error(self):
         self.api.client.service.TestService.return_value = ERROR
@@ -0,0 +1,374 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+import codecs
+import httplib
+import json
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+from test_data import TEST_BANK_ACCOUNT
+
+from authorize.apis.jsonapi import JSONCustomerAPI, JSONRecurringAPI, \
+    JSONTransactionAPI, PROD_URL, TEST_URL, loads
+from authorize.apis.transaction import TransactionResult
+from authorize.data import Address, BankAccount, CreditCard
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeInvalidError, AuthorizeResponseError
+from authorize.pool import PooledResponse
+
+
+OK = {'resultCode': 'Ok', 'message': [{'code': 'I00001',
+    'text': 'Successful.'}]}
+ERROR = {'resultCode': 'Error', 'message': [{'code': 'E00040',
+    'text': 'The record cannot be found.'}]}
+APPROVED = {
+    'transactionResponse': {
+        'responseCode': '1',
+        'authCode': 'IKRAGJ',
+        'avsResultCode': 'Y',
+        'cvvResultCode': 'P',
+        'cavvResultCode': '2',
+        'transId': '2171062816',
+        'refTransID': '',
+        'transHash': '375DD9293D7605E20DF0B437EE2A7B92',
+        'accountNumber': 'XXXX1111',
+        'accountType': 'Visa',
+        'messages': [{'code': '1',
+            'description': 'This transaction has been approved.'}],
+    },
+    'messages': OK,
+}
+DECLINED = {
+    'transactionResponse': {
+        'responseCode': '2',
+        'authCode': '',
+        'avsResultCode': 'Y',
+        'transId': '2171062817',
+        'errors': [{'errorCode': '2',
+            'errorText': 'This transaction has been declined.'}],
+    },
+    'messages': {'resultCode': 'Error', 'message': [{'code': 'E00027',
+        'text': 'The transaction was unsuccessful.'}]},
+}
+PARSED_APPROVED = dict.fromkeys(TransactionResult.from_fields({}), '')
+PARSED_APPROVED.update({
+    'response_code': '1',
+    'response_reason_code': '1',
+    'response_reason_text': 'This transaction has been approved.',
+    'authorization_code': 'IKRAGJ',
+    'avs_response': 'Y',
+    'transaction_id': '2171062816',
+    'amount': '20.00',
+    'transaction_type': 'auth_only',
+    'md5_hash': '375DD9293D7605E20DF0B437EE2A7B92',
+    'cvv_response': 'P',
+    'cavv_response': '2',
+    'account_number': 'XXXX1111',
+    'card_type': 'Visa',
+})
+
+def respond(document, status=200):
+    # Authorize.net starts every JSON response with a byte order mark
+    return PooledResponse(status, 'OK', {},
+        codecs.BOM_UTF8 + json.dumps(document))
+
+class JSONAPITests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.pool.urlopen.return_value = respond(APPROVED)
+        self.api = JSONTransactionAPI('123', '456', pool=self.pool)
+        self.year = date.today().year + 10
+        self.credit_card = CreditCard('4111111111111111', self.year, 1,
+            '911', 'Jeff', 'Schenck')
+        self.address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+
+    def sent(self, request):
+        # Decodes the last request, keeping the order of its keys
+        url, body, headers = self.pool.urlopen.call_args[0]
+        self.assertEqual(url, TEST_URL)
+        self.assertEqual(headers, {'Content-Type': 'application/json'})
+        document = json.loads(body, object_pairs_hook=OrderedDict)
+        self.assertEqual(document.keys(), [request])
+        items = document[request].items()
+        self.assertEqual(items[0], ('merchantAuthentication', {
+            'name': '123', 'transactionKey': '456'}))
+        return items[1:]
+
+    def test_basic_api(self):
+        self.assertEqual(self.api.url, TEST_URL)
+        self.assertEqual(self.api.pool, self.pool)
+        api = JSONTransactionAPI('123', '456', debug=False)
+        self.assertEqual(api.url, PROD_URL)
+
+    def test_loads(self):
+        self.assertEqual(loads(codecs.BOM_UTF8 + '{"a":1}'), {'a': 1})
+        self.assertEqual(loads('{"a":1}'), {'a': 1})
+
+    def test_auth(self):
+        result = self.api.auth(20, self.credit_card, self.address)
+        self.assertTrue(isinstance(result, TransactionResult))
+        self.assertEqual(result, PARSED_APPROVED)
+        (key, request), = self.sent('createTransactionRequest')
+        self.assertEqual(key, 'transactionRequest')
+        self.assertEqual(request.items(), [
+            ('transactionType', 'authOnlyTransaction'),
+            ('amount', '20.00'),
+            ('payment', {'creditCard': {
+                'cardNumber': '4111111111111111',
+                'expirationDate': '{0}-01'.format(self.year),
+                'cardCode': '911',
+            }}),
+            ('billTo', {
+                'firstName': 'Jeff',
+                'lastName': 'Schenck',
+                'address': '45 Rose Ave',
+                'city': 'Venice',
+                'state': 'CA',
+                'zip': '90291',
+                'country': 'US',
+            }),
+        ])
+        self.assertEqual(request['payment']['creditCard'].keys(),
+            ['cardNumber', 'expirationDate', 'cardCode'])
+        self.assertEqual(request['billTo'].keys(), ['firstName', 'lastName',
+            'address', 'city', 'state', 'zip', 'country'])
+
+    def test_capture_with_payment(self):
+        payment = self.api.encode_payment(self.credit_card)
+        self.assertEqual([key for key, value in payment],
+            ['payment', 'billTo'])
+        result = self.api.capture(20, None, payment=payment)
+        self.assertEqual(result['transaction_type'], 'auth_capture')
+        request = self.sent('createTransactionRequest')[0][1]
+        self.assertEqual(request['transactionType'], 'authCaptureTransaction')
+        self.assertEqual(request['billTo'],
+            {'firstName': 'Jeff', 'lastName': 'Schenck'})
+
+    def test_test_mode(self):
+        api = JSONTransactionAPI('123', '456', test=True, pool=self.pool)
+        api.void('2171062816')
+        request = self.sent('createTransactionRequest')[0][1]
+        self.assertEqual(request.items(), [
+            ('transactionType', 'voidTransaction'),
+            ('refTransId', '2171062816'),
+            ('transactionSettings', {'setting': [{
+                'settingName': 'testRequest',
+                'settingValue': 'true',
+            }]}),
+        ])
+
+    def test_settle_credit_void(self):
+        self.api.settle('2171062816')
+        request = self.sent('createTransactionRequest')[0][1]
+        self.assertEqual(request.items(), [
+            ('transactionType', 'priorAuthCaptureTransaction'),
+            ('refTransId', '2171062816'),
+        ])
+        self.api.settle('2171062816', amount=10)
+        request = self.sent('createTransactionRequest')[0][1]
+        self.assertEqual(request.keys(),
+            ['transactionType', 'amount', 'refTransId'])
+        self.assertEqual(request['amount'], '10.00')
+        result = self.api.credit('1111', '2171062816', 10)
+        self.assertEqual(result['transaction_type'], 'credit')
+        request = self.sent('createTransactionRequest')[0][1]
+        self.assertEqual(request.items(), [
+            ('transactionType', 'refundTransaction'),
+            ('amount', '10.00'),
+            ('payment', {'creditCard': {
+                'cardNumber': '1111',
+                'expirationDate': 'XXXX',
+            }}),
+            ('refTransId', '2171062816'),
+        ])
+        self.assertEqual(self.api.void('2171062816')['transaction_type'],
+            'void')
+
+    def test_declined(self):
+        self.pool.urlopen.return_value = respond(DECLINED)
+        try:
+            self.api.auth(20, self.credit_card)
+        except AuthorizeResponseError as e:
+            self.assertEqual(e.full_response['response_code'], '2')
+            self.assertEqual(e.full_response['response_reason_code'], '2')
+            self.assertEqual(e.full_response['response_reason_text'],
+                'This transaction has been declined.')
+            self.assertEqual(e.full_response['transaction_id'], '2171062817')
+            self.assertTrue(str(e).startswith(
+                'This transaction has been declined. full_response='))
+        else:
+            self.fail('AuthorizeResponseError not raised')
+
+        # Requests rejected before they reach the processor
+        self.pool.urlopen.return_value = respond({'messages': ERROR})
+        self.assertRaises(AuthorizeResponseError, self.api.void, '1')
+
+    def test_connection_errors(self):
+        self.pool.urlopen.return_value = respond(APPROVED, status=503)
+        self.assertRaises(AuthorizeConnectionError, self.api.void, '1')
+        self.pool.urlopen.return_value = PooledResponse(200, 'OK', {},
+            '<html>')
+        self.assertRaises(AuthorizeConnectionError, self.api.void, '1')
+        self.pool.urlopen.side_effect = IOError('Borked')
+        self.assertRaises(AuthorizeConnectionError, self.api.void, '1')
+        self.pool.urlopen.side_effect = httplib.BadStatusLine('')
+        self.assertRaises(AuthorizeConnectionError, self.api.void, '1')
+
+class JSONCustomerAPITests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.api = JSONCustomerAPI('123', '456', pool=self.pool)
+        self.credit_card = CreditCard('4111111111111111',
+            date.today().year + 10, 1, '911', 'Jeff', 'Schenck')
+        self.address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+
+    def sent(self):
+        document = json.loads(self.pool.urlopen.call_args[0][1],
+            object_pairs_hook=OrderedDict)
+        request, details = document.items()[0]
+        return request, details.items()[1:]
+
+    def test_create_saved_payment(self):
+        payment = self.api.create_saved_payment(self.credit_card,
+            self.address)
+        self.assertEqual(payment.keys(),
+            ['customerType', 'billTo', 'payment'])
+        self.assertEqual(payment['billTo']['city'], 'Venice')
+        self.assertEqual(payment['payment']['creditCard']['cardCode'], '911')
+        self.assertEqual(self.pool.urlopen.call_count, 0)
+
+        payment = self.api.create_saved_payment(
+            bank_account=BankAccount(**TEST_BANK_ACCOUNT))
+        self.assertEqual(payment['billTo'],
+            {'firstName': 'Enoon', 'lastName': 'Erehwon'})
+        self.assertEqual(payment['payment']['bankAccount'].keys(), [
+            'accountType', 'routingNumber', 'accountNumber', 'nameOnAccount',
+            'echeckType', 'bankName'])
+        self.assertEqual(
+            payment['payment']['bankAccount']['nameOnAccount'],
+            'Enoon Erehwon')
+
+        self.pool.urlopen.return_value = respond({
+            'customerProfileId': '1', 'customerPaymentProfileId': '2',
+            'messages': OK})
+        self.assertEqual(self.api.create_saved_payment(self.credit_card,
+            profile_id='1'), '2')
+        request, items = self.sent()
+        self.assertEqual(request, 'createCustomerPaymentProfileRequest')
+        self.assertEqual([key for key, value in items], ['customerProfileId',
+            'paymentProfile', 'validationMode'])
+
+    def test_create_saved_profile(self):
+        payment = self.api.create_saved_payment(self.credit_card)
+        self.pool.urlopen.return_value = respond({
+            'customerProfileId': '1', 'customerPaymentProfileIdList': ['2'],
+            'messages': OK})
+        self.assertEqual(self.api.create_saved_profile('a', [payment]),
+            ('1', ['2']))
+        request, items = self.sent()
+        self.assertEqual(request, 'createCustomerProfileRequest')
+        self.assertEqual(items, [
+            ('profile', {
+                'merchantCustomerId': 'a',
+                'paymentProfiles': [payment],
+            }),
+            ('validationMode', 'none'),
+        ])
+        self.assertEqual(self.api.create_saved_profile('a'), ('1', None))
+
+    def test_delete(self):
+        self.pool.urlopen.return_value = respond({'messages': OK})
+        self.api.delete_saved_profile('1')
+        self.assertEqual(self.sent(), ('deleteCustomerProfileRequest',
+            [('customerProfileId', '1')]))
+        self.api.delete_saved_payment('1', '2')
+        self.assertEqual(self.sent(), ('deleteCustomerPaymentProfileRequest',
+            [('customerProfileId', '1'), ('customerPaymentProfileId', '2')]))
+
+        self.pool.urlopen.return_value = respond({'messages': ERROR})
+        try:
+            self.api.delete_saved_profile('1')
+        except AuthorizeResponseError as e:
+            self.assertEqual(str(e), 'E00040: The record cannot be found.')
+            self.assertEqual(e.full_response, {
+                'response_code': 'E00040',
+                'response_text': 'The record cannot be found.',
+            })
+        else:
+            self.fail('AuthorizeResponseError not raised')
+
+    def test_transactions(self):
+        self.pool.urlopen.return_value = respond(APPROVED)
+        for method, kind in ((self.api.auth, 'authOnlyTransaction'),
+                (self.api.capture, 'authCaptureTransaction'),
+                (self.api.credit, 'refundTransaction')):
+            self.assertEqual(method('1', '2', 20)['transaction_id'],
+                '2171062816')
+            request, ((key, details),) = self.sent()
+            self.assertEqual(request, 'createTransactionRequest')
+            self.assertEqual(details.items(), [
+                ('transactionType', kind),
+                ('amount', '20.00'),
+                ('profile', {
+                    'customerProfileId': '1',
+                    'paymentProfile': {'paymentProfileId': '2'},
+                }),
+            ])
+
+class JSONRecurringAPITests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.pool.urlopen.return_value = respond({'subscriptionId': '123',
+            'messages': OK})
+        self.api = JSONRecurringAPI('123', '456', pool=self.pool)
+        self.credit_card = CreditCard('4111111111111111',
+            date.today().year + 10, 1, '911', 'Jeff', 'Schenck')
+        self.start = date.today() + timedelta(days=7)
+
+    def sent(self):
+        document = json.loads(self.pool.urlopen.call_args[0][1],
+            object_pairs_hook=OrderedDict)
+        request, details = document.items()[0]
+        return request, details.items()[1:]
+
+    def test_create_subscription(self):
+        self.assertEqual(self.api.create_subscription(self.credit_card, 10,
+            self.start, months=1, trial_amount=5, trial_occurrences=3), '123')
+        request, ((key, subscription),) = self.sent()
+        self.assertEqual(request, 'ARBCreateSubscriptionRequest')
+        self.assertEqual(subscription.keys(), ['paymentSchedule', 'amount',
+            'trialAmount', 'payment', 'billTo'])
+        self.assertEqual(subscription['paymentSchedule'].items(), [
+            ('interval', {'length': 1, 'unit': 'months'}),
+            ('startDate', self.start.strftime('%Y-%m-%d')),
+            ('totalOccurrences', 9999),
+            ('trialOccurrences', 3),
+        ])
+        self.assertEqual(subscription['amount'], '10.00')
+        self.assertEqual(subscription['trialAmount'], '5.00')
+        self.assertEqual(subscription['billTo'].items(),
+            [('firstName', 'Jeff'), ('lastName', 'Schenck')])
+        self.assertRaises(AuthorizeInvalidError,
+            self.api.create_subscription, self.credit_card, 10, self.start)
+
+    def test_update_and_delete_subscription(self):
+        self.pool.urlopen.return_value = respond({'messages': OK})
+        self.api.update_subscription('1', amount=20, occurrences=10)
+        self.assertEqual(self.sent(), ('ARBUpdateSubscriptionRequest', [
+            ('subscriptionId', '1'),
+            ('subscription', {
+                'paymentSchedule': {'totalOccurrences': 10},
+                'amount': '20.00',
+            }),
+        ]))
+        self.assertRaises(AuthorizeInvalidError,
+            self.api.update_subscription, '1',
+            start=date.today() - timedelta(days=1))
+        self.api.delete_subscription('1')
+        self.assertEqual(self.sent(), ('ARBCancelSubscriptionRequest',
+            [('subscriptionId', '1')]))
+        self.pool.urlopen.return_value = respond({'messages': ERROR})
+        self.assertRaises(AuthorizeResponseError,
+            self.api.delete_subscription, '1')
@@ -2,12 +2,15 @@ from datetime import date, timedelta
 
 import mock
 from suds import WebFault
+from suds.sudsobject import Factory
 from unittest import TestCase
 if not hasattr(TestCase, 'assertIsNotNone'):
     from unittest2 import TestCase
 
 from authorize.apis.recurring import PROD_URL, RecurringAPI, TEST_URL
-from authorize.data import CreditCard
+from authorize.apis.soap import clear_service_cache
+from authorize.apis.transport import PooledTransport
+from authorize.data import CreditCard, Money
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeInvalidError, AuthorizeResponseError
 
@@ -32,16 +35,17 @@ ERROR = AttrDict({
 class RecurringAPITests(TestCase):
     def setUp(self):
         self.patcher = mock.patch(
-            'authorize.apis.recurring.Client')
+            'authorize.apis.soap.Client')
         self.Client = self.patcher.start()
+        clear_service_cache()
         self.api = RecurringAPI('123', '456')
 
-        # Make the factory creator return mocks that know what kind they are
+        # Make the type creator return mocks that know what kind they are
         def create(kind):
             created = mock.Mock()
             created._kind = kind
             return created
-        self.api.client.factory.create.side_effect = create
+        self.api._create = create
 
     def tearDown(self):
         self.patcher.stop()
@@ -54,10 +58,15 @@ class RecurringAPITests(TestCase):
 
     def test_client_and_auth(self):
         self.Client.reset_mock()
+        clear_service_cache()
         api = RecurringAPI('123', '456')
         self.assertEqual(self.Client.call_args, None)
         client_ = api.client
         self.assertEqual(self.Client.call_args[0][0], TEST_URL)
+        self.assertTrue(client_ is self.Client.return_value.clone.return_value)
+        transport = client_.set_options.call_args[1]['transport']
+        self.assertTrue(isinstance(transport, PooledTransport))
+        self.assertTrue(transport.pool is api.pool)
         client_auth = api.client_auth
         self.assertEqual(client_auth.name, '123')
         self.assertEqual(client_auth.transactionKey, '456')
@@ -75,6 +84,9 @@ class RecurringAPITests(TestCase):
             'TestService', 'foo')
         self.assertEqual(self.api.client.service.TestService.call_args[0],
             (self.api.client_auth, 'foo'))
+        self.api.client.service.TestService.side_effect = IOError('Borked')
+        self.assertRaises(AuthorizeConnectionError, self.api._make_call,
+            'TestService', 'foo')
 
     def test_make_call_response_error(self):
         self.api.client.service.TestService.return_value = ERROR
@@ -85,6 +97,29 @@ class RecurringAPITests(TestCase):
         self.assertEqual(self.api.client.service.TestService.call_args[0],
             (self.api.client_auth, 'foo'))
 
+    def test_after_fork(self):
+        client, client_auth = self.api.client, self.api.client_auth
+        lock = self.api._lock
+        with mock.patch('os.getpid', return_value=self.api._pid + 1):
+            self.assertTrue(self.api.client is client)
+            self.assertFalse(self.api._lock is lock)
+            self.assertFalse(hasattr(self.api, '_client_auth'))
+            self.assertEqual(self.api.client_auth.name, '123')
+
+    def test_type_prototypes(self):
+        api = RecurringAPI('123', '456')
+        factory = api.client.factory
+        factory.create.reset_mock()
+        factory.create.side_effect = lambda kind: Factory.object(kind,
+            {'amount': None, 'payment': Factory.object('PaymentType')})
+        subscription = api._create('ARBSubscriptionType')
+        subscription.amount = '10.00'
+        subscription.payment.creditCard = 'card'
+        fresh = api._create('ARBSubscriptionType')
+        self.assertEqual(fresh.amount, None)
+        self.assertFalse(hasattr(fresh.payment, 'creditCard'))
+        self.assertEqual(factory.create.call_count, 1)
+
     def test_create_subscription(self):
         service = self.api.client.service.ARBCreateSubscription
         service.return_value = SUCCESS
@@ -204,6 +239,19 @@ class RecurringAPITests(TestCase):
         self.assertTrue(subscription.trialAmount, '24.00')
         self.assertTrue(subscription.paymentSchedule.trialOccurrences, 1)
 
+        # Test amounts given as Money and as exact floats
+        self.api.update_subscription('1', amount=Money('25.5'),
+            trial_amount=0.1)
+        subscription_id, subscription = service.call_args[0][1:]
+        self.assertEqual(subscription.amount, '25.50')
+        self.assertEqual(subscription.trialAmount, '0.10')
+
+        # Test amounts with fractions of a cent
+        self.assertRaises(AuthorizeInvalidError, self.api.update_subscription,
+            '1', amount='25.005')
+        self.assertRaises(AuthorizeInvalidError, self.api.update_subscription,
+            '1', trial_amount=0.1 + 0.2)
+
     def test_delete_subscription(self):
         service = self.api.client.service.ARBCancelSubscription
         service.return_value = SUCCESS
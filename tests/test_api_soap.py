@@ -0,0 +1,337 @@
+from copy import deepcopy
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+from suds.cache import NoCache
+from suds.sudsobject import Factory
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize.apis import soap
+from authorize.apis.recurring import RecurringAPI
+from authorize.apis.soap import bundled_wsdl, clear_service_cache, \
+    clone, ClientPool, PooledClient, preload, revalidate, service_client
+from authorize.apis.transport import PooledTransport
+
+
+PROD_URL = 'https://api.authorize.net/soap/v1/Service.asmx?WSDL'
+TEST_URL = 'https://apitest.authorize.net/soap/v1/Service.asmx?WSDL'
+
+class ServiceClientTests(TestCase):
+    def setUp(self):
+        self.patcher = mock.patch('authorize.apis.soap.Client')
+        self.Client = self.patcher.start()
+        def create(url, **kwargs):
+            client = mock.Mock(url=url)
+            client.clone.side_effect = lambda: mock.Mock(wsdl=client.wsdl)
+            return client
+        self.Client.side_effect = create
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.cache_dir))
+        patcher = mock.patch.object(soap, 'WSDL_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clear_service_cache()
+
+    def tearDown(self):
+        self.patcher.stop()
+        clear_service_cache()
+
+    def _bundle(self, document):
+        wsdl_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, wsdl_dir)
+        patcher = mock.patch.object(soap, 'WSDL_DIR', wsdl_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        path = os.path.join(wsdl_dir, 'apitest.authorize.net.wsdl')
+        with open(path, 'wb') as f:
+            f.write(document)
+        return path
+
+    def test_service_client_cache(self):
+        transport1 = PooledTransport(mock.Mock())
+        transport2 = PooledTransport(mock.Mock())
+        client1 = service_client(TEST_URL, transport1)
+        client2 = service_client(TEST_URL, transport2)
+        self.assertEqual(self.Client.call_count, 1)
+        self.assertEqual(self.Client.call_args[0], (TEST_URL,))
+        kwargs = self.Client.call_args[1]
+        self.assertEqual(kwargs['transport'].pool, transport1.pool)
+        self.assertEqual(kwargs['cachingpolicy'], 1)
+        # A live WSDL is never cached on disk
+        self.assertTrue(isinstance(kwargs['cache'], NoCache))
+        self.assertEqual(client1.set_options.call_args,
+            ((), {'transport': transport1}))
+        self.assertEqual(client2.set_options.call_args,
+            ((), {'transport': transport2}))
+        self.assertFalse(client1 is client2)
+        self.assertTrue(client1.wsdl is client2.wsdl)
+
+        # Each URL is loaded once
+        service_client(PROD_URL, transport1)
+        self.assertEqual(self.Client.call_count, 2)
+        self.assertEqual(self.Client.call_args[0][0], PROD_URL)
+
+        # Clearing the cache reloads the definition
+        clear_service_cache()
+        service_client(TEST_URL, transport1)
+        self.assertEqual(self.Client.call_count, 3)
+
+    def test_client_pool(self):
+        pool = mock.Mock()
+        clients = ClientPool(TEST_URL, pool)
+        with clients.checkout() as pooled1:
+            with clients.checkout() as pooled2:
+                self.assertFalse(pooled1 is pooled2)
+                self.assertTrue(pooled1.client.wsdl is pooled2.client.wsdl)
+        transport = pooled1.client.set_options.call_args[1]['transport']
+        self.assertTrue(transport.pool is pool)
+        self.assertEqual(self.Client.call_count, 1)
+
+        # Returned clients are reused, even after a failed call
+        try:
+            with clients.checkout() as pooled:
+                self.assertTrue(pooled in (pooled1, pooled2))
+                raise IOError('Borked')
+        except IOError:
+            pass
+        with clients.checkout() as pooled3:
+            with clients.checkout() as pooled4:
+                self.assertEqual(set((pooled3, pooled4)),
+                    set((pooled1, pooled2)))
+
+    def test_client_pool_after_fork(self):
+        clients = ClientPool(TEST_URL, mock.Mock())
+        with clients.checkout() as pooled:
+            pass
+        lock = clients._lock
+        with mock.patch('os.getpid', return_value=clients._pid + 1):
+            with clients.checkout() as forked:
+                self.assertTrue(forked is pooled)
+        self.assertFalse(clients._lock is lock)
+
+    def test_preload(self):
+        with mock.patch('authorize.apis.soap.ConnectionPool') as Pool:
+            preload(TEST_URL)
+        self.assertEqual(self.Client.call_count, 1)
+        self.assertEqual(Pool.return_value.close.call_count, 1)
+        service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertEqual(self.Client.call_count, 1)
+
+        # A forked child keeps the definitions but not the lock
+        lock = soap._services._lock
+        with mock.patch('os.getpid', return_value=soap._services._pid + 1):
+            service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertEqual(self.Client.call_count, 1)
+        self.assertFalse(soap._services._lock is lock)
+
+    def test_pooled_client_methods(self):
+        client = mock.Mock()
+        pooled = PooledClient(client)
+        method = pooled.method('CreateCustomerProfile')
+        self.assertTrue(method is client.service.CreateCustomerProfile)
+        client.service = mock.Mock()
+        self.assertTrue(pooled.method('CreateCustomerProfile') is method)
+
+    def test_client_pool_threads(self):
+        clients = ClientPool(TEST_URL, mock.Mock())
+        release = threading.Event()
+        used = []
+        def call():
+            with clients.checkout() as client:
+                used.append(client)
+                release.wait(5)
+        threads = [threading.Thread(target=call) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        # Every thread holds its client until all of them have one
+        for i in range(500):
+            if len(used) == 8:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(used)), 8)
+        self.assertEqual(len(clients._idle), 8)
+
+    def test_clone(self):
+        card = Factory.object('CreditCardType', {'cardNumber': None,
+            'expirationDate': None})
+        payment = Factory.object('PaymentType')
+        payment.creditCard = card
+        payment.tags = [card, 'x']
+        payment.__metadata__.sxtype = mock.Mock()
+        copied = clone(payment)
+        self.assertEqual(copied.__class__, payment.__class__)
+        self.assertEqual(copied.__keylist__, ['creditCard', 'tags'])
+        self.assertTrue(copied.__metadata__ is payment.__metadata__)
+        self.assertFalse(copied.creditCard is card)
+        self.assertFalse(copied.tags[0] is card)
+        self.assertEqual(copied.tags[1], 'x')
+        copied.creditCard.cardNumber = '4111111111111111'
+        copied.amount = '1.00'
+        self.assertEqual(card.cardNumber, None)
+        self.assertEqual(payment.__keylist__, ['creditCard', 'tags'])
+        self.assertEqual(str(clone(card)), str(card))
+
+    def test_transport_deepcopy_shares_pool(self):
+        pool = mock.Mock()
+        transport = PooledTransport(pool)
+        copied = deepcopy(transport)
+        self.assertTrue(isinstance(copied, PooledTransport))
+        self.assertFalse(copied is transport)
+        self.assertTrue(copied.pool is pool)
+
+    def test_bundled_wsdl(self):
+        self.assertEqual(bundled_wsdl(TEST_URL), None)
+        path = self._bundle('<definitions/>')
+        self.assertEqual(bundled_wsdl(TEST_URL), 'file://' + path)
+        self.assertEqual(bundled_wsdl(PROD_URL), None)
+
+    def test_service_client_bundled(self):
+        path = self._bundle('<definitions/>')
+        service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertEqual(self.Client.call_args[0], ('file://' + path,))
+        # The on-disk cache is keyed by the bundled document
+        location = self.Client.call_args[1]['cache'].location
+        self.assertEqual(os.path.dirname(os.path.dirname(location)),
+            self.cache_dir)
+        self._bundle('<definitions updated="1"/>')
+        clear_service_cache()
+        service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertNotEqual(self.Client.call_args[1]['cache'].location,
+            location)
+
+    def test_cache_dir_private(self):
+        self._bundle('<definitions/>')
+        service_client(TEST_URL, PooledTransport(mock.Mock()))
+        info = os.stat(self.cache_dir)
+        self.assertEqual(info.st_mode & 0o777, 0o700)
+        self.assertEqual(info.st_uid, os.getuid())
+
+    def test_cache_dir_unsafe(self):
+        # A cache directory others can write to is never read from
+        os.makedirs(self.cache_dir)
+        os.chmod(self.cache_dir, 0o777)
+        self._bundle('<definitions/>')
+        service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertTrue(isinstance(self.Client.call_args[1]['cache'],
+            NoCache))
+        clear_service_cache()
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            os.chmod(self.cache_dir, 0o700)
+            service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertTrue(isinstance(self.Client.call_args[1]['cache'],
+            NoCache))
+
+    def test_cache_dir_default(self):
+        # Without a configured directory, one named by user ID is used, even
+        # when the user has no name
+        tmp = os.path.dirname(self.cache_dir)
+        with mock.patch.object(soap, 'WSDL_CACHE_DIR', None):
+            with mock.patch('tempfile.gettempdir', return_value=tmp):
+                with mock.patch('pwd.getpwuid', side_effect=KeyError):
+                    location = soap._cache_dir()
+        root = os.path.join(tmp, 'authorize-sauce-{0}'.format(os.getuid()))
+        self.assertEqual(os.path.dirname(location), root)
+        self.assertEqual(os.stat(root).st_mode & 0o777, 0o700)
+
+    def test_revalidate(self):
+        self._bundle('<definitions/>')
+        transport = mock.Mock()
+        transport.open.return_value.read.return_value = '<definitions/>'
+        bundled = service_client(TEST_URL, PooledTransport(mock.Mock()))
+        revalidate(TEST_URL, transport).join()
+        self.assertEqual(transport.open.call_args[0][0].url, TEST_URL)
+        self.assertEqual(self.Client.call_count, 1)
+
+        # A changed live WSDL replaces the bundled definition
+        transport.open.return_value.read.return_value = '<changed/>'
+        revalidate(TEST_URL, transport).join()
+        self.assertEqual(self.Client.call_count, 2)
+        self.assertEqual(self.Client.call_args[0], (TEST_URL,))
+        self.assertTrue(isinstance(self.Client.call_args[1]['cache'],
+            NoCache))
+        live = service_client(TEST_URL, PooledTransport(mock.Mock()))
+        self.assertNotEqual(live.wsdl, bundled.wsdl)
+
+    def test_revalidate_existing_clients(self):
+        # Clients and types already made from the bundled definition are
+        # made again from the live one
+        self._bundle('<definitions/>')
+        transport = mock.Mock()
+        transport.open.return_value.read.return_value = '<changed/>'
+        patcher = mock.patch.object(soap, 'clone', lambda sobject: sobject)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        api = RecurringAPI('123', '456', debug=True)
+        client, client_auth = api.client, api.client_auth
+        prototype = api._create('ARBSubscriptionType')
+        with api.clients.checkout() as pooled:
+            pass
+        revalidate(TEST_URL, transport).join()
+        live = soap._services.clients[TEST_URL]
+        self.assertFalse(api.client is client)
+        self.assertTrue(api.client.wsdl is live.wsdl)
+        self.assertFalse(api.client_auth is client_auth)
+        self.assertFalse(api._create('ARBSubscriptionType') is prototype)
+        self.assertEqual(api.client.factory.create.call_args[0],
+            ('ARBSubscriptionType',))
+        with api.clients.checkout() as checked_out:
+            self.assertFalse(checked_out is pooled)
+            self.assertTrue(checked_out.client.wsdl is live.wsdl)
+        # The old client is not handed out again
+        self.assertEqual(api.clients._idle, [checked_out])
+
+    def test_revalidate_without_bundle(self):
+        # The live WSDL is already in use, so it is not fetched again
+        transport = mock.Mock()
+        with mock.patch.object(soap.log, 'warning') as warning:
+            revalidate(TEST_URL, transport).join()
+        self.assertEqual(transport.open.call_count, 0)
+        self.assertEqual(self.Client.call_count, 0)
+        self.assertEqual(warning.call_count, 0)
+
+
+class BundledWSDLTests(TestCase):
+    # Loads a bundled WSDL through suds itself, with the network refused
+    def setUp(self):
+        self.wsdl_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.wsdl_dir)
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'data',
+            'service.wsdl'), os.path.join(self.wsdl_dir,
+            'apitest.authorize.net.wsdl'))
+        self.cache_dir = os.path.join(self.wsdl_dir, 'cache')
+        for name, value in (('WSDL_DIR', self.wsdl_dir),
+                ('WSDL_CACHE_DIR', self.cache_dir)):
+            patcher = mock.patch.object(soap, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pool = mock.Mock()
+        self.pool.urlopen.side_effect = IOError('No network in tests')
+        clear_service_cache()
+        self.addCleanup(clear_service_cache)
+
+    def test_load_bundled(self):
+        client = service_client(TEST_URL, PooledTransport(self.pool))
+        methods = client.wsdl.services[0].ports[0].methods
+        self.assertTrue('CreateCustomerProfile' in methods)
+        self.assertTrue('ARBGetSubscriptionStatus' in methods)
+        request = client.factory.create('MerchantAuthenticationType')
+        self.assertEqual(request.__keylist__, ['name', 'transactionKey'])
+        self.assertEqual(self.pool.urlopen.call_count, 0)
+
+        # Another process loads the pickled definition from the disk cache
+        clear_service_cache()
+        with mock.patch('suds.wsdl.Definitions.__init__') as parse:
+            client = service_client(TEST_URL, PooledTransport(self.pool))
+        self.assertEqual(parse.call_count, 0)
+        self.assertTrue('CreateCustomerProfile' in
+            client.wsdl.services[0].ports[0].methods)
+        self.assertEqual(self.pool.urlopen.call_count, 0)
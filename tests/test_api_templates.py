@@ -0,0 +1,264 @@
+from datetime import date, timedelta
+import httplib
+from xml.etree.cElementTree import fromstring
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+from test_api_customer import PARSED_RESPONSE, RESPONSE
+
+from authorize.apis.customer import CustomerAPI, TEST_URL
+from authorize.apis.recurring import RecurringAPI
+from authorize.apis.templates import NAMESPACE, SoapFault, SoapTemplates, \
+    parse_result
+from authorize.data import CreditCard
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeInvalidError, AuthorizeResponseError
+from authorize.pool import PooledResponse
+
+
+ENDPOINT = 'https://apitest.authorize.net/soap/v1/Service.asmx'
+SOAP = '{http://schemas.xmlsoap.org/soap/envelope/}'
+NS = '{' + NAMESPACE + '}'
+PROFILE_TRANSACTION_RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><CreateCustomerProfileTransactionResponse xmlns="'
+    'https://api.authorize.net/soap/v1/">'
+    '<CreateCustomerProfileTransactionResult><resultCode>Ok</resultCode>'
+    '<messages><MessagesTypeMessage><code>I00001</code>'
+    '<text>Successful.</text></MessagesTypeMessage></messages>'
+    '<directResponse>{0}</directResponse>'
+    '</CreateCustomerProfileTransactionResult>'
+    '</CreateCustomerProfileTransactionResponse></soap:Body></soap:Envelope>'
+).format(RESPONSE)
+SUBSCRIPTION_RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><ARBCreateSubscriptionResponse xmlns="'
+    'https://api.authorize.net/soap/v1/"><ARBCreateSubscriptionResult>'
+    '<resultCode>Ok</resultCode><messages><MessagesTypeMessage>'
+    '<code>I00001</code><text>Successful.</text></MessagesTypeMessage>'
+    '</messages><subscriptionId>123</subscriptionId>'
+    '</ARBCreateSubscriptionResult></ARBCreateSubscriptionResponse>'
+    '</soap:Body></soap:Envelope>'
+)
+ERROR_RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><CreateCustomerProfileTransactionResponse xmlns="'
+    'https://api.authorize.net/soap/v1/">'
+    '<CreateCustomerProfileTransactionResult><resultCode>Error</resultCode>'
+    '<messages><MessagesTypeMessage><code>E00016</code>'
+    '<text>The field type is invalid.</text></MessagesTypeMessage>'
+    '</messages></CreateCustomerProfileTransactionResult>'
+    '</CreateCustomerProfileTransactionResponse></soap:Body></soap:Envelope>'
+)
+FAULT_RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><soap:Fault><faultcode>soap:Client</faultcode>'
+    '<faultstring>Server was unable to read request.</faultstring>'
+    '</soap:Fault></soap:Body></soap:Envelope>'
+)
+
+def respond(body, status=200):
+    return PooledResponse(status, 'OK', {}, body)
+
+class SoapTemplatesTests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.templates = SoapTemplates(TEST_URL, self.pool, '1<&>',
+            u'key\xe9')
+
+    def sent(self, operation):
+        url, envelope, headers = self.pool.urlopen.call_args[0]
+        self.assertEqual(url, ENDPOINT)
+        self.assertEqual(headers['SOAPAction'],
+            '"{0}{1}"'.format(NAMESPACE, operation))
+        self.assertEqual(headers['Content-Type'], 'text/xml; charset=utf-8')
+        request = fromstring(envelope).find(SOAP + 'Body')[0]
+        self.assertEqual(request.tag, NS + operation)
+        auth = request.find(NS + 'merchantAuthentication')
+        self.assertEqual(auth.findtext(NS + 'name'), '1<&>')
+        self.assertEqual(auth.findtext(NS + 'transactionKey'), u'key\xe9')
+        return request
+
+    def test_profile_transaction(self):
+        self.pool.urlopen.return_value = respond(
+            PROFILE_TRANSACTION_RESPONSE)
+        result = self.templates.profile_transaction('profileTransAuthOnly',
+            '1', '2', '20.00', 'x_a=1&x_b=<2>')
+        self.assertEqual(result.resultCode, 'Ok')
+        self.assertEqual(result.directResponse, RESPONSE)
+        request = self.sent('CreateCustomerProfileTransaction')
+        self.assertEqual([child.tag for child in request], [NS + tag for tag in
+            ('merchantAuthentication', 'transaction', 'extraOptions')])
+        auth = request.find(NS + 'transaction')[0]
+        self.assertEqual(auth.tag, NS + 'profileTransAuthOnly')
+        self.assertEqual([(child.tag, child.text) for child in auth], [
+            (NS + 'amount', '20.00'),
+            (NS + 'customerProfileId', '1'),
+            (NS + 'customerPaymentProfileId', '2'),
+        ])
+        self.assertEqual(request.findtext(NS + 'extraOptions'),
+            'x_a=1&x_b=<2>')
+
+        # Missing values are sent empty rather than as 'None'
+        self.templates.profile_transaction('profileTransAuthOnly', '1', '2',
+            '20.00', None)
+        request = self.sent('CreateCustomerProfileTransaction')
+        self.assertEqual(request.findtext(NS + 'extraOptions'), '')
+        self.templates.create_subscription('10.00', '4111111111111111',
+            '2030-01', None, 'Jeff', None, 'months', 1, '2030-01-01', 9999)
+        subscription = self.sent('ARBCreateSubscription').find(
+            NS + 'subscription')
+        self.assertEqual(subscription.findtext(NS + 'payment/' + NS +
+            'creditCard/' + NS + 'cardCode'), '')
+        self.assertEqual(subscription.findtext(
+            NS + 'billTo/' + NS + 'lastName'), '')
+
+    def test_create_subscription(self):
+        self.pool.urlopen.return_value = respond(SUBSCRIPTION_RESPONSE)
+        result = self.templates.create_subscription('10.00',
+            '4111111111111111', '2030-01', '911', 'Jeff', 'Sch<e>nck',
+            'months', 1, '2030-01-01', 9999)
+        self.assertEqual(result.subscriptionId, '123')
+        request = self.sent('ARBCreateSubscription')
+        subscription = request.find(NS + 'subscription')
+        self.assertEqual([child.tag for child in subscription], [
+            NS + tag for tag in ('paymentSchedule', 'amount', 'payment',
+            'billTo')])
+        schedule = subscription.find(NS + 'paymentSchedule')
+        self.assertEqual([child.tag for child in schedule], [NS + tag
+            for tag in ('interval', 'startDate', 'totalOccurrences')])
+        self.assertEqual(schedule.findtext(NS + 'interval/' + NS + 'length'),
+            '1')
+        self.assertEqual(schedule.findtext(NS + 'interval/' + NS + 'unit'),
+            'months')
+        self.assertEqual(schedule.findtext(NS + 'startDate'), '2030-01-01')
+        self.assertEqual(schedule.findtext(NS + 'totalOccurrences'), '9999')
+        self.assertEqual(subscription.findtext(NS + 'amount'), '10.00')
+        card = subscription.find(NS + 'payment/' + NS + 'creditCard')
+        self.assertEqual([(child.tag, child.text) for child in card], [
+            (NS + 'cardNumber', '4111111111111111'),
+            (NS + 'expirationDate', '2030-01'),
+            (NS + 'cardCode', '911'),
+        ])
+        self.assertEqual(subscription.findtext(
+            NS + 'billTo/' + NS + 'lastName'), 'Sch<e>nck')
+
+        # Test with trial period
+        self.templates.create_subscription('10.00', '4111111111111111',
+            '2030-01', '911', 'Jeff', 'Schenck', 'days', 14, '2030-01-01', 10,
+            trial_amount='5.00', trial_occurrences=3)
+        subscription = self.sent('ARBCreateSubscription').find(
+            NS + 'subscription')
+        self.assertEqual([child.tag for child in subscription], [
+            NS + tag for tag in ('paymentSchedule', 'amount', 'trialAmount',
+            'payment', 'billTo')])
+        self.assertEqual(subscription.findtext(NS + 'trialAmount'), '5.00')
+        self.assertEqual(subscription.findtext(
+            NS + 'paymentSchedule/' + NS + 'trialOccurrences'), '3')
+
+    def test_parse_result(self):
+        result = parse_result(ERROR_RESPONSE)
+        self.assertEqual(result.resultCode, 'Error')
+        self.assertEqual(result.messages[0][0].code, 'E00016')
+        self.assertEqual(result.messages[0][0].text,
+            'The field type is invalid.')
+        self.assertEqual(result.directResponse, None)
+        self.assertRaises(SoapFault, parse_result, FAULT_RESPONSE)
+        self.assertRaises(SoapFault, parse_result, 'Service Unavailable')
+
+    def test_http_errors(self):
+        self.pool.urlopen.return_value = respond(FAULT_RESPONSE, status=500)
+        self.assertRaises(SoapFault, self.templates.profile_transaction,
+            'profileTransAuthOnly', '1', '2', '20.00', '')
+        self.pool.urlopen.return_value = respond('Unavailable', status=503)
+        self.assertRaises(IOError, self.templates.profile_transaction,
+            'profileTransAuthOnly', '1', '2', '20.00', '')
+
+class TemplateAPITests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.customer = CustomerAPI('123', '456', pool=self.pool,
+            marshaller='templates')
+        self.recurring = RecurringAPI('123', '456', pool=self.pool,
+            marshaller='templates')
+        year = date.today().year + 10
+        self.credit_card = CreditCard('4111111111111111', year, 1, '911',
+            'Jeff', 'Schenck')
+        self.start = date.today() + timedelta(days=7)
+
+    def test_marshaller_option(self):
+        self.assertEqual(CustomerAPI('123', '456').templates, None)
+        self.assertEqual(RecurringAPI('123', '456').templates, None)
+        self.assertTrue(isinstance(self.customer.templates, SoapTemplates))
+        self.assertTrue(isinstance(self.recurring.templates, SoapTemplates))
+        self.assertRaises(ValueError, CustomerAPI, '123', '456',
+            marshaller='fast')
+        self.assertRaises(ValueError, RecurringAPI, '123', '456',
+            marshaller='fast')
+
+    def test_customer_transactions(self):
+        self.pool.urlopen.return_value = respond(
+            PROFILE_TRANSACTION_RESPONSE)
+        for method, kind in ((self.customer.auth, 'profileTransAuthOnly'),
+                (self.customer.capture, 'profileTransAuthCapture'),
+                (self.customer.credit, 'profileTransRefund')):
+            self.assertEqual(method('1', '2', 20), PARSED_RESPONSE)
+            envelope = self.pool.urlopen.call_args[0][1]
+            details = fromstring(envelope).find(SOAP + 'Body')[0].find(
+                NS + 'transaction')[0]
+            self.assertEqual(details.tag, NS + kind)
+            self.assertEqual(details.findtext(NS + 'amount'), '20.00')
+        self.assertFalse(hasattr(self.customer, '_client'))
+
+    def test_customer_errors(self):
+        self.pool.urlopen.return_value = respond(ERROR_RESPONSE)
+        try:
+            self.customer.auth('1', '2', 20)
+        except AuthorizeResponseError as e:
+            self.assertEqual(str(e), 'E00016: The field type is invalid.')
+            self.assertEqual(e.full_response, {
+                'response_code': 'E00016',
+                'response_text': 'The field type is invalid.',
+            })
+        else:
+            self.fail('AuthorizeResponseError not raised')
+        self.pool.urlopen.return_value = respond(FAULT_RESPONSE, status=500)
+        self.assertRaises(AuthorizeConnectionError, self.customer.capture,
+            '1', '2', 20)
+        self.pool.urlopen.side_effect = httplib.BadStatusLine('')
+        self.assertRaises(AuthorizeConnectionError, self.customer.capture,
+            '1', '2', 20)
+
+    def test_create_subscription(self):
+        self.pool.urlopen.return_value = respond(SUBSCRIPTION_RESPONSE)
+        self.assertEqual(self.recurring.create_subscription(self.credit_card,
+            10, self.start, months=1, trial_amount=5, trial_occurrences=3),
+            '123')
+        envelope = self.pool.urlopen.call_args[0][1]
+        subscription = fromstring(envelope).find(SOAP + 'Body')[0].find(
+            NS + 'subscription')
+        self.assertEqual(subscription.findtext(NS + 'amount'), '10.00')
+        self.assertEqual(subscription.findtext(NS + 'trialAmount'), '5.00')
+        self.assertEqual(subscription.findtext(NS + 'paymentSchedule/' + NS +
+            'totalOccurrences'), '9999')
+        self.assertEqual(subscription.findtext(NS + 'paymentSchedule/' + NS +
+            'startDate'), self.start.strftime('%Y-%m-%d'))
+        self.assertRaises(AuthorizeInvalidError,
+            self.recurring.create_subscription, self.credit_card, 10,
+            self.start)
+        self.assertFalse(hasattr(self.recurring, '_client'))
+
+        self.pool.urlopen.return_value = respond(ERROR_RESPONSE)
+        self.assertRaises(AuthorizeResponseError,
+            self.recurring.create_subscription, self.credit_card, 10,
+            self.start, days=30)
+        self.pool.urlopen.side_effect = IOError('Borked')
+        self.assertRaises(AuthorizeConnectionError,
+            self.recurring.create_subscription, self.credit_card, 10,
+            self.start, days=30)
@@ -1,23 +1,30 @@
 from cStringIO import StringIO
 from datetime import date
+import httplib
+import pickle
 
 import mock
 from unittest import TestCase
 if not hasattr(TestCase, 'assertIsNotNone'):
     from unittest2 import TestCase
 
-from authorize.apis.transaction import PROD_URL, TEST_URL, TransactionAPI
+from authorize.apis.transaction import FIELD_INDEXES, PROD_URL, TEST_URL, \
+    TransactionAPI, TransactionResult, parse_response
 from authorize.data import Address, CreditCard
 from authorize.exceptions import AuthorizeConnectionError, \
     AuthorizeResponseError
+from authorize.pool import ConnectionPool
 
 
+BASE_URL = TEST_URL + '?x_delim_char=%3B&x_delim_data=TRUE&x_encap_char=%7C' \
+    '&x_login=123&x_test_request=FALSE&x_tran_key=456&x_version=3.1'
 SUCCESS = StringIO(
     '1;1;1;This transaction has been approved.;IKRAGJ;Y;2171062816;;;20.00;CC'
     ';auth_only;;Jeffrey;Schenck;;45 Rose Ave;Venice;CA;90291;USA;;;;;;;;;;;;'
     ';;;;;375DD9293D7605E20DF0B437EE2A7B92;P;2;;;;;;;;;;;XXXX1111;Visa;;;;;;;'
     ';;;;;;;;;;Y')
-PARSED_SUCCESS = {
+PARSED_SUCCESS = dict.fromkeys(FIELD_INDEXES, '')
+PARSED_SUCCESS.update({
     'cvv_response': 'P',
     'authorization_code': 'IKRAGJ',
     'response_code': '1',
@@ -27,13 +34,27 @@ PARSED_SUCCESS = {
     'response_reason_code': '1',
     'response_reason_text': 'This transaction has been approved.',
     'transaction_id': '2171062816',
-}
+    'response_subcode': '1',
+    'method': 'CC',
+    'first_name': 'Jeffrey',
+    'last_name': 'Schenck',
+    'address': '45 Rose Ave',
+    'city': 'Venice',
+    'state': 'CA',
+    'zip_code': '90291',
+    'country': 'USA',
+    'md5_hash': '375DD9293D7605E20DF0B437EE2A7B92',
+    'cavv_response': '2',
+    'account_number': 'XXXX1111',
+    'card_type': 'Visa',
+})
 ERROR = StringIO(
     '2;1;2;This transaction has been declined.;000000;N;2171062816;;;20.00;CC'
     ';auth_only;;Jeffrey;Schenck;;45 Rose Ave;Venice;CA;90291;USA;;;;;;;;;;;;'
     ';;;;;375DD9293D7605E20DF0B437EE2A7B92;N;1;;;;;;;;;;;XXXX1111;Visa;;;;;;;'
     ';;;;;;;;;;Y')
-PARSED_ERROR = {
+PARSED_ERROR = dict.fromkeys(FIELD_INDEXES, '')
+PARSED_ERROR.update({
     'cvv_response': 'N',
     'authorization_code': '000000',
     'response_code': '2',
@@ -43,7 +64,82 @@ PARSED_ERROR = {
     'response_reason_code': '2',
     'response_reason_text': 'This transaction has been declined.',
     'transaction_id': '2171062816',
-}
+    'response_subcode': '1',
+    'method': 'CC',
+    'first_name': 'Jeffrey',
+    'last_name': 'Schenck',
+    'address': '45 Rose Ave',
+    'city': 'Venice',
+    'state': 'CA',
+    'zip_code': '90291',
+    'country': 'USA',
+    'md5_hash': '375DD9293D7605E20DF0B437EE2A7B92',
+    'cavv_response': '1',
+    'account_number': 'XXXX1111',
+    'card_type': 'Visa',
+})
+# The success response as sent with x_encap_char, with a delimiter in a value
+ENCAPSULATED_FIELDS = SUCCESS.getvalue().split(';')
+ENCAPSULATED_FIELDS[16] = '45 Rose Ave; Apt 2'
+ENCAPSULATED = '|{0}|'.format('|;|'.join(ENCAPSULATED_FIELDS))
+
+class TransactionResultTests(TestCase):
+    def test_parse_response(self):
+        result = parse_response(SUCCESS.getvalue())
+        self.assertTrue(isinstance(result, TransactionResult))
+        self.assertEqual(result, PARSED_SUCCESS)
+        self.assertEqual(dict(result), PARSED_SUCCESS)
+        self.assertEqual(len(result), len(PARSED_SUCCESS))
+        self.assertEqual(result['md5_hash'], '375DD9293D7605E20DF0B437EE2A7B92')
+        self.assertEqual(result.get('invoice_number'), '')
+        self.assertEqual(result.get('unknown', 'default'), 'default')
+        self.assertTrue('card_type' in result)
+        self.assertFalse('unknown' in result)
+        self.assertRaises(KeyError, lambda: result['unknown'])
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertTrue('2171062816' in repr(result))
+
+    def test_parse_encapsulated_response(self):
+        result = parse_response(ENCAPSULATED)
+        self.assertEqual(result['address'], '45 Rose Ave; Apt 2')
+        self.assertEqual(result['city'], 'Venice')
+        self.assertEqual(result['account_number'], 'XXXX1111')
+        expected = dict(PARSED_SUCCESS, address='45 Rose Ave; Apt 2')
+        self.assertEqual(result, expected)
+
+    def test_parse_encapsulated_response_line_break(self):
+        result = parse_response(ENCAPSULATED + '\r\n')
+        self.assertEqual(result['response_code'], '1')
+        self.assertEqual(result['address'], '45 Rose Ave; Apt 2')
+        self.assertEqual(result, dict(PARSED_SUCCESS,
+            address='45 Rose Ave; Apt 2'))
+
+    def test_parse_unicode_response(self):
+        result = parse_response(unicode(ENCAPSULATED))
+        self.assertEqual(result, dict(PARSED_SUCCESS,
+            address='45 Rose Ave; Apt 2'))
+
+    def test_parse_short_response(self):
+        result = parse_response('3;1;13;The merchant login ID is invalid.')
+        self.assertEqual(result['response_code'], '3')
+        self.assertEqual(result['response_reason_code'], '13')
+        self.assertEqual(result['transaction_id'], '')
+        self.assertEqual(result['card_type'], '')
+
+    def test_from_fields(self):
+        result = TransactionResult.from_fields(PARSED_SUCCESS)
+        self.assertEqual(result, PARSED_SUCCESS)
+        result = TransactionResult.from_fields({'transaction_id': '9'})
+        self.assertEqual(result['transaction_id'], '9')
+        self.assertEqual(result['response_code'], '')
+        self.assertRaises(KeyError, TransactionResult.from_fields,
+            {'unknown': '1'})
+
+    def test_pickle(self):
+        result = parse_response(ENCAPSULATED)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(result, protocol)),
+                result)
 
 class TransactionAPITests(TestCase):
     def setUp(self):
@@ -57,128 +153,120 @@ class TransactionAPITests(TestCase):
     def test_basic_api(self):
         api = TransactionAPI('123', '456')
         self.assertEqual(api.url, TEST_URL)
+        self.assertEqual(api.base_url, BASE_URL)
+        self.assertTrue(isinstance(api.pool, ConnectionPool))
         api = TransactionAPI('123', '456', debug=False)
         self.assertEqual(api.url, PROD_URL)
+        self.assertTrue(api.base_url.startswith(PROD_URL + '?'))
+        pool = ConnectionPool()
+        api = TransactionAPI('123', '456', pool=pool)
+        self.assertTrue(api.pool is pool)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_make_call(self, urlopen):
         urlopen.side_effect = self.success
-        result = self.api._make_call({'a': '1', 'b': '2'})
+        result = self.api._make_call('a=1', None, 'b=2')
         self.assertEqual(urlopen.call_args[0][0],
-            '{0}?a=1&b=2'.format(TEST_URL))
+            '{0}&a=1&b=2'.format(BASE_URL))
         self.assertEqual(result, PARSED_SUCCESS)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_make_call_connection_error(self, urlopen):
         urlopen.side_effect = IOError('Borked')
         self.assertRaises(AuthorizeConnectionError, self.api._make_call,
-            {'a': '1', 'b': '2'})
+            'a=1&b=2')
+        urlopen.side_effect = httplib.BadStatusLine('')
+        self.assertRaises(AuthorizeConnectionError, self.api._make_call,
+            'a=1&b=2')
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_make_call_response_error(self, urlopen):
         urlopen.side_effect = self.error
         try:
-            self.api._make_call({'a': '1', 'b': '2'})
+            self.api._make_call('a=1&b=2')
         except AuthorizeResponseError as e:
             self.assertTrue(str(e).startswith('This transaction has been declined.'))
             self.assertEqual(e.full_response, PARSED_ERROR)
 
-    def test_add_params(self):
-        self.assertEqual(self.api._add_params({}), {})
-        params = self.api._add_params({}, credit_card=self.credit_card)
-        self.assertEqual(params, {
-            'x_card_num': '4111111111111111',
-            'x_exp_date': '01-{0}'.format(self.year),
-            'x_card_code': '911',
-        })
-        params = self.api._add_params({}, address=self.address)
-        self.assertEqual(params, {
-            'x_address': '45 Rose Ave',
-            'x_city': 'Venice',
-            'x_state': 'CA',
-            'x_zip': '90291',
-            'x_country': 'US',
-        })
-        params = self.api._add_params({},
-            credit_card=self.credit_card, address=self.address)
-        self.assertEqual(params, {
-            'x_card_num': '4111111111111111',
-            'x_exp_date': '01-{0}'.format(self.year),
-            'x_card_code': '911',
-            'x_address': '45 Rose Ave',
-            'x_city': 'Venice',
-            'x_state': 'CA',
-            'x_zip': '90291',
-            'x_country': 'US',
-        })
-
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    def test_encode_payment(self):
+        self.assertEqual(self.api.encode_payment(), '')
+        self.assertEqual(self.api.encode_payment(self.credit_card),
+            'x_card_num=4111111111111111&x_exp_date=01-{0}'
+            '&x_card_code=911'.format(self.year))
+        self.assertEqual(self.api.encode_payment(address=self.address),
+            'x_address=45+Rose+Ave&x_city=Venice&x_state=CA&x_zip=90291'
+            '&x_country=US')
+        self.assertEqual(
+            self.api.encode_payment(self.credit_card, self.address),
+            'x_card_num=4111111111111111&x_exp_date=01-{0}&x_card_code=911'
+            '&x_address=45+Rose+Ave&x_city=Venice&x_state=CA&x_zip=90291'
+            '&x_country=US'.format(self.year))
+
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_auth(self, urlopen):
         urlopen.side_effect = self.success
         result = self.api.auth(20, self.credit_card, self.address)
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_zip=90291&x_card_num=4111111111111111&x_amount=20.00'
-            '&x_tran_key=456&x_city=Venice&x_country=US&x_version=3.1'
-            '&x_state=CA&x_delim_char=%3B&x_address=45+Rose+Ave'
-            '&x_exp_date=01-{0}&x_test_request=FALSE&x_card_code=911'
-            '&x_type=AUTH_ONLY&x_delim_data=TRUE'.format(str(self.year)))
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=AUTH_ONLY&x_card_num=4111111111111111'
+            '&x_exp_date=01-{0}&x_card_code=911&x_address=45+Rose+Ave'
+            '&x_city=Venice&x_state=CA&x_zip=90291&x_country=US'
+            '&x_amount=20.00'.format(self.year))
         self.assertEqual(result, PARSED_SUCCESS)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+        # Test with the card and address already encoded
+        result = self.api.auth(20.5, self.credit_card, self.address,
+            payment='x_card_num=4111111111111111')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=AUTH_ONLY&x_card_num=4111111111111111&x_amount=20.50')
+
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_capture(self, urlopen):
         urlopen.side_effect = self.success
         result = self.api.capture(20, self.credit_card, self.address)
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_zip=90291&x_card_num=4111111111111111&x_amount=20.00'
-            '&x_tran_key=456&x_city=Venice&x_country=US&x_version=3.1'
-            '&x_state=CA&x_delim_char=%3B&x_address=45+Rose+Ave'
-            '&x_exp_date=01-{0}&x_test_request=FALSE&x_card_code=911'
-            '&x_type=AUTH_CAPTURE&x_delim_data=TRUE'.format(str(self.year)))
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=AUTH_CAPTURE&x_card_num=4111111111111111'
+            '&x_exp_date=01-{0}&x_card_code=911&x_address=45+Rose+Ave'
+            '&x_city=Venice&x_state=CA&x_zip=90291&x_country=US'
+            '&x_amount=20.00'.format(self.year))
         self.assertEqual(result, PARSED_SUCCESS)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+        # Test with the card and address already encoded
+        result = self.api.capture(20.5, self.credit_card, self.address,
+            payment='x_card_num=4111111111111111')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=AUTH_CAPTURE&x_card_num=4111111111111111'
+            '&x_amount=20.50')
+
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_settle(self, urlopen):
         urlopen.side_effect = self.success
 
         # Test without specified amount
         result = self.api.settle('123456')
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_trans_id=123456&x_version=3.1&x_delim_char=%3B'
-            '&x_type=PRIOR_AUTH_CAPTURE&x_delim_data=TRUE&x_tran_key=456'
-            '&x_test_request=FALSE')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=PRIOR_AUTH_CAPTURE&x_trans_id=123456')
         self.assertEqual(result, PARSED_SUCCESS)
 
         # Test with specified amount
         result = self.api.settle('123456', amount=10)
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_trans_id=123456&x_version=3.1&x_delim_char=%3B'
-            '&x_type=PRIOR_AUTH_CAPTURE&x_amount=10.00&x_delim_data=TRUE'
-            '&x_tran_key=456&x_test_request=FALSE')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=PRIOR_AUTH_CAPTURE&x_trans_id=123456&x_amount=10.00')
         self.assertEqual(result, PARSED_SUCCESS)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_credit(self, urlopen):
         urlopen.side_effect = self.success
 
         # Test with transaction_id, amount
         result = self.api.credit('1111', '123456', 10)
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_trans_id=123456&x_version=3.1&x_amount=10.00&x_delim_char=%3B'
-            '&x_type=CREDIT&x_card_num=1111&x_delim_data=TRUE&x_tran_key=456'
-            '&x_test_request=FALSE')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=CREDIT&x_trans_id=123456&x_card_num=1111&x_amount=10.00')
         self.assertEqual(result, PARSED_SUCCESS)
 
-    @mock.patch('authorize.apis.transaction.urllib.urlopen')
+    @mock.patch('authorize.pool.ConnectionPool.urlopen')
     def test_void(self, urlopen):
         urlopen.side_effect = self.success
         result = self.api.void('123456')
-        self.assertEqual(urlopen.call_args[0][0],
-            'https://test.authorize.net/gateway/transact.dll?x_login=123'
-            '&x_trans_id=123456&x_version=3.1&x_delim_char=%3B&x_type=VOID'
-            '&x_delim_data=TRUE&x_tran_key=456&x_test_request=FALSE')
+        self.assertEqual(urlopen.call_args[0][0], BASE_URL +
+            '&x_type=VOID&x_trans_id=123456')
         self.assertEqual(result, PARSED_SUCCESS)
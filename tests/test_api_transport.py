@@ -0,0 +1,55 @@
+import mock
+from suds.transport import Request, TransportError
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize.apis.transport import PooledTransport
+from authorize.pool import PooledResponse
+
+
+URL = 'https://apitest.authorize.net/soap/v1/Service.asmx'
+
+class PooledTransportTests(TestCase):
+    def setUp(self):
+        self.pool = mock.Mock()
+        self.transport = PooledTransport(self.pool)
+
+    def test_open(self):
+        self.pool.urlopen.return_value = PooledResponse(200, 'OK', {},
+            '<wsdl/>')
+        result = self.transport.open(Request(URL + '?WSDL'))
+        self.assertEqual(result.read(), '<wsdl/>')
+        self.assertEqual(self.pool.urlopen.call_args,
+            ((URL + '?WSDL',), {'headers': {}}))
+
+        self.pool.urlopen.return_value = PooledResponse(404, 'Not Found',
+            {}, '')
+        self.assertRaises(TransportError, self.transport.open,
+            Request(URL + '?WSDL'))
+
+    def test_send(self):
+        request = Request(URL, '<envelope/>')
+        request.headers = {'SOAPAction': 'Test'}
+        self.pool.urlopen.return_value = PooledResponse(200, 'OK',
+            {'content-type': 'text/xml'}, '<reply/>')
+        reply = self.transport.send(request)
+        self.assertEqual(self.pool.urlopen.call_args,
+            ((URL, '<envelope/>', {'SOAPAction': 'Test'}), {}))
+        self.assertEqual(reply.code, 200)
+        self.assertEqual(reply.message, '<reply/>')
+        self.assertEqual(reply.headers, {'content-type': 'text/xml'})
+
+        self.pool.urlopen.return_value = PooledResponse(202, 'Accepted',
+            {}, '')
+        self.assertEqual(self.transport.send(request), None)
+
+        self.pool.urlopen.return_value = PooledResponse(500, 'Error', {},
+            '<fault/>')
+        try:
+            self.transport.send(request)
+        except TransportError as e:
+            self.assertEqual(e.httpcode, 500)
+            self.assertEqual(e.fp.read(), '<fault/>')
+        else:
+            self.fail('TransportError not raised')
@@ -0,0 +1,132 @@
+from datetime import date
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+from test_client import TRANSACTION_RESULT
+from test_data import TEST_BANK_ACCOUNT
+
+from authorize import Address, BankAccount, CreditCard
+from authorize.apis.jsonapi import JSONTransactionAPI
+from authorize.asynchronous import AsyncAuthorizeBankAccount, \
+    AsyncAuthorizeClient, AsyncAuthorizeCreditCard, AsyncAuthorizeRecurring, \
+    AsyncAuthorizeSavedAccount, AsyncAuthorizeSavedCard, \
+    AsyncAuthorizeTransaction
+from authorize.exceptions import AuthorizeResponseError
+from authorize.instrument import Instrumentation
+
+
+class AsyncClientTests(TestCase):
+    def setUp(self):
+        self.patchers = [mock.patch('authorize.client.{0}'.format(api))
+            for api in ('TransactionAPI', 'CustomerAPI', 'RecurringAPI')]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = AsyncAuthorizeClient('123', '456', max_concurrency=4)
+        self.apis = self.client.client
+        self.year = date.today().year + 10
+        self.credit_card = CreditCard('4111111111111111', self.year, 1, '911',
+            'Jeff', 'Schenck')
+        self.bank_account = BankAccount(**dict(TEST_BANK_ACCOUNT))
+        self.address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+
+    def tearDown(self):
+        self.client.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_basic_async_client(self):
+        self.assertEqual(self.client.max_concurrency, 4)
+        self.assertEqual(self.apis.pool.maxsize, 4)
+        self.assertTrue(isinstance(self.client.card(self.credit_card),
+            AsyncAuthorizeCreditCard))
+        self.assertTrue(isinstance(self.client.check(self.bank_account),
+            AsyncAuthorizeBankAccount))
+        self.assertTrue(isinstance(self.client.transaction('1'),
+            AsyncAuthorizeTransaction))
+        self.assertTrue(isinstance(self.client.saved_card('1|2'),
+            AsyncAuthorizeSavedCard))
+        self.assertTrue(isinstance(self.client.saved_check('1|2'),
+            AsyncAuthorizeSavedAccount))
+        self.assertTrue(isinstance(self.client.recurring('1'),
+            AsyncAuthorizeRecurring))
+        repr(self.client.card(self.credit_card, self.address))
+        repr(self.client.check(self.bank_account))
+
+    def test_async_client_options(self):
+        instrumentation = Instrumentation()
+        client = AsyncAuthorizeClient('123', '456', backend='json',
+            instrumentation=instrumentation)
+        self.assertEqual(client.client.backend, 'json')
+        self.assertTrue(isinstance(client.client._transaction,
+            JSONTransactionAPI))
+        self.assertTrue(client.client.instrumentation is instrumentation)
+        client.close()
+        client = AsyncAuthorizeClient('123', '456', soap_marshaller='templates')
+        self.assertEqual(client.client.soap_marshaller, 'templates')
+        client.close()
+
+    def test_async_credit_card(self):
+        self.apis._transaction.capture.return_value = TRANSACTION_RESULT
+        card = self.client.card(self.credit_card, self.address)
+        future = card.capture(10)
+        transaction = future.result()
+        self.assertEqual(self.apis._transaction.capture.call_args,
+            ((10, self.credit_card, self.address),
+            {'payment': self.apis._transaction.encode_payment.return_value}))
+        self.assertTrue(isinstance(transaction, AsyncAuthorizeTransaction))
+        self.assertEqual(transaction.uid, '2171062816')
+        self.assertEqual(transaction.full_response, TRANSACTION_RESULT)
+
+        self.apis._recurring.create_subscription.return_value = '1'
+        today = date.today()
+        recurring = card.recurring(10, today, months=1).result()
+        self.assertTrue(isinstance(recurring, AsyncAuthorizeRecurring))
+        self.assertEqual(recurring.uid, '1')
+
+    @mock.patch('authorize.client.last_call')
+    def test_async_transaction_timings(self, last_call):
+        # Timings are taken on the worker thread that made the call
+        self.apis._transaction.capture.return_value = TRANSACTION_RESULT
+        last_call.return_value.phases = {'ttfb': 0.25}
+        card = self.client.card(self.credit_card)
+        self.assertEqual(card.capture(10).result().timings, {'ttfb': 0.25})
+        self.assertEqual(self.client.transaction('123').timings, None)
+
+    def test_async_transaction(self):
+        self.apis._transaction.void.return_value = TRANSACTION_RESULT
+        transaction = self.client.transaction('123')
+        result = transaction.void().result()
+        self.assertEqual(self.apis._transaction.void.call_args,
+            (('123',), {}))
+        self.assertEqual(result.uid, '2171062816')
+
+    def test_async_saved_card(self):
+        self.apis._customer.auth.return_value = TRANSACTION_RESULT
+        saved = self.client.saved_card('1|2')
+        result = saved.auth(10).result()
+        self.assertEqual(self.apis._customer.auth.call_args,
+            (('1', '2', 10), {}))
+        self.assertEqual(result.uid, '2171062816')
+        self.assertEqual(saved.delete().result(), None)
+
+    def test_async_recurring(self):
+        recurring = self.client.recurring('123')
+        recurring.update(occurrences=20).result()
+        self.assertEqual(self.apis._recurring.update_subscription.call_args,
+            (('123',), {'amount': None, 'start': None, 'occurrences': 20,
+            'trial_amount': None, 'trial_occurrences': None}))
+
+    def test_async_errors(self):
+        error = AuthorizeResponseError('Declined')
+        self.apis._transaction.settle.side_effect = error
+        future = self.client.transaction('123').settle()
+        self.assertRaises(AuthorizeResponseError, future.result)
+        self.assertTrue(future.exception() is error)
+
+    def test_async_warmup(self):
+        with mock.patch.object(self.apis, 'warmup') as warmup:
+            self.assertEqual(self.client.warmup().result(),
+                warmup.return_value)
+            self.assertEqual(warmup.call_args, ((4,), {}))
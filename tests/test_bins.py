@@ -0,0 +1,90 @@
+from datetime import date
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize import bins
+from authorize.bins import BinIndex, BinInfo, build_index
+from authorize.data import CreditCard
+
+
+RANGES = '''low,high,issuer,country,funding,card_level,prepaid
+411111,411111,Chase,US,debit,CLASSIC,N
+400000,400999,Bank of Examples,GB,credit,PLATINUM,N
+55555555,55555599,Caf\xc3\xa9 Prepaid,FR,debit,,Y
+371449635,371449635,American Express,US,charge,GOLD,N
+'''
+
+
+class BinIndexTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = self.write_index(RANGES)
+        self.index = BinIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        bins._index = None
+        shutil.rmtree(self.directory)
+
+    def write_index(self, ranges):
+        source = os.path.join(self.directory, 'ranges.csv')
+        with open(source, 'wb') as f:
+            f.write(ranges)
+        path = os.path.join(self.directory, 'bins.idx')
+        build_index(source, path)
+        return path
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.lookup('4111111111111111'),
+            BinInfo(u'Chase', 'US', 'debit', u'CLASSIC', False))
+        self.assertEqual(self.index.lookup('4000001234567899'),
+            BinInfo(u'Bank of Examples', 'GB', 'credit', u'PLATINUM', False))
+        self.assertEqual(self.index.lookup('4009991234567899').country, 'GB')
+        info = self.index.lookup('5555555555554444')
+        self.assertEqual(info.issuer, u'Caf\xe9 Prepaid')
+        self.assertEqual(info.card_level, u'')
+        self.assertTrue(info.prepaid)
+        self.assertEqual(self.index.lookup('371449635398431').funding,
+            'charge')
+
+    def test_lookup_misses(self):
+        for card_number in ('4010001234567899', '3999991234567899',
+                '5555551055554444', '9999999999999999', '371449636398431',
+                '', '4111-1111'):
+            self.assertEqual(self.index.lookup(card_number), None)
+
+    def test_build_index_errors(self):
+        for ranges in (
+                # Overlapping ranges
+                'low,high,issuer,country,funding,card_level,prepaid\n'
+                '4000,4100,A,US,credit,,N\n4099,4200,B,US,credit,,N\n',
+                # High below low
+                'low,high,issuer,country,funding,card_level,prepaid\n'
+                '4100,4000,A,US,credit,,N\n',
+                'low,high,issuer,country,funding,card_level,prepaid\n'
+                '41x0,4100,A,US,credit,,N\n',
+                'low,high,issuer,country,funding,card_level,prepaid\n'
+                '4100,4100,A,USA,credit,,N\n',
+                'low,high,issuer,country,funding,card_level,prepaid\n'
+                '4100,4100,A,US,cash,,N\n'):
+            self.assertRaises(ValueError, self.write_index, ranges)
+
+    def test_not_an_index(self):
+        path = os.path.join(self.directory, 'ranges.csv')
+        self.assertRaises(ValueError, BinIndex, path)
+
+    def test_credit_card_bin_info(self):
+        credit_card = CreditCard('4111111111111111', date.today().year + 10,
+            1, '911')
+        self.assertEqual(credit_card.bin_info, None)
+        self.assertEqual(bins.lookup('4111111111111111'), None)
+        index = bins.load(self.path)
+        self.assertEqual(index.path, self.path)
+        self.assertEqual(credit_card.bin_info.issuer, u'Chase')
+        index.close()
@@ -0,0 +1,102 @@
+from datetime import date
+
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase, skipUnless
+else:
+    from unittest import skipUnless
+from test_data import TEST_CARD_NUMBERS
+
+from authorize.data import CreditCard
+from authorize.exceptions import AuthorizeInvalidError
+
+try:
+    import numpy
+    from authorize.bulk import validate_cards, ERROR_MESSAGES, EXPIRED, \
+        INVALID_CVV, INVALID_NUMBER, UNKNOWN_CARD_TYPE, VALID
+except ImportError:
+    numpy = None
+
+
+@skipUnless(numpy, 'Bulk validation needs NumPy.')
+class ValidateCardsTests(TestCase):
+    def setUp(self):
+        self.today = date(2020, 6, 15)
+
+    def validate(self, *rows):
+        return list(validate_cards(*zip(*rows), today=self.today))
+
+    def test_valid_cards(self):
+        rows = [(number, 2030, 1, '911')
+            for card_type, number in TEST_CARD_NUMBERS]
+        self.assertEqual(self.validate(*rows), [VALID] * len(rows))
+        self.assertEqual(self.validate(
+            ('4111-1111-1111-1111', '2030', '01', 911),
+            (4111111111111111, 2030, 12, '1234'),
+        ), [VALID, VALID])
+
+    def test_invalid_number(self):
+        self.assertEqual(self.validate(
+            ('4111111111111112', 2030, 1, '911'),
+            ('', 2030, 1, '911'),
+            ('abcd', 2030, 1, '911'),
+        ), [INVALID_NUMBER] * 3)
+
+    def test_expiration(self):
+        self.assertEqual(self.validate(
+            ('4111111111111111', 2020, 6, '911'),
+            ('4111111111111111', 2020, 5, '911'),
+            ('4111111111111111', 2019, 12, '911'),
+            ('4111111111111111', 2030, 13, '911'),
+            ('4111111111111111', 2030, 0, '911'),
+            ('4111111111111111', 'soon', 1, '911'),
+        ), [VALID] + [EXPIRED] * 5)
+
+    def test_cvv(self):
+        self.assertEqual(self.validate(
+            ('4111111111111111', 2030, 1, '91'),
+            ('4111111111111111', 2030, 1, '91111'),
+            ('4111111111111111', 2030, 1, '9a1'),
+            ('4111111111111111', 2030, 1, None),
+        ), [INVALID_CVV] * 4)
+
+    def test_card_type(self):
+        # Passes the Luhn check, but matches no card type
+        self.assertEqual(self.validate(
+            ('1234567812345670', 2030, 1, '911'),
+            ('411111111111116', 2030, 1, '911'),
+        ), [UNKNOWN_CARD_TYPE] * 2)
+
+    def test_first_error_wins(self):
+        self.assertEqual(self.validate(
+            ('4111111111111112', 2019, 1, '9'),
+            ('4111111111111111', 2019, 1, '9'),
+            ('1234567812345670', 2030, 1, '9'),
+        ), [INVALID_NUMBER, EXPIRED, INVALID_CVV])
+
+    def test_matches_credit_card(self):
+        self.today = date.today()
+        year = self.today.year
+        rows = [
+            ('4111111111111111', year + 1, 1, '911'),
+            ('4111111111111112', year + 1, 1, '911'),
+            ('4111111111111111', year - 1, 1, '911'),
+            ('4111111111111111', year + 1, 1, '91'),
+            ('1234567812345670', year + 1, 1, '911'),
+            ('370000000000002', year, self.today.month, '1234'),
+        ]
+        for row, code in zip(rows, self.validate(*rows)):
+            try:
+                CreditCard(*row)
+            except AuthorizeInvalidError as e:
+                self.assertEqual(str(e), ERROR_MESSAGES[code])
+            else:
+                self.assertEqual(code, VALID)
+
+    def test_columns(self):
+        self.assertEqual(len(validate_cards([], [], [], [])), 0)
+        self.assertRaises(ValueError, validate_cards,
+            ['4111111111111111'], [2030, 2031], [1], ['911'])
+        codes = validate_cards(numpy.array(['4111111111111111']),
+            numpy.array([2030]), numpy.array([1]), numpy.array(['911']))
+        self.assertEqual(codes.dtype, numpy.uint8)
@@ -1,17 +1,35 @@
 from datetime import date
+import os
+import pickle
+import subprocess
+import sys
+from xml.sax import SAXParseException
 
 import mock
+from suds.transport import TransportError
 from unittest import TestCase
 if not hasattr(TestCase, 'assertIsNotNone'):
     from unittest2 import TestCase
 from test_data import TEST_BANK_ACCOUNT
 
-from authorize import Address, AuthorizeClient, CreditCard, BankAccount
+import authorize
+from authorize import Address, AuthorizeClient, CreditCard, BankAccount, \
+    Money
+from authorize.apis.jsonapi import JSONCustomerAPI, JSONRecurringAPI, \
+    JSONTransactionAPI, TEST_URL as JSON_TEST_URL
 from authorize.client import AuthorizeCreditCard, AuthorizeRecurring, \
     AuthorizeSavedCard, AuthorizeBankAccount, AuthorizeSavedAccount, \
     AuthorizeTransaction
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeInvalidError
+from authorize.instrument import Instrumentation
+from authorize.pool import ConnectionPool
+from authorize.recorder import FlightRecorder
 
 
+def _after_hook(call):
+    pass
+
 TRANSACTION_RESULT = {
     'cvv_response': 'P',
     'authorization_code': 'IKRAGJ',
@@ -24,6 +42,17 @@ TRANSACTION_RESULT = {
     'transaction_id': '2171062816',
 }
 
+class ImportTests(TestCase):
+    def test_import_skips_suds(self):
+        # Only the saved payment and recurring billing APIs need suds
+        root = os.path.dirname(os.path.dirname(os.path.abspath(
+            authorize.__file__)))
+        modules = subprocess.check_output([sys.executable, '-c',
+            'import sys, authorize; print sorted(name for name in '
+            'sys.modules if name.split(".")[0] in ("suds", "uuid"))'],
+            cwd=root)
+        self.assertEqual(modules.strip(), '[]')
+
 class ClientTests(TestCase):
     def setUp(self):
         self.transaction_api_patcher = mock.patch(
@@ -56,11 +85,157 @@ class ClientTests(TestCase):
         self.assertEqual(self.recurring_api.call_args, None)
         client = AuthorizeClient('123', '456', False, False)
         self.assertEqual(self.transaction_api.call_args,
-            (('123', '456', False, False), {}))
+            (('123', '456', False, False), {'pool': client.pool,
+            'instrumentation': client.instrumentation}))
         self.assertEqual(self.customer_api.call_args,
-            (('123', '456', False, False), {}))
+            (('123', '456', False, False),
+            {'pool': client.pool, 'marshaller': 'suds',
+            'instrumentation': client.instrumentation}))
         self.assertEqual(self.recurring_api.call_args,
-            (('123', '456', False, False), {}))
+            (('123', '456', False, False),
+            {'pool': client.pool, 'marshaller': 'suds',
+            'instrumentation': client.instrumentation}))
+        client = AuthorizeClient('123', '456', soap_marshaller='templates')
+        self.assertEqual(self.customer_api.call_args[1]['marshaller'],
+            'templates')
+        self.assertEqual(self.recurring_api.call_args[1]['marshaller'],
+            'templates')
+
+    def test_authorize_client_pickle(self):
+        client = AuthorizeClient('123', '456', debug=False, test=True,
+            pool_size=3, pool_idle_timeout=5, soap_marshaller='templates')
+        client.warmup_timings = {}
+        copied = pickle.loads(pickle.dumps(client, pickle.HIGHEST_PROTOCOL))
+        for name in ('login_id', 'transaction_key', 'debug', 'test',
+                'soap_marshaller', 'backend'):
+            self.assertEqual(getattr(copied, name), getattr(client, name))
+        self.assertFalse(copied.pool is client.pool)
+        self.assertEqual(copied.pool.maxsize, 3)
+        self.assertEqual(copied.pool.idle_timeout, 5)
+        self.assertEqual(copied.warmup_timings, None)
+        self.assertFalse(copied.instrumentation is client.instrumentation)
+        self.assertEqual(self.customer_api.call_args,
+            (('123', '456', False, True),
+            {'pool': copied.pool, 'marshaller': 'templates',
+            'instrumentation': copied.instrumentation}))
+        copied = pickle.loads(pickle.dumps(AuthorizeClient('123', '456',
+            backend='json')))
+        self.assertEqual(copied.backend, 'json')
+
+    def test_authorize_client_pickle_instrumentation(self):
+        instrumentation = Instrumentation(phases=True,
+            recorder=FlightRecorder(size=5))
+        instrumentation.add_hook(after=_after_hook)
+        client = AuthorizeClient('123', '456', backend='json',
+            instrumentation=instrumentation)
+        with instrumentation.measure('transaction', 'VOID'):
+            pass
+        copied = pickle.loads(pickle.dumps(client, pickle.HIGHEST_PROTOCOL))
+        # The settings, recorder and hooks are kept, but not the numbers
+        self.assertTrue(copied.instrumentation.phases)
+        recorder = copied.instrumentation.recorder
+        self.assertEqual(recorder.size, 5)
+        self.assertEqual(recorder.calls(), [])
+        self.assertEqual(copied.instrumentation.after_hooks,
+            [recorder, _after_hook])
+        self.assertEqual(copied.stats(), {})
+        self.assertTrue(copied._transaction.instrumentation is
+            copied.instrumentation)
+        with copied.instrumentation.measure('transaction', 'VOID'):
+            pass
+        self.assertEqual(len(recorder.calls()), 1)
+
+    @mock.patch('authorize.apis.soap.preload')
+    def test_authorize_client_preload(self, preload):
+        self.client.preload()
+        self.assertEqual(preload.call_args,
+            ((self.client._customer.url,), {}))
+        preload.reset_mock()
+        AuthorizeClient('123', '456', backend='json').preload()
+        self.assertEqual(preload.call_count, 0)
+
+    def test_authorize_client_pool(self):
+        client = AuthorizeClient('123', '456', pool_size=3,
+            pool_idle_timeout=5)
+        self.assertTrue(isinstance(client.pool, ConnectionPool))
+        self.assertEqual(client.pool.maxsize, 3)
+        self.assertEqual(client.pool.idle_timeout, 5)
+        with mock.patch.object(client.pool, 'close') as close:
+            client.close()
+            self.assertEqual(close.call_count, 1)
+
+    def test_authorize_client_stats(self):
+        instrumentation = Instrumentation()
+        client = AuthorizeClient('123', '456', instrumentation=instrumentation)
+        self.assertTrue(client.instrumentation is instrumentation)
+        self.assertEqual(client.stats(), {})
+        with instrumentation.measure('transaction', 'AUTH_ONLY'):
+            pass
+        self.assertEqual(client.stats()['transaction']['AUTH_ONLY']['count'],
+            1)
+        self.assertEqual(instrumentation.recorder, None)
+        # Calls are only recorded and logged when a recorder is passed in
+        self.assertEqual(self.client.instrumentation.recorder, None)
+        self.assertEqual(self.client.instrumentation.after_hooks, [])
+        recorder = FlightRecorder()
+        client = AuthorizeClient('123', '456',
+            instrumentation=Instrumentation(recorder=recorder))
+        self.assertEqual(client.instrumentation.after_hooks, [recorder])
+
+    def test_authorize_client_warmup(self):
+        self.assertEqual(self.client.warmup_timings, None)
+        with mock.patch.object(self.client.pool, 'warm') as warm:
+            timings = self.client.warmup(connections=2)
+            self.assertEqual(timings.keys(), ['customer_client',
+                'customer_auth', 'recurring_client', 'recurring_auth',
+                'transaction_connections', 'soap_connections'])
+            self.assertEqual(self.client.warmup_timings, timings)
+            self.assertEqual(warm.call_args_list, [
+                ((self.client._transaction.url, 2), {}),
+                ((self.client._customer.url, 2), {}),
+            ])
+
+            # Connection failures are reported as connection errors
+            warm.side_effect = IOError('Borked')
+            self.assertRaises(AuthorizeConnectionError, self.client.warmup)
+            # So are failures to fetch or parse the WSDL
+            warm.side_effect = TransportError('Not Found', 404)
+            self.assertRaises(AuthorizeConnectionError, self.client.warmup)
+            warm.side_effect = SAXParseException('Borked', None, mock.Mock())
+            self.assertRaises(AuthorizeConnectionError, self.client.warmup)
+            warm.side_effect = ValueError('Borked')
+            self.assertRaises(ValueError, self.client.warmup)
+
+    def test_authorize_client_warmup_background(self):
+        with mock.patch.object(self.client.pool, 'warm') as warm:
+            thread = self.client.warmup(background=True)
+            thread.join()
+            self.assertEqual(warm.call_count, 2)
+            self.assertEqual(len(self.client.warmup_timings), 6)
+
+    @mock.patch('authorize.apis.soap.revalidate')
+    def test_authorize_client_revalidate_wsdl(self, revalidate):
+        result = self.client.revalidate_wsdl()
+        self.assertEqual(result, revalidate.return_value)
+        url, transport = revalidate.call_args[0]
+        self.assertEqual(url, self.client._customer.url)
+        self.assertTrue(transport.pool is self.client.pool)
+
+    def test_authorize_client_json_backend(self):
+        client = AuthorizeClient('123', '456', backend='json')
+        self.assertTrue(isinstance(client._transaction, JSONTransactionAPI))
+        self.assertTrue(isinstance(client._customer, JSONCustomerAPI))
+        self.assertTrue(isinstance(client._recurring, JSONRecurringAPI))
+        for api in (client._transaction, client._customer, client._recurring):
+            self.assertTrue(api.pool is client.pool)
+            self.assertTrue(api.instrumentation is client.instrumentation)
+        with mock.patch.object(client.pool, 'warm') as warm:
+            self.assertEqual(client.warmup(connections=2).keys(),
+                ['json_connections'])
+            self.assertEqual(warm.call_args, ((JSON_TEST_URL, 2), {}))
+        self.assertEqual(client.revalidate_wsdl(), None)
+        self.assertRaises(ValueError, AuthorizeClient, '123', '456',
+            backend='xml')
 
     def test_authorize_client_payment_creators(self):
         self.assertTrue(isinstance(
@@ -96,22 +271,44 @@ class ClientTests(TestCase):
         self.client._transaction.auth.return_value = TRANSACTION_RESULT
         card = AuthorizeCreditCard(self.client, self.credit_card)
         result = card.auth(10)
+        payment = self.client._transaction.encode_payment.return_value
         self.assertEqual(self.client._transaction.auth.call_args,
-            ((10, self.credit_card, None), {}))
+            ((10, self.credit_card, None), {'payment': payment}))
         self.assertTrue(isinstance(result, AuthorizeTransaction))
         self.assertEqual(result.uid, '2171062816')
         self.assertEqual(result.full_response, TRANSACTION_RESULT)
 
+        # The card is only encoded the first time it is charged
+        card.auth(20)
+        self.assertEqual(self.client._transaction.encode_payment.call_args_list,
+            [((self.credit_card, None), {})])
+
+    @mock.patch('authorize.client.last_call')
+    def test_authorize_credit_card_timings(self, last_call):
+        self.client._transaction.capture.return_value = TRANSACTION_RESULT
+        last_call.return_value.phases = {'ttfb': 0.25}
+        result = AuthorizeCreditCard(self.client, self.credit_card).capture(10)
+        self.assertEqual(result.timings, {'ttfb': 0.25})
+        last_call.return_value = None
+        result = AuthorizeCreditCard(self.client, self.credit_card).capture(10)
+        self.assertEqual(result.timings, None)
+
     def test_authorize_credit_card_capture(self):
         self.client._transaction.capture.return_value = TRANSACTION_RESULT
         card = AuthorizeCreditCard(self.client, self.credit_card)
         result = card.capture(10)
+        payment = self.client._transaction.encode_payment.return_value
         self.assertEqual(self.client._transaction.capture.call_args,
-            ((10, self.credit_card, None), {}))
+            ((10, self.credit_card, None), {'payment': payment}))
         self.assertTrue(isinstance(result, AuthorizeTransaction))
         self.assertEqual(result.uid, '2171062816')
         self.assertEqual(result.full_response, TRANSACTION_RESULT)
 
+        # The card is only encoded the first time it is charged
+        card.capture(20)
+        self.assertEqual(self.client._transaction.encode_payment.call_args_list,
+            [((self.credit_card, None), {})])
+
     def test_authorize_credit_card_save(self):
         self.client._customer.create_saved_profile.return_value = ('1', '2')
         card = AuthorizeCreditCard(self.client, self.credit_card)
@@ -153,6 +350,39 @@ class ClientTests(TestCase):
     def test_authorize_transaction_basic(self):
         transaction = AuthorizeTransaction(self.client, '123')
         repr(transaction)
+        self.assertEqual(transaction.full_response, None)
+        self.assertEqual(transaction.timings, None)
+
+    def test_wrappers_immutable(self):
+        wrappers = (
+            (AuthorizeCreditCard(self.client, self.credit_card, self.address),
+                AuthorizeCreditCard(self.client, self.credit_card)),
+            (AuthorizeBankAccount(self.client, self.bank_account),
+                AuthorizeBankAccount(self.client, self.bank_account,
+                    self.address)),
+            (AuthorizeTransaction(self.client, '123'),
+                AuthorizeTransaction(self.client, '124')),
+            (AuthorizeSavedCard(self.client, '1|2'),
+                AuthorizeSavedCard(self.client, '1|3')),
+            (AuthorizeSavedAccount(self.client, '1|2'),
+                AuthorizeSavedAccount(self.client, '1|3')),
+            (AuthorizeRecurring(self.client, '123'),
+                AuthorizeRecurring(self.client, '124')),
+        )
+        for wrapper, other in wrappers:
+            self.assertFalse(hasattr(wrapper, '__dict__'))
+            self.assertRaises(AttributeError, setattr, wrapper, 'uid', '1')
+            self.assertNotEqual(wrapper, other)
+        # Equal on what they identify, whichever client made them
+        client = AuthorizeClient('123', '456')
+        self.assertEqual(AuthorizeTransaction(client, '123'),
+            AuthorizeTransaction(self.client, '123', TRANSACTION_RESULT))
+        self.assertEqual(self.client.saved_card('1|2'),
+            client.saved_card('1|2'))
+        self.assertNotEqual(self.client.saved_card('1|2'),
+            client.saved_check('1|2'))
+        self.assertEqual(len(set([client.card(self.credit_card),
+            self.client.card(self.credit_card)])), 1)
 
     def test_authorize_transaction_settle(self):
         self.client._transaction.settle.return_value = TRANSACTION_RESULT
@@ -266,6 +496,19 @@ class ClientTests(TestCase):
         self.assertEqual(self.client._recurring.update_subscription.call_args,
             (('123',), {'amount': None, 'start': None, 'occurrences': 20,
             'trial_amount': None, 'trial_occurrences': None}))
+        recurring.update(amount='19.99', trial_amount=5)
+        self.assertEqual(self.client._recurring.update_subscription.call_args,
+            (('123',), {'amount': Money('19.99'), 'start': None,
+            'occurrences': None, 'trial_amount': Money(5),
+            'trial_occurrences': None}))
+
+        # Invalid amounts are rejected before anything is sent
+        self.client._recurring.update_subscription.reset_mock()
+        self.assertRaises(AuthorizeInvalidError, recurring.update,
+            amount='19.999')
+        self.assertRaises(AuthorizeInvalidError, recurring.update,
+            trial_amount=-5)
+        self.assertFalse(self.client._recurring.update_subscription.called)
 
     def test_authorize_recurring_delete(self):
         recurring = AuthorizeRecurring(self.client, '123')
@@ -1,10 +1,15 @@
 from datetime import date, datetime, timedelta
+from decimal import Decimal
+import pickle
+import sys
 
+import mock
 from unittest import TestCase
 if not hasattr(TestCase, 'assertIsNotNone'):
     from unittest2 import TestCase
 
-from authorize.data import Address, CreditCard, BankAccount
+from authorize.data import Address, CreditCard, BankAccount, Money, \
+    find_card_type, format_amount
 from authorize.exceptions import AuthorizeInvalidError
 
 
@@ -16,6 +21,12 @@ TEST_CARD_NUMBERS = [
     ('visa', '4007000000027'),
     ('visa', '4012888818888'),
     ('diners', '38000000000006'),
+    ('amex', '340000000000009'),
+    ('mc', '2223000048400011'),
+    ('discover', '6500000000000002'),
+    ('jcb', '3530111333300000'),
+    ('unionpay', '6200000000000005'),
+    ('maestro', '6759649826438453'),
 ]
 
 TEST_BANK_ACCOUNT = {'first_name': "Enoon", 'last_name': 'Erehwon',
@@ -61,6 +72,57 @@ class CreditCardTests(TestCase):
             credit_card = CreditCard(card_number, self.YEAR, 1, '911')
             self.assertEqual(credit_card.card_type, card_type)
 
+    def test_find_card_type(self):
+        self.assertEqual(find_card_type('4111111111111111'), 'visa')
+        # Longer prefixes win over shorter ones
+        self.assertEqual(find_card_type('6011000000000012'), 'discover')
+        self.assertEqual(find_card_type('6304000000000000'), 'maestro')
+        # A known prefix with the wrong length
+        self.assertEqual(find_card_type('411111111111111'), None)
+        self.assertEqual(find_card_type('5105105105105'), None)
+        self.assertEqual(find_card_type('2720990000000000'), 'mc')
+        self.assertEqual(find_card_type('2721000000000000'), None)
+        self.assertEqual(find_card_type('1234567812345670'), None)
+        self.assertEqual(find_card_type(''), None)
+
+    def test_credit_card_derived_fields_cached(self):
+        credit_card = CreditCard('4111111111111111', self.YEAR, 1, '911')
+        with mock.patch('authorize.data.find_card_type') as find_card_type:
+            with mock.patch('calendar.monthrange') as monthrange:
+                self.assertEqual(credit_card.card_type, 'visa')
+                repr(credit_card)
+                credit_card.expiration
+        self.assertEqual(find_card_type.call_count, 0)
+        self.assertEqual(monthrange.call_count, 0)
+
+        # Unpickled cards work them out again
+        copied = pickle.loads(pickle.dumps(credit_card))
+        self.assertEqual(copied.card_type, 'visa')
+        self.assertEqual(copied.expiration, credit_card.expiration)
+
+    def test_credit_card_immutable(self):
+        credit_card = CreditCard('4111111111111111', self.YEAR, 1, '911',
+            'Jeff', 'Schenck')
+        self.assertRaises(AttributeError, setattr, credit_card,
+            'card_number', '5555555555554444')
+        self.assertRaises(AttributeError, delattr, credit_card, 'cvv')
+        self.assertRaises(AttributeError, setattr, credit_card, 'color',
+            'blue')
+        self.assertEqual(credit_card.card_number, '4111111111111111')
+
+        same = CreditCard('4111-1111-1111-1111', self.YEAR, '1', 911,
+            'Jeff', 'Schenck')
+        self.assertEqual(credit_card, same)
+        self.assertFalse(credit_card != same)
+        self.assertEqual(hash(credit_card), hash(same))
+        self.assertNotEqual(credit_card, CreditCard('4111111111111111',
+            self.YEAR, 2, '911', 'Jeff', 'Schenck'))
+        self.assertNotEqual(credit_card, '4111111111111111')
+        self.assertEqual(len(set([credit_card, same])), 1)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(credit_card,
+                protocol)), credit_card)
+
     def test_credit_card_expiration(self):
         credit_card = CreditCard('4111111111111111', self.YEAR, 1, '911')
         self.assertEqual(credit_card.expiration,
@@ -71,6 +133,27 @@ class CreditCardTests(TestCase):
         self.assertEqual(credit_card.safe_number, '************1111')
 
 
+class Plain(object):
+    pass
+
+
+class FootprintTests(TestCase):
+    def test_footprint(self):
+        year = date.today().year + 10
+        objects = (
+            CreditCard('4111111111111111', year, 1, '911', 'Jeff', 'Schenck'),
+            BankAccount(**TEST_BANK_ACCOUNT),
+            Address('45 Rose Ave', 'Venice', 'CA', '90291'),
+        )
+        for value in objects:
+            self.assertFalse(hasattr(value, '__dict__'))
+            # The same fields on an ordinary object, kept in its __dict__
+            plain = Plain()
+            plain.__dict__.update(value.__getstate__())
+            self.assertTrue(sys.getsizeof(value) * 2 <
+                sys.getsizeof(plain) + sys.getsizeof(plain.__dict__))
+
+
 class BankAccountTests(TestCase):
     def setUp(self):
         pass
@@ -84,6 +167,17 @@ class BankAccountTests(TestCase):
                                           account_type='checking')
         repr(bank_account)
 
+    def test_bank_account_immutable(self):
+        bank_account = self._bank_account()
+        self.assertRaises(AttributeError, setattr, bank_account,
+            'account_number', '54321')
+        self.assertEqual(bank_account, self._bank_account())
+        self.assertEqual(hash(bank_account), hash(self._bank_account()))
+        self.assertNotEqual(bank_account,
+            self._bank_account(account_type='savings'))
+        self.assertEqual(pickle.loads(pickle.dumps(bank_account)),
+            bank_account)
+
     def test_individual_savings_account(self):
         bank_account = self._bank_account(customer_type='individual',
                                           account_type='savings')
@@ -222,3 +316,68 @@ class AddressTests(TestCase):
     def test_basic_address(self):
         address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
         repr(address)
+
+    def test_address_immutable(self):
+        address = Address('45 Rose Ave', 'Venice', 'CA', '90291')
+        self.assertRaises(AttributeError, setattr, address, 'city', 'LA')
+        self.assertEqual(address, Address('45 Rose Ave', 'Venice', 'CA',
+            '90291', 'US'))
+        self.assertNotEqual(address, Address('45 Rose Ave', 'Venice', 'CA',
+            '90292'))
+        self.assertEqual({address: 1}[Address('45 Rose Ave', 'Venice', 'CA',
+            '90291')], 1)
+
+
+class MoneyTests(TestCase):
+    def test_basic_money(self):
+        money = Money('20.5')
+        self.assertEqual(money.cents, 2050)
+        self.assertEqual(str(money), '20.50')
+        self.assertEqual(money.amount, Decimal('20.50'))
+        self.assertFalse(hasattr(money, '__dict__'))
+        repr(money)
+
+    def test_money_conversion(self):
+        for amount in (20, 20L, 20.0, '20', ' 20.00 ', u'20', Decimal('20'),
+                Decimal('2E+1'), Money(20), Money.from_cents(2000)):
+            self.assertEqual(Money(amount).cents, 2000)
+        self.assertEqual(Money(0.07).cents, 7)
+        self.assertEqual(Money(1.1).cents, 110)
+        self.assertEqual(str(Money(0)), '0.00')
+        self.assertEqual(str(Money.from_cents(5)), '0.05')
+        self.assertFalse(Money(0))
+        self.assertTrue(Money('0.01'))
+
+    def test_money_validation(self):
+        for amount in ('20.001', 0.1 + 0.2, Decimal('0.005'), -1, '-0.01',
+                'abc', '', float('nan'), float('inf'), Decimal('Infinity'),
+                None, True, [20]):
+            self.assertRaises(AuthorizeInvalidError, Money, amount)
+        self.assertRaises(AuthorizeInvalidError, Money.from_cents, 20.5)
+        self.assertRaises(AuthorizeInvalidError, Money.from_cents, -1)
+
+    def test_money_comparison(self):
+        self.assertEqual(Money(20), Money('20.00'))
+        self.assertNotEqual(Money(20), Money(21))
+        self.assertNotEqual(Money(20), 20)
+        self.assertEqual(len(set([Money(20), Money('20.00')])), 1)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            for money in (Money(20), Money(0)):
+                copied = pickle.loads(pickle.dumps(money, protocol))
+                self.assertEqual(copied, money)
+                self.assertEqual(copied.cents, money.cents)
+
+    def test_money_immutable(self):
+        money = Money(20)
+        self.assertRaises(AttributeError, setattr, money, 'cents', 0)
+        self.assertRaises(AttributeError, delattr, money, 'cents')
+        self.assertEqual(money.cents, 2000)
+
+    def test_format_amount(self):
+        self.assertEqual(format_amount(20), '20.00')
+        self.assertEqual(format_amount(20), '20.00')
+        self.assertEqual(format_amount('19.99'), '19.99')
+        self.assertEqual(format_amount(Money(5)), '5.00')
+        self.assertRaises(AuthorizeInvalidError, format_amount, '19.999')
+        self.assertRaises(AuthorizeInvalidError, format_amount, True)
+        self.assertRaises(AuthorizeInvalidError, format_amount, [1])
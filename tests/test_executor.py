@@ -0,0 +1,120 @@
+import threading
+import time
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize.client import AuthorizeClient
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeResponseError
+from authorize.executor import AuthorizeExecutor
+
+
+class ExecutorTests(TestCase):
+    def setUp(self):
+        self.executor = AuthorizeExecutor(max_workers=2, max_pending=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def blocked(self, value=None):
+        self.release.wait(5)
+        return value
+
+    def test_basic_executor(self):
+        self.assertEqual(self.executor.max_workers, 2)
+        self.assertEqual(self.executor.max_pending, 1)
+        repr(self.executor)
+
+    def test_results_and_exceptions(self):
+        def fail(e):
+            raise e
+        ok = self.executor.submit(lambda x, y=0: x + y, 1, y=2)
+        response = self.executor.submit(fail, AuthorizeResponseError('No'))
+        connection = self.executor.submit(fail, AuthorizeConnectionError('No'))
+        self.assertEqual(ok.result(), 3)
+        self.assertRaises(AuthorizeResponseError, response.result)
+        self.assertRaises(AuthorizeConnectionError, connection.result)
+
+    def test_concurrency(self):
+        executor = AuthorizeExecutor(max_workers=10)
+        start = time.time()
+        futures = [executor.submit(time.sleep, 0.1) for i in range(10)]
+        executor.shutdown()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_backpressure(self):
+        for i in range(3):
+            self.executor.submit(self.blocked)
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (
+            self.executor.submit(self.blocked), submitted.set()))
+        thread.start()
+        self.assertFalse(submitted.wait(0.2))
+        self.release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+
+    def test_drain(self):
+        futures = [self.executor.submit(self.blocked, i) for i in range(3)]
+        self.assertEqual(self.executor.drain(0.1), set(futures))
+        self.release.set()
+        self.assertEqual(self.executor.drain(), set())
+        self.assertEqual([future.result() for future in futures], [0, 1, 2])
+
+    def test_cancel(self):
+        futures = [self.executor.submit(self.blocked) for i in range(3)]
+        time.sleep(0.1)
+        self.assertEqual(self.executor.cancel(), 1)
+        self.assertTrue(futures[2].cancelled())
+        self.release.set()
+        self.assertEqual(self.executor.drain(), set())
+        self.assertFalse(futures[0].cancelled())
+        # The cancelled call freed its slot
+        self.executor.submit(self.blocked)
+
+    def test_context_manager(self):
+        self.release.set()
+        with self.executor as executor:
+            futures = [executor.submit(self.blocked, i) for i in range(3)]
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertRaises(RuntimeError, self.executor.submit, self.blocked)
+
+    def test_context_manager_cancels_on_error(self):
+        futures = []
+        try:
+            with self.executor as executor:
+                futures = [executor.submit(self.blocked) for i in range(3)]
+                time.sleep(0.1)
+                threading.Timer(0.1, self.release.set).start()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(futures[2].cancelled())
+        self.assertTrue(futures[0].done())
+
+
+@mock.patch('authorize.client.CustomerAPI')
+@mock.patch('authorize.client.RecurringAPI')
+@mock.patch('authorize.client.TransactionAPI')
+class ClientExecutorTests(TestCase):
+    def test_client_executor(self, *apis):
+        client = AuthorizeClient('123', '456', pool_size=4)
+        executor = client.executor(max_workers=8, max_pending=100)
+        self.assertTrue(isinstance(executor, AuthorizeExecutor))
+        self.assertEqual(executor.max_workers, 8)
+        self.assertEqual(executor.max_pending, 100)
+        self.assertEqual(client.pool.maxsize, 8)
+        client._transaction.settle.return_value = {'transaction_id': '9'}
+        with executor:
+            futures = [executor.submit(client.transaction(str(i)).settle)
+                for i in range(5)]
+        self.assertEqual(client._transaction.settle.call_count, 5)
+        self.assertEqual(futures[0].result().uid, '9')
+        client.executor(max_workers=2).shutdown()
+        self.assertEqual(client.pool.maxsize, 8)
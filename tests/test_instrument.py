@@ -0,0 +1,158 @@
+from cStringIO import StringIO
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize.apis.transaction import TransactionAPI
+from authorize.exceptions import AuthorizeConnectionError, \
+    AuthorizeResponseError
+from authorize.instrument import PHASES, Instrumentation, \
+    LatencyHistogram, current_call, lap, last_call, measure
+
+
+class LatencyHistogramTests(TestCase):
+    def test_buckets(self):
+        # Every latency falls in a bucket no wider than 1/32 of it
+        previous = -1
+        for microseconds in range(0, 70000, 7):
+            bucket = LatencyHistogram._bucket(microseconds)
+            highest = LatencyHistogram._highest(bucket)
+            self.assertTrue(microseconds <= highest)
+            self.assertTrue(highest - microseconds <= microseconds // 32)
+            self.assertTrue(bucket >= previous)
+            previous = bucket
+
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        for milliseconds in range(1, 1001):
+            histogram.record(milliseconds / 1000.0)
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.total, 500.5)
+        self.assertEqual(histogram.max, 1.0)
+        for percent, expected in ((50, 0.5), (90, 0.9), (99, 0.99)):
+            self.assertTrue(abs(histogram.percentile(percent) - expected)
+                <= expected / 32)
+        self.assertEqual(histogram.percentile(100), 1.0)
+        self.assertEqual(histogram.cumulative((0.01, 0.1, 2.0))[2], 1000)
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+
+    def test_measure(self):
+        with self.instrumentation.measure('transaction', 'AUTH_ONLY') as call:
+            self.assertTrue(current_call() is call)
+            call.bytes_sent += 10
+            call.bytes_received += 20
+        self.assertEqual(current_call(), None)
+        self.assertEqual(call.outcome, 'ok')
+        self.assertTrue(call.duration >= 0)
+        for error, outcome in ((AuthorizeResponseError, 'response_error'),
+                (AuthorizeConnectionError, 'connection_error'),
+                (KeyError, 'error')):
+            with self.assertRaises(error):
+                with self.instrumentation.measure('transaction', 'VOID') \
+                        as call:
+                    raise error('Borked')
+            self.assertEqual(call.outcome, outcome)
+            self.assertTrue(isinstance(call.error, error))
+        stats = self.instrumentation.stats()
+        auth = stats['transaction']['AUTH_ONLY']
+        self.assertEqual(auth['count'], 1)
+        self.assertEqual(auth['outcomes']['ok'], 1)
+        self.assertEqual((auth['bytes_sent'], auth['bytes_received']),
+            (10, 20))
+        for name in ('mean', 'max', 'p50', 'p90', 'p99', 'p99.9'):
+            self.assertTrue(auth[name] >= 0)
+        self.assertEqual(stats['transaction']['VOID']['outcomes'], {
+            'ok': 0, 'response_error': 1, 'connection_error': 1, 'error': 1})
+        self.instrumentation.reset()
+        self.assertEqual(self.instrumentation.stats(), {})
+
+    def test_measure_none(self):
+        with measure(None, 'transaction', 'VOID') as call:
+            self.assertEqual(call, None)
+            self.assertEqual(current_call(), None)
+
+    def test_hooks(self):
+        calls = []
+        self.instrumentation.add_hook(
+            before=lambda call: calls.append(('before', call.outcome)),
+            after=lambda call: calls.append(('after', call.outcome)))
+        self.instrumentation.add_hook(after=lambda call: 1 / 0)
+        with self.instrumentation.measure('recurring', 'ARBCreateSubscription'):
+            pass
+        self.assertEqual(calls, [('before', None), ('after', 'ok')])
+
+    def test_prometheus(self):
+        with self.instrumentation.measure('transaction', 'AUTH_ONLY') as call:
+            call.bytes_sent += 10
+        lines = self.instrumentation.prometheus().splitlines()
+        labels = 'api="transaction",operation="AUTH_ONLY"'
+        self.assertTrue('# TYPE authorize_call_duration_seconds histogram'
+            in lines)
+        self.assertTrue('authorize_call_duration_seconds_bucket{{{0},le="30.0"}'
+            '} 1'.format(labels) in lines)
+        self.assertTrue('authorize_call_duration_seconds_bucket{{{0},le="+Inf"'
+            '}} 1'.format(labels) in lines)
+        self.assertTrue('authorize_call_duration_seconds_count{{{0}}} 1'
+            .format(labels) in lines)
+        self.assertTrue('authorize_calls_total{{{0},outcome="ok"}} 1'.format(
+            labels) in lines)
+        self.assertTrue('authorize_bytes_sent_total{{{0}}} 10'.format(labels)
+            in lines)
+
+    def test_phases(self):
+        with self.instrumentation.measure('transaction', 'VOID') as call:
+            lap('ttfb')
+        self.assertEqual(call.phases, None)
+        self.assertTrue(last_call() is call)
+        self.assertFalse('phases' in self.instrumentation.stats()
+            ['transaction']['VOID'])
+
+        instrumentation = Instrumentation(phases=True)
+        for i in range(2):
+            with instrumentation.measure('transaction', 'VOID') as call:
+                lap('serialize')
+                lap('ttfb')
+        self.assertEqual(sorted(call.phases), ['parse', 'serialize', 'ttfb'])
+        phases = instrumentation.stats()['transaction']['VOID']['phases']
+        self.assertEqual(sorted(phases), sorted(PHASES))
+        self.assertEqual(phases['tls'], 0.0)
+        self.assertTrue('authorize_call_phase_seconds_total{api="transaction",'
+            'operation="VOID",phase="tls"} 0.0' in
+            instrumentation.prometheus().splitlines())
+        self.assertFalse('phase' in self.instrumentation.prometheus())
+
+    def test_fork(self):
+        with self.instrumentation.measure('transaction', 'VOID'):
+            pass
+        self.instrumentation._pid = -1
+        self.assertEqual(self.instrumentation.stats(), {})
+
+class APIInstrumentationTests(TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.api = TransactionAPI('123', '456',
+            instrumentation=self.instrumentation)
+        self.urlopen = mock.patch.object(self.api.pool, 'urlopen').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_transaction_api(self):
+        self.urlopen.return_value = StringIO('1;1;1;Approved.;A;Y;9')
+        self.api.void('9')
+        self.urlopen.return_value = StringIO('2;1;2;Declined.;A;Y;9')
+        self.assertRaises(AuthorizeResponseError, self.api.void, '9')
+        self.urlopen.side_effect = IOError('Borked')
+        self.assertRaises(AuthorizeConnectionError, self.api.auth, 20,
+            None, payment='x_card_num=4111111111111111')
+        stats = self.instrumentation.stats()['transaction']
+        self.assertEqual(stats['VOID']['count'], 2)
+        self.assertEqual(stats['VOID']['outcomes']['response_error'], 1)
+        self.assertEqual(stats['AUTH_ONLY']['outcomes']['connection_error'],
+            1)
@@ -0,0 +1,178 @@
+from datetime import date
+import json
+
+import mock
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+
+from authorize.apis.jsonapi import JSONTransactionAPI
+from authorize.apis.transaction import TransactionAPI
+from authorize.data import CreditCard
+from authorize.exceptions import AuthorizeConnectionError
+from authorize.instrument import Call, Instrumentation
+from authorize.recorder import FlightRecorder, redact
+
+
+CREDIT_CARD = CreditCard('4111111111111111', date.today().year + 10, 1,
+    '911', 'Jeff', 'Schenck')
+
+
+class RedactTests(TestCase):
+    def test_query_string(self):
+        self.assertEqual(redact('https://test.authorize.net/gateway/'
+            'transact.dll?x_login=123&x_tran_key=8Jx5%2Bq&x_type=AUTH_ONLY'
+            '&x_card_num=4111111111111111&x_card_code=911&x_amount=20.00'),
+            'https://test.authorize.net/gateway/transact.dll?x_login=123'
+            '&x_tran_key=********&x_type=AUTH_ONLY'
+            '&x_card_num=************1111&x_card_code=***&x_amount=20.00')
+
+    def test_soap(self):
+        self.assertEqual(redact('<ns1:merchantAuthentication><ns1:name>123'
+            '</ns1:name><ns1:transactionKey>456</ns1:transactionKey>'
+            '<bankAccount><routingNumber>211073473</routingNumber>'
+            '<accountNumber>1234567890</accountNumber></bankAccount>'
+            '<cardCode>1234</cardCode>'),
+            '<ns1:merchantAuthentication><ns1:name>123</ns1:name>'
+            '<ns1:transactionKey>***</ns1:transactionKey><bankAccount>'
+            '<routingNumber>211073473</routingNumber><accountNumber>'
+            '******7890</accountNumber></bankAccount><cardCode>****'
+            '</cardCode>')
+
+    def test_json(self):
+        self.assertEqual(redact('{"transactionKey": "456", '
+            '"cardNumber":"4111111111111111","cardCode":"911"}'),
+            '{"transactionKey": "***", "cardNumber":"************1111",'
+            '"cardCode":"***"}')
+
+    def test_card_numbers(self):
+        # Card numbers are masked wherever they turn up, other numbers kept
+        self.assertEqual(redact('Card 4111111111111111 declined in '
+            'transaction 2171062816 of batch 123456789012345678901'),
+            'Card ************1111 declined in transaction 2171062816 of '
+            'batch 123456789012345678901')
+
+    def test_card_numbers_in_other_fields(self):
+        self.assertEqual(redact('x_description=card+4111111111111111'
+            '&x_amount=20.00'),
+            'x_description=card+************1111&x_amount=20.00')
+        self.assertEqual(redact('<cardNumber xsi:type="xsd:string">'
+            '4111111111111111</cardNumber>'),
+            '<cardNumber xsi:type="xsd:string">************1111'
+            '</cardNumber>')
+
+class FlightRecorderTests(TestCase):
+    def setUp(self):
+        self.recorder = FlightRecorder(size=2, slow_threshold=1.0)
+        self.log = mock.patch('authorize.recorder.log').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def call(self, operation, duration=0.1, outcome='ok', error=None):
+        call = Call('transaction', operation, phases=True)
+        call.duration, call.outcome, call.error = duration, outcome, error
+        call.phases = {'ttfb': duration}
+        call.request = 'x_type={0}&x_card_num=4111111111111111'.format(
+            operation)
+        self.recorder(call)
+        return call
+
+    def test_ring_buffer(self):
+        for operation in ('AUTH_ONLY', 'PRIOR_AUTH_CAPTURE', 'VOID'):
+            self.call(operation)
+        records = self.recorder.calls()
+        self.assertEqual([record.operation for record in records],
+            ['PRIOR_AUTH_CAPTURE', 'VOID'])
+        self.assertEqual(records[1].request,
+            'x_type=VOID&x_card_num=************1111')
+        self.assertEqual(records[1].phases, {'ttfb': 0.1})
+        lines = self.recorder.dump().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(' transaction VOID ok 0.100s sent=0 received=0 '
+            'ttfb=0.100 request=x_type=VOID' in lines[1])
+        self.assertEqual(self.log.warning.call_count, 0)
+        self.assertEqual(self.log.error.call_count, 0)
+        self.recorder.clear()
+        self.assertEqual(self.recorder.calls(), [])
+
+    def test_slow_call(self):
+        self.call('AUTH_ONLY', duration=1.5)
+        self.assertEqual(self.log.warning.call_count, 1)
+        self.assertEqual(self.log.warning.call_args[0][1].operation,
+            'AUTH_ONLY')
+        self.recorder.slow_threshold = None
+        self.call('AUTH_ONLY', duration=1.5)
+        self.assertEqual(self.log.warning.call_count, 1)
+
+    def test_request_card_numbers(self):
+        call = Call('transaction', 'AUTH_ONLY')
+        call.duration, call.outcome = 1.5, 'ok'
+        call.request = 'x_type=AUTH_ONLY&x_description=4111111111111111'
+        self.recorder(call)
+        self.assertEqual(self.recorder.calls()[0].request,
+            'x_type=AUTH_ONLY&x_description=************1111')
+        self.assertFalse('4111111111111111' in
+            str(self.log.warning.call_args[0][1]))
+
+    def test_connection_error(self):
+        self.call('AUTH_ONLY')
+        self.call('VOID', outcome='connection_error', error=IOError(
+            'Failed sending x_card_num=4111111111111111'))
+        self.assertEqual(self.log.error.call_count, 1)
+        count, dump = self.log.error.call_args[0][1:]
+        self.assertEqual(count, 2)
+        self.assertTrue('error=Failed sending x_card_num=************1111'
+            in dump)
+        self.assertFalse('4111111111111111' in dump)
+
+    def test_fork(self):
+        self.call('AUTH_ONLY')
+        self.recorder._pid = -1
+        self.assertEqual(self.recorder.calls(), [])
+
+class RecordedCallTests(TestCase):
+    def setUp(self):
+        self.recorder = FlightRecorder()
+        self.instrumentation = Instrumentation(recorder=self.recorder)
+        self.log = mock.patch('authorize.recorder.log').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_transaction_api(self):
+        api = TransactionAPI('123', 'SECRETKEY',
+            instrumentation=self.instrumentation)
+        with mock.patch.object(api.pool, '_get', side_effect=IOError(
+                'Borked')):
+            self.assertRaises(AuthorizeConnectionError, api.auth, 20,
+                CREDIT_CARD)
+        record, = self.recorder.calls()
+        self.assertEqual((record.operation, record.outcome),
+            ('AUTH_ONLY', 'connection_error'))
+        self.assertTrue('x_card_num=************1111' in record.request)
+        self.assertTrue('x_tran_key=*********' in record.request)
+        self.assertFalse('911' in record.request)
+        self.assertEqual(self.log.error.call_count, 1)
+
+    def test_json_api(self):
+        api = JSONTransactionAPI('123', 'SECRETKEY',
+            instrumentation=self.instrumentation)
+        with mock.patch.object(api.pool, '_get', side_effect=IOError(
+                'Borked')):
+            self.assertRaises(AuthorizeConnectionError, api.capture, 20,
+                CREDIT_CARD)
+        request = json.loads(self.recorder.calls()[0].request)
+        request = request['createTransactionRequest']
+        self.assertEqual(request['merchantAuthentication']['transactionKey'],
+            '*********')
+        card = request['transactionRequest']['payment']['creditCard']
+        self.assertEqual(card['cardNumber'], '************1111')
+        self.assertEqual(card['cardCode'], '***')
+
+    def test_request_cleared(self):
+        with self.instrumentation.measure('transaction', 'VOID') as call:
+            call.request = 'x_card_num=4111111111111111'
+        self.assertEqual(call.request, None)
+        self.assertEqual(self.recorder.calls()[0].request,
+            'x_card_num=************1111')
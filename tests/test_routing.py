@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+if not hasattr(TestCase, 'assertIsNotNone'):
+    from unittest2 import TestCase
+from test_data import TEST_BANK_ACCOUNT
+
+from authorize import routing
+from authorize.data import BankAccount
+from authorize.exceptions import AuthorizeInvalidError
+from authorize.routing import RoutingDirectory, RoutingInfo, \
+    build_directory
+
+
+def entry(routing_number, name, city, state, zip_code, record_type='1',
+        new_routing_number='000000000'):
+    # A line of the FedACH directory
+    return ''.join((routing_number, 'O', '011000015', record_type, '010119',
+        new_routing_number, name.ljust(36), '1 MAIN ST'.ljust(36),
+        city.ljust(20), state, zip_code, '0000', '2125551212', '1', '1',
+        ' ' * 5))
+
+DIRECTORY = '\r\n'.join((
+    entry('211073473', 'KNAB BANK', 'BOSTON', 'MA', '02110'),
+    entry('011000015', 'FEDERAL RESERVE BANK', 'BOSTON', 'MA', '02106'),
+    entry('111050295', 'OLD BANK', 'DALLAS', 'TX', '75201', '2', '211073473'),
+    '',
+))
+
+
+class RoutingDirectoryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = self.write_directory(DIRECTORY)
+        self.routing = RoutingDirectory(self.path)
+
+    def tearDown(self):
+        self.routing.close()
+        routing._directory = None
+        shutil.rmtree(self.directory)
+
+    def write_directory(self, lines):
+        source = os.path.join(self.directory, 'FedACHdir.txt')
+        with open(source, 'wb') as f:
+            f.write(lines)
+        path = os.path.join(self.directory, 'routing.idx')
+        build_directory(source, path)
+        return path
+
+    def test_lookup(self):
+        self.assertEqual(len(self.routing), 3)
+        self.assertEqual(self.routing.lookup('211073473'), RoutingInfo(
+            '211073473', u'KNAB BANK', u'BOSTON', 'MA', '02110', None))
+        self.assertEqual(self.routing.lookup('011000015').name,
+            u'FEDERAL RESERVE BANK')
+        self.assertEqual(self.routing.lookup('111050295').new_routing_number,
+            '211073473')
+        for routing_number in ('211073472', '000000000', '999999999',
+                '21107347', 'ABCDEFGHI'):
+            self.assertEqual(self.routing.lookup(routing_number), None)
+
+    def test_lookup_all(self):
+        results = self.routing.lookup_all(iter(['211073473', '123',
+            '011000015', '211073472', '211073473']))
+        self.assertEqual([result and result.routing_number
+            for result in results],
+            ['211073473', None, '011000015', None, '211073473'])
+        self.assertEqual(routing.lookup_all(['211073473']), [None])
+        routing.load(self.path).close()
+
+    def test_build_directory_errors(self):
+        for lines in (
+                entry('211073473', 'A', 'B', 'MA', '02110') + '\n' +
+                entry('211073473', 'C', 'D', 'MA', '02110'),
+                entry('21107347X', 'A', 'B', 'MA', '02110'),
+                entry('211073473', 'A', 'B', 'MA', '02110')[:100],
+                entry('111050295', 'A', 'B', 'TX', '75201', '2', ' ' * 9)):
+            self.assertRaises(ValueError, self.write_directory, lines)
+
+    def test_bank_account(self):
+        # Only the checksum is checked without a directory
+        BankAccount(**dict(TEST_BANK_ACCOUNT, routing_number='011000028'))
+        bank_account = BankAccount(**TEST_BANK_ACCOUNT)
+        self.assertEqual(bank_account.routing_info, None)
+
+        routing.load(self.path)
+        bank_account = BankAccount(**dict(TEST_BANK_ACCOUNT, bank_name=''))
+        self.assertEqual(bank_account.bank_name, u'KNAB BANK')
+        self.assertEqual(bank_account.routing_info.city, u'BOSTON')
+        bank_account = BankAccount(**TEST_BANK_ACCOUNT)
+        self.assertEqual(bank_account.bank_name,
+            TEST_BANK_ACCOUNT['bank_name'])
+        self.assertRaises(AuthorizeInvalidError, BankAccount,
+            **dict(TEST_BANK_ACCOUNT, routing_number='011000028'))
+        # Other kinds of routing number are not in the directory
+        BankAccount(**dict(TEST_BANK_ACCOUNT, routing_number='011000028',
+            routing_number_type='SWIFT'))
+        routing.loaded().close()